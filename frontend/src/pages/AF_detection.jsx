@@ -19,6 +19,7 @@ export default function AFDetection({ user }) {
   const [loading, setLoading] = useState(false);
   const [showModal, setShowModal] = useState(false);
   const [rrFeatures, setRrFeatures] = useState(null);
+  const [model, setModel] = useState(null);
   const [errorMsg, setErrorMsg] = useState("");
   const [successMsg, setSuccessMsg] = useState("");
 
@@ -78,6 +79,7 @@ export default function AFDetection({ user }) {
       });
       if (!response.ok) throw new Error("API error");
       const data = await response.json();
+      setModel({ name: data.model, threshold: data.threshold });
 
       if (data.rr_features) {
         const rid = Object.keys(data.rr_features)[0];
@@ -102,7 +104,7 @@ export default function AFDetection({ user }) {
         : ridRaw || null;
       setRecordId(rid);
 
-      const anyHigh = probs.some((p) => p >= 0.65);
+      const anyHigh = probs.some((p) => p >= (data.threshold ?? 0.65));
       setDecision(anyHigh ? "Yes" : "No");
       if (anyHigh) setShowModal(true);
     } catch (err) {
@@ -157,6 +159,8 @@ export default function AFDetection({ user }) {
       decision,
       prob_af: Math.round(probabilities.reduce((a, b) => a + b, 0) / probabilities.length),
       rr_features: rrFeatures,
+      model: model?.name,
+      threshold: model?.threshold,
       timestamp: new Date().toLocaleString()
     };
 
@@ -18,6 +18,7 @@ export default function UploadAnalysis({ user }) {
   const [showModal, setShowModal] = useState(false);
   const [loading, setLoading] = useState(false);
   const [rrFeatures, setRrFeatures] = useState(null);
+  const [model, setModel] = useState(null);
   const [errorMsg, setErrorMsg] = useState("");
   const [successMsg, setSuccessMsg] = useState("");
 
@@ -82,6 +83,7 @@ export default function UploadAnalysis({ user }) {
       if (!response.ok) throw new Error("API error");
 
       const data = await response.json();
+      setModel({ name: data.model, threshold: data.threshold });
 
       const rid = data.record_id?.[0] || null;
       if (rid) {
@@ -102,7 +104,7 @@ export default function UploadAnalysis({ user }) {
         const probPercent = Math.round(p75 * 100);
         setProbability(probPercent);
 
-        if (p75 >= 0.53) setRisk("Risky");
+        if (p75 >= (data.threshold ?? 0.53)) setRisk("Risky");
         else setRisk("Safe");
       } else {
         setProbability(null);
@@ -155,6 +157,8 @@ export default function UploadAnalysis({ user }) {
       decision: risk,
       prob_af: probability,
       rr_features: rrFeatures,
+      model: model?.name,
+      threshold: model?.threshold,
       timestamp: new Date().toLocaleString()
     };
 
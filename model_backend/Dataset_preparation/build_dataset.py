@@ -0,0 +1,346 @@
+"""
+Offline training dataset builder: Records/ + metadata.csv -> a feature store of labelled windows,
+replacing the hand-made ../Dataset/raw_RRI_segments.csv + row-wise PSR in the training notebooks.
+
+Each selected record is loaded + cleaned through Record (the same cleaning as the server), cut
+into the server's windows (50 beats, step 5) and written into memory-mappable .npy shards:
+    <out>/shard-00000/raw.npy          (n, 50)  float32  RR windows (ms), the r_0..r_49 columns
+    <out>/shard-00000/psr.npy          (n, 138) float32  PSR embedding (m=3, tau=2)
+    <out>/shard-00000/label.npy        (n,)     int8     0 = SR, 1 = pre-AF, 2 = AF
+    <out>/shard-00000/af_fraction.npy  (n,)     float32  share of AF beats in the window
+    <out>/index.csv                    one row per record: patient_id, rows start:stop of its shard, class counts
+    <out>/manifest.json                build parameters
+Labels come from the record's rr_labels.csv (Record.rr_label_intervals):
+    AF      af_fraction >= --af-threshold
+    pre-AF  otherwise, when an AF episode starts inside the window or within --pre-af-minutes after its last beat
+    SR      the rest
+
+Records are built in parallel (--workers), each worker writing its rows straight into the shard.
+Re-running on the same --out is incremental: unchanged records (same RR / label file names, sizes
+and mtimes) are kept, new or changed ones go into a new shard, records that are gone or filtered
+out are dropped from the index. Other build parameters, or --rebuild, start the store over.
+index.csv is written last: shards it does not reference (left by an interrupted build, or whose
+records were all dropped / rebuilt) are deleted on the next run. Rows of a dropped or rebuilt
+record in a shard that still holds other records stay on disk, unreferenced, until --rebuild.
+By default only the records in save_files/filtered_records.npy are built (--no-filter: all of
+them); --exclude-flag drops records flagged in save_files/af_filter_flags.npy.
+
+Run from model_backend/:
+    python -m Dataset_preparation.build_dataset --records Records --out Dataset/feature_store --workers 8
+
+Training:
+    store = FeatureStore("Dataset/feature_store")
+    X, y, groups = store.load("psr"), store.load("label"), store.groups("patient_id")
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from Dataset_preparation.metadata import DEFAULT_METADATA_PATH, MetadataIndex
+from Dataset_preparation.record import Record, RecordFiles
+from model_utils import build_psr_windows, count_windows
+from preprocess_cache import CLEANING_VERSION
+
+SAVE_FILES_DIR = Path(__file__).resolve().parent / "save_files"
+LABEL_NAMES = ("SR", "pre-AF", "AF")
+INDEX_COLUMNS = ["record_id", "patient_id", "shard", "start", "stop", "n_sr", "n_pre_af", "n_af", "source"]
+
+
+@dataclass(frozen=True)
+class BuildParams:
+    window_size: int = 50
+    step_size: int = 5
+    m: int = 3
+    tau: int = 2
+    af_threshold: float = 0.5
+    pre_af_minutes: float = 90.0
+    cleaning: str = CLEANING_VERSION.decode()
+
+    @property
+    def arrays(self):
+        """name -> (row shape, dtype) of every per-window array in a shard."""
+        psr_width = (self.window_size - (self.m - 1) * self.tau) * self.m
+        return {
+            "raw": ((self.window_size,), np.float32),
+            "psr": ((psr_width,), np.float32),
+            "label": ((), np.int8),
+            "af_fraction": ((), np.float32),
+        }
+
+
+def window_labels(rr, intervals, params):
+    """(label, af_fraction) of every window build_psr_windows cuts from rr (see module docstring)."""
+    n_windows = count_windows(len(rr), params.window_size, params.step_size)
+    af_fraction = intervals.window_fraction(n_windows, params.window_size, params.step_size)
+
+    starts = np.arange(n_windows, dtype=np.int64) * params.step_size
+    last_beat = np.minimum(starts + params.window_size, len(rr)) - 1
+    elapsed_ms = np.cumsum(rr)
+    onsets = np.asarray(intervals.starts, dtype=np.int64)
+    # an onset beat starts where the beat before it ends
+    onset_ms = elapsed_ms[onsets] - rr[onsets]
+    # first onset at or after the window start: one inside the window gives minutes_to_onset <= 0
+    next_onset = np.searchsorted(onsets, starts, side="left")
+    has_onset = next_onset < len(onsets)
+    minutes_to_onset = np.full(n_windows, np.inf)
+    minutes_to_onset[has_onset] = (onset_ms[next_onset[has_onset]] - elapsed_ms[last_beat[has_onset]]) / 60000.0
+
+    labels = np.where(
+        af_fraction >= params.af_threshold, 2, np.where(minutes_to_onset <= params.pre_af_minutes, 1, 0)
+    ).astype(np.int8)
+    return labels, af_fraction.astype(np.float32)
+
+
+def record_windows(record, params):
+    """All per-window arrays of one record, keyed like BuildParams.arrays."""
+    rr = record.load_rr()
+    intervals = record.rr_label_intervals()
+    raw, _ = build_psr_windows([rr], params.window_size, params.step_size, m=1, tau=1)
+    psr, _ = build_psr_windows([rr], params.window_size, params.step_size, params.m, params.tau)
+    labels, af_fraction = window_labels(rr, intervals, params)
+    return {"raw": raw, "psr": psr, "label": labels, "af_fraction": af_fraction}
+
+
+def _build_record(record_folder, files, shard_dir, offset, params):
+    """Worker: windows of one record written to rows offset.. of the shard; returns (rows, class counts)."""
+    record = Record(record_folder, metadata_record=None, files=files)
+    arrays = record_windows(record, params)
+    n = len(arrays["label"])
+    for name, values in arrays.items():
+        out = np.lib.format.open_memmap(Path(shard_dir) / f"{name}.npy", mode="r+")
+        out[offset:offset + n] = values
+        out.flush()
+        del out
+    counts = np.bincount(arrays["label"], minlength=len(LABEL_NAMES))
+    return n, counts
+
+
+def _build_records(args, workers):
+    """(record_id, (rows, class counts) or the exception) per record, as they finish."""
+    if workers <= 1:
+        for a in args:
+            try:
+                yield Path(a[0]).name, _build_record(*a)
+            except Exception as e:
+                yield Path(a[0]).name, e
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_build_record, *a): Path(a[0]).name for a in args}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def source_signature(files: RecordFiles) -> str:
+    """Changes when an RR or RR label file of the record is replaced (name, size, mtime)."""
+    hasher = hashlib.blake2b(digest_size=12)
+    for path in files.rr + files.rr_labels:
+        stat = os.stat(path)
+        hasher.update(f"{Path(path).name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return hasher.hexdigest()
+
+
+def load_record_filter(save_dir=SAVE_FILES_DIR, exclude_flags=()):
+    """Record ids allowed by save_files: filtered_records.npy minus records with any of exclude_flags set."""
+    allowed = set(np.load(Path(save_dir) / "filtered_records.npy").tolist())
+    if exclude_flags:
+        flags = np.load(Path(save_dir) / "af_filter_flags.npy", allow_pickle=True)
+        unknown = set(exclude_flags) - set(flags[0]) if len(flags) else set()
+        if unknown:
+            raise ValueError(f"Unknown filter flags: {', '.join(sorted(unknown))}")
+        allowed -= {entry["record_id"] for entry in flags if any(entry[flag] for flag in exclude_flags)}
+    return allowed
+
+
+class FeatureStore:
+    """Read side of a built store: per-record index + memory-mapped shard arrays."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / "manifest.json").read_text())
+        self.params = BuildParams(**self.manifest["params"])
+        self.index = pd.read_csv(
+            self.path / "index.csv", dtype={"record_id": str, "patient_id": str, "source": str},
+            keep_default_na=False,
+        )
+
+    def __len__(self):
+        return int((self.index["stop"] - self.index["start"]).sum())
+
+    def array(self, name, shard) -> np.ndarray:
+        return np.load(self.path / f"shard-{shard:05d}" / f"{name}.npy", mmap_mode="r")
+
+    def _rows(self, record_ids):
+        if record_ids is None:
+            return self.index
+        return self.index[self.index["record_id"].isin(set(record_ids))]
+
+    def load(self, name, record_ids=None) -> np.ndarray:
+        """Rows of the given records (default: all), in index order, copied out of the memmaps."""
+        rows = self._rows(record_ids)
+        shape, dtype = self.params.arrays[name]
+        out = np.empty((int((rows["stop"] - rows["start"]).sum()),) + shape, dtype=dtype)
+        position = 0
+        for shard, group in rows.groupby("shard", sort=False):
+            data = self.array(name, shard)
+            for start, stop in zip(group["start"], group["stop"]):
+                out[position:position + stop - start] = data[start:stop]
+                position += stop - start
+        return out
+
+    def groups(self, column="patient_id", record_ids=None) -> np.ndarray:
+        """Per-row value of an index column (e.g. patient_id for grouped splits), aligned with load()."""
+        rows = self._rows(record_ids)
+        return np.repeat(rows[column].to_numpy(), (rows["stop"] - rows["start"]).to_numpy())
+
+
+def _write_atomic(path, text):
+    tmp_path = Path(f"{path}.tmp")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+def _reset_store(out_dir):
+    for shard_dir in out_dir.glob("shard-*"):
+        shutil.rmtree(shard_dir)
+    for name in ("index.csv", "manifest.json"):
+        (out_dir / name).unlink(missing_ok=True)
+
+
+def _remove_unindexed_shards(out_dir, index):
+    """Delete the shard folders no row of index points to."""
+    indexed = {f"shard-{shard:05d}" for shard in index["shard"].astype(int)}
+    for shard_dir in out_dir.glob("shard-*"):
+        if shard_dir.name not in indexed:
+            shutil.rmtree(shard_dir)
+
+
+def build_dataset(records_dir, out_dir, params=BuildParams(), metadata=None, allowed=None,
+                  workers=1, rebuild=False, log=print):
+    """
+    Build or update the store in out_dir from the record folders in records_dir.
+    - metadata: MetadataIndex for patient ids (records missing from it get an empty patient_id)
+    - allowed: record ids to build (None: every record folder)
+    Returns {"kept", "built", "dropped", "failed"} record counts; dropped are the records removed
+    from the index (gone or filtered out), changed records count as built.
+    """
+    records_dir, out_dir = Path(records_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    index = pd.DataFrame(columns=INDEX_COLUMNS)
+    if not rebuild and (out_dir / "manifest.json").exists():
+        store = FeatureStore(out_dir)
+        if store.params == params:
+            index = store.index
+        else:
+            log("[build_dataset] build parameters changed: rebuilding the store")
+            rebuild = True
+    if rebuild:
+        _reset_store(out_dir)
+    else:
+        _remove_unindexed_shards(out_dir, index)
+    # past every indexed shard, also those whose records are all rebuilt below
+    shard = int(index["shard"].max()) + 1 if len(index) else 0
+
+    folders = {
+        folder.name: RecordFiles.from_folder(folder)
+        for folder in sorted(records_dir.iterdir())
+        if folder.is_dir() and (allowed is None or folder.name in allowed)
+    }
+    sources = {record_id: source_signature(files) for record_id, files in folders.items() if files.rr}
+    unchanged = (index["record_id"].map(sources) == index["source"]).to_numpy(dtype=bool)
+    dropped = int((~index["record_id"].isin(set(sources))).sum())
+    index = index[unchanged]
+    to_build = [record_id for record_id in sources if record_id not in set(index["record_id"])]
+
+    failed = []
+    # rows per record from the HDF5 shapes, so workers can write into preallocated shards
+    offsets, total = {}, 0
+    for record_id in to_build:
+        try:
+            n_beats = sum(Record(records_dir / record_id, files=folders[record_id]).rr_lengths())
+        except Exception as e:
+            failed.append(record_id)
+            log(f"[build_dataset] SKIP {record_id}: {type(e).__name__}: {e}")
+            continue
+        offsets[record_id] = (total, count_windows(n_beats, params.window_size, params.step_size))
+        total += offsets[record_id][1]
+
+    new_rows = []
+    if offsets:
+        shard_dir = out_dir / f"shard-{shard:05d}"
+        shard_dir.mkdir()
+        for name, (shape, dtype) in params.arrays.items():
+            np.lib.format.open_memmap(shard_dir / f"{name}.npy", mode="w+", dtype=dtype, shape=(total,) + shape)
+
+        t0 = time.perf_counter()
+        args = [
+            (records_dir / record_id, folders[record_id], shard_dir, offset, params)
+            for record_id, (offset, _) in offsets.items()
+        ]
+        for record_id, result in _build_records(args, workers):
+            if isinstance(result, Exception):
+                failed.append(record_id)
+                log(f"[build_dataset] SKIP {record_id}: {type(result).__name__}: {result}")
+                continue
+            n, counts = result
+            start = offsets[record_id][0]
+            patient_id = metadata.get(record_id).patient_id if metadata is not None and record_id in metadata else ""
+            new_rows.append([record_id, patient_id, shard, start, start + n, *counts.tolist(), sources[record_id]])
+        log(f"[build_dataset] {len(new_rows)} records, {total} windows -> {shard_dir.name} "
+            f"in {time.perf_counter() - t0:.1f}s")
+        if not new_rows:
+            shutil.rmtree(shard_dir)
+
+    if new_rows:
+        new_index = pd.DataFrame(new_rows, columns=INDEX_COLUMNS)
+        index = pd.concat([index, new_index], ignore_index=True) if len(index) else new_index
+    index = index.sort_values(["shard", "start"], kind="stable").reset_index(drop=True)
+    _write_atomic(out_dir / "index.csv", index.to_csv(index=False))
+    _write_atomic(out_dir / "manifest.json", json.dumps({"params": asdict(params), "labels": LABEL_NAMES}, indent=2))
+    _remove_unindexed_shards(out_dir, index)
+    return {"kept": len(index) - len(new_rows), "built": len(new_rows), "dropped": dropped, "failed": len(failed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", default="Records", help="folder of record folders (IRIDIA-AF layout)")
+    parser.add_argument("--out", default=os.path.join("Dataset", "feature_store"))
+    parser.add_argument("--metadata", default=str(DEFAULT_METADATA_PATH))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rebuild", action="store_true", help="start the store over")
+    parser.add_argument("--no-filter", action="store_true", help="build every record, not only filtered_records.npy")
+    parser.add_argument("--exclude-flag", action="append", default=[],
+                        help="also drop records with this af_filter_flags.npy flag set (repeatable)")
+    parser.add_argument("--window-size", type=int, default=BuildParams.window_size)
+    parser.add_argument("--step-size", type=int, default=BuildParams.step_size)
+    parser.add_argument("--af-threshold", type=float, default=BuildParams.af_threshold)
+    parser.add_argument("--pre-af-minutes", type=float, default=BuildParams.pre_af_minutes)
+    args = parser.parse_args()
+
+    allowed = None if args.no_filter else load_record_filter(exclude_flags=args.exclude_flag)
+    metadata = MetadataIndex.from_csv(args.metadata) if os.path.exists(args.metadata) else None
+    params = BuildParams(
+        window_size=args.window_size, step_size=args.step_size,
+        af_threshold=args.af_threshold, pre_af_minutes=args.pre_af_minutes,
+    )
+    summary = build_dataset(args.records, args.out, params, metadata, allowed, args.workers, args.rebuild)
+    store = FeatureStore(args.out)
+    counts = store.index[["n_sr", "n_pre_af", "n_af"]].sum().tolist()
+    print(json.dumps({**summary, "records": len(store.index), "windows": len(store),
+                      "class_counts": dict(zip(LABEL_NAMES, counts))}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from Dataset_preparation.record import REQUIRED_META_COLS, Record, RecordMetadata
+
+DEFAULT_METADATA_PATH = Path(__file__).resolve().parent.parent / "metadata.csv"
+
+# metadata.csv header -> RecordMetadata field
+META_COLUMN_ALIASES = {
+    "record_files": "record_n_files",
+    "record_seconds": "record_n_seconds",
+    "record_samples": "record_n_samples",
+}
+
+
+def normalize_metadata(metadata_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    metadata.csv columns renamed to the RecordMetadata fields and put in their order,
+    ids as stripped strings and the sex lower-cased. Raises ValueError for missing columns.
+    """
+    df = metadata_df.rename(columns=META_COLUMN_ALIASES)
+    missing = [column for column in REQUIRED_META_COLS if column not in df.columns]
+    if missing:
+        raise ValueError(f"metadata is missing columns: {', '.join(missing)}")
+    df = df[REQUIRED_META_COLS].reset_index(drop=True)
+    for column in ("patient_id", "record_id"):
+        df[column] = df[column].astype(str).str.strip()
+    df["patient_sex"] = df["patient_sex"].astype(str).str.strip().str.lower()
+    return df
+
+
+class MetadataIndex:
+    """
+    metadata.csv loaded + normalized once (see normalize_metadata).
+    - get(record_id) / for_patient(patient_id): RecordMetadata through dict lookups
+    - filter(...): vectorized selection by sex / age / duration, returned as a new index
+    - create_record(...): Record with its metadata attached
+    """
+
+    def __init__(self, metadata_df: pd.DataFrame):
+        self.df = normalize_metadata(metadata_df)
+        self._values = self.df.to_numpy(dtype=object)
+        self._rows = {}
+        self._duplicates = set()
+        for row, record_id in enumerate(self.df["record_id"]):
+            if record_id in self._rows:
+                self._duplicates.add(record_id)
+            self._rows[record_id] = row
+        self._patient_rows = self.df.groupby("patient_id", sort=False).indices
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_METADATA_PATH):
+        return cls(pd.read_csv(path))
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, record_id):
+        return str(record_id).strip() in self._rows
+
+    @property
+    def record_ids(self):
+        return self.df["record_id"].tolist()
+
+    def get(self, record_id) -> RecordMetadata:
+        record_id = str(record_id).strip()
+        if record_id in self._duplicates:
+            count = int((self.df["record_id"] == record_id).sum())
+            raise ValueError(f"Expected exactly 1 metadata row for {record_id}, got {count}")
+        if record_id not in self._rows:
+            raise KeyError(f"No metadata for record {record_id}")
+        return RecordMetadata(*self._values[self._rows[record_id]])
+
+    def for_patient(self, patient_id):
+        rows = self._patient_rows.get(str(patient_id).strip(), [])
+        return [RecordMetadata(*self._values[row]) for row in rows]
+
+    def filter(self, sex=None, min_age=None, max_age=None, min_seconds=None, max_seconds=None, min_files=None):
+        """Records matching every given bound (inclusive); duration is record_n_seconds."""
+        df = self.df
+        keep = np.ones(len(df), dtype=bool)
+        if sex is not None:
+            keep &= (df["patient_sex"] == sex.strip().lower()).to_numpy()
+        for column, low, high in (
+            ("patient_age", min_age, max_age),
+            ("record_n_seconds", min_seconds, max_seconds),
+            ("record_n_files", min_files, None),
+        ):
+            values = df[column].to_numpy()
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+        return MetadataIndex(df[keep])
+
+    def create_record(self, record_id, records_dir, files=None) -> Record:
+        return Record(Path(records_dir, str(record_id).strip()), self.get(record_id), files=files)
@@ -1,11 +1,17 @@
-from dataclasses import dataclass
+import fnmatch
+import os
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import h5py
-import hrvanalysis  as hrv
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
+
+# pandas / hrvanalysis / matplotlib are imported where they are used: none of them
+# is needed to load + clean RR for inference, and together they add seconds to startup
+if TYPE_CHECKING:
+    import pandas as pd
 
 # def create_record(record_id, metadata_df, record_path):
 #     metadata_record = (metadata_df[metadata_df["record_id"] == record_id])
@@ -15,36 +21,470 @@ from matplotlib import pyplot as plt
 #     record = Record(record_path, metadata_record)
 #     return record
 
+# RecordMetadata fields; metadata.csv's record_files / record_seconds / record_samples
+# headers are mapped to them by Dataset_preparation.metadata.normalize_metadata
 REQUIRED_META_COLS = [
-    "patient_sex", "patient_age", "record_id", "record_date",
+    "patient_id", "patient_sex", "patient_age", "record_id", "record_date",
     "record_start_time", "record_end_time", "record_timedelta",
     "record_n_files", "record_n_seconds", "record_n_samples"
 ]
 
-def create_record(record_id, metadata_df, record_path):
+def create_record(record_id, metadata_df, record_path, files=None):
+    """
+    Record for record_id with its metadata when metadata_df (a DataFrame of metadata.csv or a
+    Dataset_preparation.metadata.MetadataIndex) has it. Build the MetadataIndex once when creating
+    many records: a DataFrame is indexed again on every call.
+    """
+    from Dataset_preparation.metadata import MetadataIndex
+
     record_path = Path(record_path, record_id)
+    if metadata_df is None:
+        return Record(record_path, metadata_record=None, files=files)
+
+    if not isinstance(metadata_df, MetadataIndex):
+        try:
+            metadata_df = MetadataIndex(metadata_df)
+        except ValueError:
+            return Record(record_path, metadata_record=None, files=files)
+    try:
+        metadata_record = metadata_df.get(record_id)
+    except KeyError:
+        raise ValueError(f"Expected exactly 1 metadata row for {record_id}, got 0")
+    return Record(record_path, metadata_record, files=files)
+
+
+def clean_rr_reference(rr_list, remove_invalid=True, low_rr=200, high_rr=4000, interpolation_method="linear",
+                       remove_ecto=True) -> np.ndarray:
+    """
+    Original pandas + hrvanalysis RR cleaning, kept as the reference clean_rr is
+    verified and benchmarked against (and used for non-linear interpolation methods).
+    """
+    import hrvanalysis as hrv
+    import pandas as pd
+
+    if remove_invalid:
+        rr_list = [rr if high_rr >= rr >= low_rr else np.nan for rr in rr_list]
+        rr_list = pd.Series(rr_list).interpolate(method=interpolation_method).tolist()
+    if remove_ecto:
+        rr_list = hrv.remove_ectopic_beats(rr_list,
+                                           method='custom',
+                                           custom_removing_rule=0.3,
+                                           verbose=False)
+        rr_list = pd.Series(rr_list) \
+            .interpolate(method=interpolation_method) \
+            .interpolate(limit_direction='both').tolist()
+    return np.array(rr_list)
+
+
+def _interpolate_linear(rr, fill_edges=False):
+    """
+    Fill NaN gaps in place like pandas .interpolate(method="linear"):
+    trailing NaNs take the last valid beat, leading NaNs are only filled when fill_edges.
+    """
+    missing = np.isnan(rr)
+    if not missing.any() or missing.all():
+        return rr
+    index = np.arange(len(rr))
+    rr[missing] = np.interp(index[missing], index[~missing], rr[~missing])
+    if not fill_edges:
+        rr[:np.argmax(~missing)] = np.nan
+    return rr
+
+
+def clean_rr(rr, remove_invalid=True, low_rr=200, high_rr=4000, remove_ecto=True, ecto_rule=0.3) -> np.ndarray:
+    """
+    Vectorized RR cleaning with the same output as clean_rr_reference:
+    - beats outside [low_rr, high_rr] ms -> NaN -> linear interpolation
+    - ectopic beats (change > ecto_rule vs previous beat) -> removed + interpolated;
+      the beat after a removed one is always kept (hrvanalysis 'custom' rule)
+    - gaps left at the edges are filled with the nearest valid beat
+    """
+    rr = np.array(rr, dtype=np.float64)
+    if len(rr) == 0:
+        raise ValueError("Cannot clean an empty RR series")
+
+    if remove_invalid:
+        rr[~((rr >= low_rr) & (rr <= high_rr))] = np.nan
+        rr = _interpolate_linear(rr)
+
+    if remove_ecto:
+        # candidate[i]: beat i differs too much from beat i-1 (NaN compares as ectopic)
+        candidate = np.zeros(len(rr), dtype=bool)
+        candidate[1:] = ~(np.abs(rr[:-1] - rr[1:]) <= ecto_rule * rr[:-1])
+
+        # in a run of consecutive candidates every other beat is removed, starting
+        # with the first, because the beat following a removed beat is never tested
+        index = np.arange(len(rr))
+        run_start = np.where(candidate & ~np.r_[False, candidate[:-1]], index, 0)
+        run_start = np.maximum.accumulate(run_start)
+        ectopic = candidate & ((index - run_start) % 2 == 0)
+
+        rr[ectopic] = np.nan
+        rr = _interpolate_linear(rr, fill_edges=True)
+    return rr
+
+
+class RRCleaner:
+    """
+    clean_rr for a series that arrives in chunks: feed() returns the cleaned beats later chunks
+    can no longer change, finish() the rest. The concatenated output is identical to clean_rr
+    of the whole series. Only an unresolved tail is held back (beats after the last kept beat,
+    waiting for the next one to interpolate against), so memory follows the chunk size.
+    """
+
+    def __init__(self, remove_invalid=True, low_rr=200, high_rr=4000, remove_ecto=True, ecto_rule=0.3):
+        self.remove_invalid = remove_invalid
+        self.low_rr = low_rr
+        self.high_rr = high_rr
+        self.remove_ecto = remove_ecto
+        self.ecto_rule = ecto_rule
+
+        self._pending = np.empty(0)  # raw beats not emitted yet
+        self._start = 0              # series index of _pending[0]
+        self._last_valid = None      # (index, value) of the last in-range beat before _pending
+        self._prev = None            # in-range-filled value of the beat before _pending
+        self._run = 0                # ectopic candidates in a row ending right before _pending
+        self._last_kept = None       # (index, value) of the last kept beat before _pending
+
+    def feed(self, chunk) -> np.ndarray:
+        chunk = np.asarray(chunk, dtype=np.float64)
+        self._pending = np.concatenate([self._pending, chunk]) if len(self._pending) else chunk
+        return self._emit(final=False)
+
+    def finish(self) -> np.ndarray:
+        if self._start + len(self._pending) == 0:
+            raise ValueError("Cannot clean an empty RR series")
+        return self._emit(final=True)
+
+    def _emit(self, final):
+        raw = self._pending
+        n = len(raw)
+        index = np.arange(self._start, self._start + n)
+
+        # step 1 (as clean_rr): out-of-range beats -> linear interpolation, leading ones stay NaN.
+        # Settled up to the last in-range beat; the beats after it wait for the next one
+        if self.remove_invalid:
+            valid = (raw >= self.low_rr) & (raw <= self.high_rr)
+            valid_at = np.flatnonzero(valid)
+            rr = np.where(valid, raw, np.nan)
+            xp, fp = index[valid_at], raw[valid_at]
+            if self._last_valid is not None:
+                xp, fp = np.r_[self._last_valid[0], xp], np.r_[self._last_valid[1], fp]
+            if len(xp):
+                fill = ~valid & (index > xp[0])
+                rr[fill] = np.interp(index[fill], xp, fp)
+            settled = n if final else (valid_at[-1] + 1 if len(valid_at) else 0)
+        else:
+            rr = raw.copy()
+            settled = n
+        if settled == 0:
+            return np.empty(0)
+        rr = rr[:settled]
+
+        if not self.remove_ecto:
+            emitted, out = settled, rr
+        else:
+            # step 2: ectopic candidates continue the run (and its removal parity) of the previous call
+            prev = np.r_[np.nan if self._prev is None else self._prev, rr[:-1]]
+            candidate = ~(np.abs(prev - rr) <= self.ecto_rule * prev)
+            if self._start == 0:
+                candidate[0] = False
+            local = np.arange(settled)
+            continues = np.r_[self._run > 0, candidate[:-1]]
+            run_start = np.maximum.accumulate(np.where(candidate & ~continues, local, -self._run))
+            ectopic = candidate & ((local - run_start) % 2 == 0)
+
+            kept_at = np.flatnonzero(~ectopic & ~np.isnan(rr))
+            emitted = settled if final else (kept_at[-1] + 1 if len(kept_at) else 0)
+            if emitted == 0:
+                return np.empty(0)
+            out = rr[:emitted].copy()
+            missing = np.ones(emitted, dtype=bool)
+            missing[kept_at[kept_at < emitted]] = False
+            xp, fp = index[kept_at], rr[kept_at]
+            if self._last_kept is not None:
+                xp, fp = np.r_[self._last_kept[0], xp], np.r_[self._last_kept[1], fp]
+            if len(xp):
+                out[missing] = np.interp(index[:emitted][missing], xp, fp)
+            else:
+                out[missing] = np.nan
+
+            not_candidate = np.flatnonzero(~candidate[:emitted])
+            self._run = emitted - 1 - not_candidate[-1] if len(not_candidate) else self._run + emitted
+            kept_at = kept_at[kept_at < emitted]
+            if len(kept_at):
+                self._last_kept = (index[kept_at[-1]], rr[kept_at[-1]])
+
+        if self.remove_invalid:
+            valid_at = valid_at[valid_at < emitted]
+            if len(valid_at):
+                self._last_valid = (index[valid_at[-1]], raw[valid_at[-1]])
+        self._prev = rr[emitted - 1]
+        self._pending = raw[emitted:].copy()
+        self._start += emitted
+        return out
+
+
+# Beats per HDF5 read in Record.iter_rr (rounded to the dataset's chunk size)
+RR_CHUNK_BEATS = 1 << 16
+
+
+def _iter_rr_datasets(datasets, chunk_size=RR_CHUNK_BEATS, clean=True):
+    """RR of the day datasets in order, read chunk_size beats at a time; each day is cleaned on its own."""
+    for dataset in datasets:
+        step = chunk_size
+        if dataset.chunks:
+            step = max(1, chunk_size // dataset.chunks[0]) * dataset.chunks[0]
+        cleaner = RRCleaner() if clean else None
+        for start in range(0, len(dataset), step):
+            chunk = dataset[start:start + step]
+            if cleaner is not None:
+                chunk = cleaner.feed(chunk)
+            if len(chunk):
+                yield chunk
+        if cleaner is not None:
+            yield cleaner.finish()
+
+
+def _open_source(source):
+    """
+    Paths are handed to h5py / pandas as-is.
+    Archive members (see zip_ingest.ZipMember) are opened as in-memory file objects.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    return source.open()
+
+
+class IntervalLabels:
+    """
+    0/1 AF labels of a series (all day files back to back) stored as sorted, disjoint
+    [start, stop) intervals instead of one flag per beat / sample.
+    - at(i): label of positions i (binary search, O(log n) per query)
+    - fraction(start, stop): share of each range that is AF, e.g. per 50-beat window
+    - dense(start, stop): the per-position array, only when asked for
+    """
+
+    def __init__(self, starts, stops, length):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.length = int(length)
+        self._covered_before = np.r_[0, np.cumsum(self.stops - self.starts)]
+
+    @classmethod
+    def from_events(cls, events, index_name, day_lengths, front=0):
+        """
+        From an event table (start_file_index, start_<index_name>_index, end_file_index,
+        end_<index_name>_index) over days of day_lengths. Events may span any number of days.
+        front: positions already cut from the start of every day (day_lengths are after the cut).
+        """
+        day_lengths = np.asarray(day_lengths, dtype=np.int64)
+        day_starts = np.r_[0, np.cumsum(day_lengths)]
+        if events is None or len(events) == 0:
+            return cls([], [], day_starts[-1])
+
+        columns = ["start_file_index", f"start_{index_name}_index", "end_file_index", f"end_{index_name}_index"]
+        start_day, start_index, end_day, end_index = events[columns].to_numpy(dtype=np.int64).T
+        if max(start_day.max(), end_day.max()) >= len(day_lengths) or min(start_day.min(), end_day.min()) < 0:
+            raise ValueError(f"Label events reference day files outside 0..{len(day_lengths) - 1}")
+
+        def position(day, index):
+            return day_starts[day] + np.clip(index - front, 0, day_lengths[day])
+
+        starts, stops = position(start_day, start_index), position(end_day, end_index)
+        keep = stops > starts
+        starts, stops = starts[keep], stops[keep]
+        order = np.argsort(starts, kind="stable")
+        starts, stops = starts[order], stops[order]
+
+        # merge overlapping / touching events: a new interval begins where no earlier one reaches
+        reach = np.maximum.accumulate(stops)
+        begins = np.r_[True, starts[1:] > reach[:-1]]
+        group_ends = np.r_[np.flatnonzero(begins)[1:] - 1, len(starts) - 1]
+        return cls(starts[begins], reach[group_ends], day_starts[-1])
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def episodes(self) -> np.ndarray:
+        """(n, 2) [start, stop) of every labelled interval."""
+        return np.column_stack([self.starts, self.stops])
+
+    def at(self, positions):
+        positions = np.asarray(positions)
+        k = np.searchsorted(self.starts, positions, side="right") - 1
+        inside = positions < self.stops[np.maximum(k, 0)] if len(self.starts) else np.zeros(positions.shape, bool)
+        return ((k >= 0) & inside).astype(np.uint8)
+
+    def covered(self, positions):
+        """Number of labelled positions before each position."""
+        positions = np.asarray(positions, dtype=np.int64)
+        k = np.searchsorted(self.starts, positions, side="left")
+        overhang = np.maximum(self.stops[np.maximum(k - 1, 0)] - positions, 0) if len(self.starts) else 0
+        return self._covered_before[k] - np.where(k > 0, overhang, 0)
+
+    def fraction(self, starts, stops):
+        """Share of labelled positions in each [start, stop) range."""
+        starts, stops = np.asarray(starts), np.asarray(stops)
+        return (self.covered(stops) - self.covered(starts)) / np.maximum(stops - starts, 1)
+
+    def window_fraction(self, n_windows, window_size=50, step_size=5):
+        """AF share of each sliding window, aligned with the rows of build_psr_windows."""
+        starts = np.arange(n_windows, dtype=np.int64) * step_size
+        return self.fraction(starts, starts + window_size)
+
+    def dense(self, start=0, stop=None, dtype=np.uint8) -> np.ndarray:
+        stop = self.length if stop is None else min(stop, self.length)
+        labels = np.zeros(max(stop - start, 0), dtype=dtype)
+        first = np.searchsorted(self.stops, start, side="right")
+        last = np.searchsorted(self.starts, stop, side="left")
+        for episode_start, episode_stop in zip(self.starts[first:last], self.stops[first:last]):
+            labels[max(episode_start, start) - start:min(episode_stop, stop) - start] = 1
+        return labels
+
+
+# ECG samples dropped from the start of every day file with clean_front=True
+ECG_FRONT_SAMPLES = 6000
+
+
+def _ecg_dataset(h5_file):
+    return h5_file[list(h5_file.keys())[0]]
+
+
+def _ecg_day_array(dataset, source):
+    """
+    np.memmap of a day's ECG when the dataset is stored contiguous + uncompressed in a file on disk,
+    else the h5py dataset itself (sliced through HDF5). Both read only the rows that are sliced.
+    """
+    if isinstance(source, (str, os.PathLike)) and dataset.chunks is None and dataset.compression is None:
+        offset = dataset.id.get_offset()
+        if offset is not None:
+            return np.memmap(source, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+    return dataset
+
+
+class ECGView:
+    """
+    Lazy ECG of a record: all day files back to back as one (samples, leads) array that reads
+    only what is sliced (view[a:b], view.time_slice(t0, t1)).
+    - front: samples skipped at the start of every day (clean_front), by index arithmetic
+    - events: ECG label table (start/end_file_index, start/end_qrs_index); labels(a, b) and
+      episodes() answer from its IntervalLabels without a per-sample label array
+    - fs: sampling rate (Hz) for time_slice
+    Keeps the files open: close() it or use it as a context manager.
+    """
+
+    def __init__(self, ecg_files, events=None, front=0, fs=None):
+        self.front = front
+        self.fs = fs
+        self._stack = ExitStack()
+        self._days = []
+        try:
+            for ecg_file in ecg_files:
+                dataset = _ecg_dataset(self._stack.enter_context(h5py.File(_open_source(ecg_file), "r")))
+                self._days.append(_ecg_day_array(dataset, ecg_file))
+        except Exception:
+            self._stack.close()
+            raise
+
+        lengths = [max(len(day) - front, 0) for day in self._days]
+        self.day_starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.day_starts[1:])
+        self.shape = (int(self.day_starts[-1]),) + tuple(self._days[0].shape[1:]) if self._days else (0,)
+        self.label_intervals = IntervalLabels.from_events(events, "qrs", np.diff(self.day_starts), front)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._days = []
+        self._stack.close()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("ECGView supports slices only, e.g. view[start:stop]")
+        start, stop, step = index.indices(len(self))
+        stop = max(start, stop)
+        first = np.searchsorted(self.day_starts, start, side="right") - 1
+        parts = []
+        for day in range(max(first, 0), len(self._days)):
+            day_start, day_end = self.day_starts[day], self.day_starts[day + 1]
+            if day_start >= stop:
+                break
+            lo, hi = max(start, day_start) - day_start, min(stop, day_end) - day_start
+            if hi > lo:
+                parts.append(np.asarray(self._days[day][self.front + lo:self.front + hi]))
+        if not parts:
+            return np.empty((0,) + self.shape[1:])
+        data = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return data[::step] if step != 1 else data
+
+    def time_slice(self, start_s, stop_s):
+        if self.fs is None:
+            raise ValueError("ECGView needs fs (Hz) for time ranges")
+        return self[int(round(start_s * self.fs)):int(round(stop_s * self.fs))]
+
+    def episodes(self) -> np.ndarray:
+        """(n, 2) [start, stop) view indices of the labelled AF episodes."""
+        return self.label_intervals.episodes
+
+    def labels(self, start=0, stop=None) -> np.ndarray:
+        """0/1 AF label of samples start..stop (same values as Record.ecg_labels.dense())."""
+        return self.label_intervals.dense(start, stop)
+
+
+RECORD_FILE_PATTERNS = {
+    "rr": "*rr_*.h5",
+    "ecg": "*ecg_*.h5",
+    "rr_labels": "*rr_labels.csv",
+    "ecg_labels": "*ecg_labels.csv",
+}
 
-    if metadata_df is None or not set(REQUIRED_META_COLS).issubset(set(metadata_df.columns)):
-        return Record(record_path, metadata_record=None)
 
-    metadata_record = metadata_df[metadata_df["record_id"].astype(str).str.strip() == str(record_id).strip()]
-    if len(metadata_record) != 1:
-        raise ValueError(f"Expected exactly 1 metadata row for {record_id}, got {len(metadata_record)}")
+@dataclass
+class RecordFiles:
+    """
+    The files of one record, sorted by name. Each entry is a Path or an
+    archive member (see zip_ingest.ZipMember); built once so Record never globs.
+    """
+    rr: list = field(default_factory=list)
+    ecg: list = field(default_factory=list)
+    rr_labels: list = field(default_factory=list)
+    ecg_labels: list = field(default_factory=list)
+
+    def add(self, file_name, source):
+        for kind, pattern in RECORD_FILE_PATTERNS.items():
+            if fnmatch.fnmatchcase(file_name, pattern):
+                getattr(self, kind).append(source)
+
+    @classmethod
+    def from_folder(cls, record_folder):
+        files = cls()
+        for path in sorted(Path(record_folder).iterdir()):
+            files.add(path.name, path)
+        return files
 
-    return Record(record_path, metadata_record.values[0])
 
 class Record:
-    def __init__(self, record_folder, metadata_record=None):
+    def __init__(self, record_folder, metadata_record=None, files=None):
         self.record_folder = record_folder
+        self.files = RecordFiles.from_folder(record_folder) if files is None else files
 
-        if metadata_record is None:
-            self.metadata = None
+        if metadata_record is None or isinstance(metadata_record, RecordMetadata):
+            self.metadata = metadata_record
         else:
             self.metadata = RecordMetadata(*metadata_record)
 
         # discover rr and ecg files
-        self.rr_files = sorted(self.record_folder.glob("*rr_*.h5"))
-        self.ecg_files = sorted(self.record_folder.glob("*ecg_*.h5"))
+        self.rr_files = self.files.rr
+        self.ecg_files = self.files.ecg
 
         if len(self.rr_files) == 0:
             raise AssertionError(f"No RR files found for record folder: {self.record_folder}")
@@ -65,13 +505,44 @@ class Record:
         self.ecg = None
         self.ecg_labels_df = None
         self.ecg_labels = None
+        self.ecg_clean_front = False  # clean_front of the last load_ecg
 
     def load_rr_record(self):
         self.rr = [self.__read_rr_file(rr_file) for rr_file in self.rr_files]
         self.__create_rr_labels()
 
+    @contextmanager
+    def _rr_datasets(self):
+        """The "rr" dataset of every day file, open for lazy slicing."""
+        with ExitStack() as stack:
+            yield [stack.enter_context(h5py.File(_open_source(rr_file), "r"))["rr"] for rr_file in self.rr_files]
+
+    def rr_lengths(self):
+        """Beats per day file, from the HDF5 metadata (nothing is read)."""
+        with self._rr_datasets() as datasets:
+            return [len(dataset) for dataset in datasets]
+
+    def iter_rr(self, chunk_size=RR_CHUNK_BEATS, clean=True):
+        """
+        Lazy load_rr_record: RR of all days in order, in chunks of about chunk_size beats.
+        Cleaning is the same as load_rr_record (per day), but continues across chunk boundaries
+        (RRCleaner), so the concatenated chunks equal np.concatenate(self.rr).
+        """
+        with self._rr_datasets() as datasets:
+            yield from _iter_rr_datasets(datasets, chunk_size, clean)
+
+    def load_rr(self, chunk_size=RR_CHUNK_BEATS) -> np.ndarray:
+        """Cleaned RR of all days in one preallocated array (no per-day copies, labels not read)."""
+        with self._rr_datasets() as datasets:
+            rr = np.empty(sum(len(dataset) for dataset in datasets))
+            position = 0
+            for chunk in _iter_rr_datasets(datasets, chunk_size):
+                rr[position:position + len(chunk)] = chunk
+                position += len(chunk)
+        return rr
+
     def __read_rr_file(self, rr_file: Path, clean_rr=True) -> np.ndarray:
-        with h5py.File(rr_file, "r") as f:
+        with h5py.File(_open_source(rr_file), "r") as f:
             rr = f["rr"][:]
         if clean_rr:
             rr = self.__clean_rr(rr)
@@ -79,55 +550,35 @@ class Record:
 
     def __clean_rr(self, rr_list, remove_invalid=True, low_rr=200, high_rr=4000, interpolation_method="linear",
                    remove_ecto=True) -> np.ndarray:
-
-        if remove_invalid:
-            rr_list = [rr if high_rr >= rr >= low_rr else np.nan for rr in rr_list]
-            rr_list = pd.Series(rr_list).interpolate(method=interpolation_method).tolist()
-        if remove_ecto:
-            rr_list = hrv.remove_ectopic_beats(rr_list,
-                                               method='custom',
-                                               custom_removing_rule=0.3,
-                                               verbose=False)
-            rr_list = pd.Series(rr_list) \
-                .interpolate(method=interpolation_method) \
-                .interpolate(limit_direction='both').tolist()
-        return np.array(rr_list)
+        if interpolation_method != "linear":
+            return clean_rr_reference(rr_list, remove_invalid, low_rr, high_rr, interpolation_method, remove_ecto)
+        return clean_rr(rr_list, remove_invalid, low_rr, high_rr, remove_ecto)
 
     # def __read_rr_label(self) -> pd.DataFrame:
     #     rr_labels = sorted(self.record_folder.glob("*rr_labels.csv"))
     #     return df_rr_labels
     
-    def __read_rr_label(self) -> pd.DataFrame: 
-        rr_labels = sorted(self.record_folder.glob("*rr_labels.csv"))
-        df_rr_labels = pd.read_csv(rr_labels[0])
+    def __read_rr_label(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        df_rr_labels = pd.read_csv(_open_source(self.files.rr_labels[0]))
         return df_rr_labels
 
     def __create_rr_labels(self):
         self.rr_labels_df = self.__read_rr_label()
-        len_rr = [len(rr) for rr in self.rr]
-
-        start_day = self.rr_labels_df["start_file_index"].unique()
-        end_day = self.rr_labels_df["end_file_index"].unique()
-        days = np.unique(np.concatenate([start_day, end_day]))
-        assert len(days) <= len(len_rr)
+        self.rr_labels = IntervalLabels.from_events(self.rr_labels_df, "rr", [len(rr) for rr in self.rr])
 
-        labels = [np.zeros(len_day_rr) for len_day_rr in len_rr]
-
-        for i, row in self.rr_labels_df.iterrows():
-            rr_event = RREvent(**row)
-            if rr_event.start_file_index == rr_event.end_file_index:
-                labels[rr_event.start_file_index][rr_event.start_rr_index:rr_event.end_rr_index] = 1
-            else:
-                labels[rr_event.start_file_index][rr_event.start_rr_index:] = 1
-                labels[rr_event.end_file_index][:rr_event.end_rr_index] = 1
-                if rr_event.end_file_index - rr_event.end_file_index > 1:
-                    for day in range(rr_event.start_file_index + 1, rr_event.end_file_index):
-                        labels[day][:] = 1
-        self.rr_labels = labels
+    def rr_label_intervals(self, day_lengths=None) -> IntervalLabels:
+        """RR labels without loading the RR (day lengths from rr_lengths()); no AF when there is no label file."""
+        day_lengths = self.rr_lengths() if day_lengths is None else day_lengths
+        events = self.__read_rr_label() if self.files.rr_labels else None
+        return IntervalLabels.from_events(events, "rr", day_lengths)
 
     def plot_rr(self, has_day_ticks=True, has_abnormal_color=False):
         all_rr = np.concatenate(self.rr)
-        all_rr_labels = np.concatenate(self.rr_labels)
+        all_rr_labels = self.rr_labels.dense()
+
+        from matplotlib import pyplot as plt
 
         fig, ax = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
 
@@ -154,76 +605,74 @@ class Record:
 
         if has_abnormal_color:
             # color the background of the abnormal regions
-            abnormal_regions_start = np.where(np.diff(all_rr_labels) == 1)[0]
-            abnormal_regions_end = np.where(np.diff(all_rr_labels) == -1)[0]
-            if len(abnormal_regions_start) > len(abnormal_regions_end):
-                abnormal_regions_end = np.append(abnormal_regions_end, len(all_rr_labels))
-            elif len(abnormal_regions_start) < len(abnormal_regions_end):
-                abnormal_regions_start = np.insert(abnormal_regions_start, 0, 0)
-            for start, end in zip(abnormal_regions_start, abnormal_regions_end):
+            for start, end in self.rr_labels.episodes:
                 ax[0].axvspan(start, end, alpha=0.3, color="red")
                 ax[1].axvspan(start, end, alpha=0.3, color="red")
 
         plt.show()
 
+    def ecg_view(self, clean_front=False, fs=None) -> ECGView:
+        """
+        Lazy alternative to load_ecg: nothing is read until the view is sliced.
+        fs defaults to record_n_samples / record_n_seconds from the metadata, when there is one.
+        """
+        events = self.__read_ecg_labels() if self.files.ecg_labels else None
+        if fs is None and self.metadata is not None and self.metadata.record_n_seconds:
+            fs = float(self.metadata.record_n_samples) / float(self.metadata.record_n_seconds)
+        return ECGView(self.ecg_files, events, ECG_FRONT_SAMPLES if clean_front else 0, fs)
+
     def load_ecg(self, clean_front=False):
-        ecg_files = sorted(self.record_folder.glob("*_ecg_*.h5"))
-        self.ecg = [self.__read_ecg_file(ecg_file, clean_front) for ecg_file in ecg_files]
+        self.ecg_clean_front = clean_front
+        self.ecg = [self.__read_ecg_file(ecg_file, clean_front) for ecg_file in self.ecg_files]
         self.__create_ecg_labels(clean_front)
 
     def __read_ecg_file(self, ecg_file: Path, clean_front=False) -> np.ndarray:
-        with h5py.File(ecg_file, "r") as f:
+        with h5py.File(_open_source(ecg_file), "r") as f:
             key = list(f.keys())[0]
             ecg = f[key][:]
             if clean_front:
-                ecg = ecg[6000:]
+                ecg = ecg[ECG_FRONT_SAMPLES:]
         return ecg
 
-    def __read_ecg_labels(self) -> pd.DataFrame:
-        ecg_labels = sorted(self.record_folder.glob("*ecg_labels.csv"))
-        df_ecg_labels = pd.read_csv(ecg_labels[0])
+    def __read_ecg_labels(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        df_ecg_labels = pd.read_csv(_open_source(self.files.ecg_labels[0]))
         return df_ecg_labels
 
     def __create_ecg_labels(self, clean_front=False):
         self.ecg_labels_df = self.__read_ecg_labels()
-        len_ecg = [len(ecg) for ecg in self.ecg]
-
-        start_day = self.ecg_labels_df["start_file_index"].unique()
-        end_day = self.ecg_labels_df["end_file_index"].unique()
-        days = np.unique(np.concatenate([start_day, end_day]))
-        assert len(days) <= len(len_ecg)
-
-        labels = [np.zeros(len_day_ecg) for len_day_ecg in len_ecg]
-
-        for i, row in self.ecg_labels_df.iterrows():
-            if row.start_file_index == row.end_file_index:
-                labels[row.start_file_index][row.start_qrs_index:row.end_qrs_index] = 1
-            else:
-                labels[row.start_file_index][row.start_qrs_index:] = 1
-                labels[row.end_file_index][:row.end_qrs_index] = 1
-                if row.end_file_index - row.end_file_index > 1:
-                    for day in range(row.start_file_index + 1, row.end_file_index):
-                        labels[day][:] = 1
-        if clean_front:
-            labels = [label[6000:] for label in labels]
-        self.ecg_labels = labels
-
-    def plot_ecg(self, has_day_ticks=True):
-        all_ecg = np.concatenate(self.ecg)
-        all_ecg_labels = np.concatenate(self.ecg_labels)
+        self.ecg_labels = IntervalLabels.from_events(
+            self.ecg_labels_df, "qrs", [len(ecg) for ecg in self.ecg], ECG_FRONT_SAMPLES if clean_front else 0
+        )
+
+    def plot_ecg(self, has_day_ticks=True, start=0, stop=None, clean_front=None):
+        """
+        Plot samples start..stop (default: the whole record), read through ecg_view.
+        clean_front defaults to the one of the last load_ecg, so indices match self.ecg.
+        """
+        clean_front = self.ecg_clean_front if clean_front is None else clean_front
+        with self.ecg_view(clean_front) as view:
+            stop = len(view) if stop is None else stop
+            all_ecg = view[start:stop]
+            all_ecg_labels = view.labels(start, stop)
+            day_starts = view.day_starts
+
+        from matplotlib import pyplot as plt
 
         # set font size
         plt.rcParams.update({"font.size": 18})
 
         fig, ax = plt.subplots(3, 1, figsize=(10, 8), sharex=True)
+        x = np.arange(start, start + len(all_ecg))
 
-        ax[0].plot(all_ecg[:, 0])
+        ax[0].plot(x, all_ecg[:, 0])
         ax[0].set_ylabel("ECG I (mV)")
 
-        ax[1].plot(all_ecg[:, 1])
+        ax[1].plot(x, all_ecg[:, 1])
         ax[1].set_ylabel("ECG II (mV)")
 
-        ax[2].plot(all_ecg_labels)
+        ax[2].plot(x, all_ecg_labels)
         ax[2].set_ylim(-0.1, 1.1)
         ax[2].set_yticks([0, 1])
         ax[2].set_yticklabels(["NSR", "AF"])
@@ -231,11 +680,8 @@ class Record:
         ax[2].set_ylabel("Label")
 
         if has_day_ticks:
-            # add vertical lines at the end of each day
-            len_ecg = [len(ecg) for ecg in self.ecg]
-            index_len_ecg = np.cumsum(len_ecg)
-            index_len_ecg = np.insert(index_len_ecg, 0, 0)
-            for i in index_len_ecg:
+            # add vertical lines at the day boundaries inside the plotted range
+            for i in day_starts[(day_starts >= start) & (day_starts <= stop)]:
                 ax[0].axvline(i, color="k", linestyle="--", alpha=0.5)
                 ax[1].axvline(i, color="k", linestyle="--", alpha=0.5)
                 ax[2].axvline(i, color="k", linestyle="--", alpha=0.5)
@@ -243,12 +689,12 @@ class Record:
         plt.show()
 
     def number_of_episodes(self):
-        rr_labels = sorted(self.record_folder.glob("*rr_labels.csv"))
-        df_rr_labels = pd.read_csv(rr_labels[0])
+        import pandas as pd
+
+        df_rr_labels = pd.read_csv(_open_source(self.files.rr_labels[0]))
         num_episodes_rr = len(df_rr_labels)
 
-        ecg_labels = sorted(self.record_folder.glob("*ecg_labels.csv"))
-        df_ecg_labels = pd.read_csv(ecg_labels[0])
+        df_ecg_labels = pd.read_csv(_open_source(self.files.ecg_labels[0]))
         num_episodes_ecg = len(df_ecg_labels)
 
         assert num_episodes_rr == num_episodes_ecg
@@ -0,0 +1,248 @@
+"""
+Autotune predict_probabilities: a batch size per model and one torch thread count for the process.
+
+torch's intra-op thread count is a process setting shared by every model's batcher thread, so it
+is tuned once, over the models together, and applied at startup; each model only gets its own
+batch size. Candidates are timed on synthetic PSR / raw windows built the same way as uploads
+(build_psr_windows on RR in ms, /1000), since the adaptive solver's cost depends on the input.
+Results are stored in a JSON cache keyed by model hash (checkpoint bytes + solver + precision)
+and CPU signature: ModelRegistry applies a model's batch size when it loads and main.py applies
+the thread count at startup (AF_AUTOTUNE=cached, the default). main.py can also tune missing
+entries at startup (AF_AUTOTUNE=auto); that stops as soon as a request is in flight.
+
+Run from model_backend/:
+    python autotune.py                              # the two default models
+    python autotune.py --models NODE_PSR PSR_hybrid --batch-sizes 1024 4096 --threads 1 2 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from model_utils import (
+    DEFAULT_BATCH_SIZE, INPUT_SCALE, STEP_SIZE, WINDOW_SIZE, InferenceConfig, build_psr_windows,
+    get_inference_config, predict_probabilities, set_inference_config,
+)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "af-backend", "autotune.json")
+DEFAULT_BATCH_SIZES = (512, 1024, 2048, 4096, 8192)
+
+
+class AutotuneInterrupted(Exception):
+    """busy() turned true while tuning: requests are in flight, nothing was stored."""
+
+
+def default_thread_counts():
+    cpus = os.cpu_count() or 1
+    counts = {1, cpus}
+    n = 2
+    while n < cpus:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def cpu_signature() -> str:
+    model_name = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model_name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{model_name}|{os.cpu_count()} cpus|{platform.machine()}|torch {torch.__version__}"
+
+
+def model_key(spec, solver) -> str:
+    """Hash of what the timings depend on: the weights, the ODE solver and the precision."""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(Path(spec.path).read_bytes())
+    hasher.update(f"|{solver}|{spec.precision}".encode())
+    return hasher.hexdigest()
+
+
+def synthetic_windows(spec, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    n_beats = (rows - 1) * STEP_SIZE + WINDOW_SIZE
+    # mostly regular rhythm with irregular stretches, like a real recording
+    rr = 800 + rng.normal(0, 40, n_beats)
+    irregular = rng.random(n_beats) < 0.2
+    rr[irregular] = rng.uniform(350, 1400, irregular.sum())
+    X, _ = build_psr_windows([rr], WINDOW_SIZE, STEP_SIZE, scale=INPUT_SCALE, **spec.window_params)
+    return X[:rows]
+
+
+def _best_time(model, X, batch_size, repeat, busy):
+    predict_probabilities(model, X[:batch_size], batch_size=batch_size)  # warmup
+    best = float("inf")
+    for _ in range(repeat):
+        if busy is not None and busy():
+            raise AutotuneInterrupted()
+        t0 = time.perf_counter()
+        predict_probabilities(model, X, batch_size=batch_size)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def autotune_model(model, spec, batch_sizes=DEFAULT_BATCH_SIZES, rows=8192, repeat=2, busy=None):
+    """
+    Time every batch size at the current torch thread count.
+    Returns (best InferenceConfig, windows/s, all results); raises AutotuneInterrupted once busy() is true.
+    """
+    X = synthetic_windows(spec, rows)
+    results = []
+    for batch_size in batch_sizes:
+        seconds = _best_time(model, X, batch_size, repeat, busy)
+        results.append({"batch_size": batch_size, "windows_per_s": rows / seconds})
+    top = max(results, key=lambda r: r["windows_per_s"])
+    return InferenceConfig(top["batch_size"]), top["windows_per_s"], results
+
+
+def autotune_threads(models, thread_counts=None, rows=8192, repeat=2, busy=None):
+    """
+    One torch thread count for all models: [(model, spec)], each at its own batch size
+    (InferenceConfig), timed together per candidate. The thread count is restored afterwards.
+    Returns (best thread count, windows/s over all models, all results).
+    """
+    inputs = [(model, synthetic_windows(spec, rows)) for model, spec in models]
+    original_threads = torch.get_num_threads()
+    results = []
+    try:
+        for num_threads in thread_counts or default_thread_counts():
+            if busy is not None and busy():
+                raise AutotuneInterrupted()
+            torch.set_num_threads(num_threads)
+            seconds = 0.0
+            for model, X in inputs:
+                config = get_inference_config(model)
+                batch_size = config.batch_size if config is not None else DEFAULT_BATCH_SIZE
+                seconds += _best_time(model, X, batch_size, repeat, busy)
+            results.append({"num_threads": num_threads, "windows_per_s": rows * len(inputs) / seconds})
+    finally:
+        torch.set_num_threads(original_threads)
+    top = max(results, key=lambda r: r["windows_per_s"])
+    return top["num_threads"], top["windows_per_s"], results
+
+
+class TuningCache:
+    """
+    JSON file of tuned settings for this CPU:
+    - "<model key>@<cpu signature>": the model's InferenceConfig
+    - "threads@<cpu signature>": the process thread count
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = Path(path)
+        self.cpu = cpu_signature()
+        self._lock = threading.Lock()
+
+    def _key(self, model_key):
+        return f"{model_key}@{self.cpu}"
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, key, entry):
+        with self._lock:
+            entries = self._read()
+            entries[key] = {**entry, "tuned_at": time.time()}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(entries, indent=2, sort_keys=True))
+            os.replace(tmp_path, self.path)
+
+    def get(self, model_key):
+        entry = self._read().get(self._key(model_key))
+        if entry is None:
+            return None
+        return InferenceConfig(entry["batch_size"])
+
+    def put(self, model_key, config, windows_per_s=None, name=None):
+        self._write(self._key(model_key), {
+            "batch_size": config.batch_size, "windows_per_s": windows_per_s, "model": name,
+        })
+
+    def get_threads(self):
+        entry = self._read().get(self._key("threads"))
+        return None if entry is None else entry["num_threads"]
+
+    def put_threads(self, num_threads, windows_per_s=None, models=()):
+        self._write(self._key("threads"), {
+            "num_threads": num_threads, "windows_per_s": windows_per_s, "models": list(models),
+        })
+
+
+def apply_thread_count(cache):
+    """Set torch's thread count to the cached one (if any); returns it."""
+    num_threads = cache.get_threads()
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def tune_registry_model(registry, name, cache, **kwargs):
+    """Tune one registry model's batch size, store the result and apply it to the loaded model."""
+    spec = registry.spec(name)
+    model = registry.get(name)
+    config, windows_per_s, results = autotune_model(model, spec, **kwargs)
+    cache.put(model_key(spec, registry.solver), config, windows_per_s, name)
+    set_inference_config(model, config)
+    return config, windows_per_s, results
+
+
+def tune_registry_threads(registry, names, cache, **kwargs):
+    """Tune the process thread count over the registry models names, store it and apply it."""
+    models = [(registry.get(name), registry.spec(name)) for name in names]
+    num_threads, windows_per_s, results = autotune_threads(models, **kwargs)
+    cache.put_threads(num_threads, windows_per_s, names)
+    torch.set_num_threads(num_threads)
+    return num_threads, windows_per_s, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=None, help="registry names (default: the two defaults)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--threads", nargs="+", type=int, default=None)
+    parser.add_argument("--rows", type=int, default=8192)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--cache", default=os.environ.get("AF_AUTOTUNE_CACHE", DEFAULT_CACHE_PATH))
+    args = parser.parse_args()
+
+    # same registry (specs, solver, precision) as the server, without starting it
+    os.environ["AF_STARTUP_MODE"] = "lazy"
+    os.environ["AF_AUTOTUNE"] = "off"
+    import main as server
+
+    cache = TuningCache(args.cache)
+    names = args.models or [server.PREDICT_MODEL, server.DETECT_MODEL]
+    print(f"cpu: {cache.cpu}  cache: {cache.path}  threads: {torch.get_num_threads()}")
+    for name in names:
+        config, windows_per_s, results = tune_registry_model(
+            server.model_registry, name, cache, batch_sizes=args.batch_sizes, rows=args.rows, repeat=args.repeat,
+        )
+        default = next((r for r in results if r["batch_size"] == DEFAULT_BATCH_SIZE), None)
+        baseline = f"  (batch {DEFAULT_BATCH_SIZE}: {default['windows_per_s']:,.0f} windows/s)" if default else ""
+        print(f"{name}: batch_size={config.batch_size} {windows_per_s:,.0f} windows/s{baseline}")
+
+    num_threads, windows_per_s, results = tune_registry_threads(
+        server.model_registry, names, cache, thread_counts=args.threads, rows=args.rows, repeat=args.repeat,
+    )
+    timings = "  ".join(f"{r['num_threads']}: {r['windows_per_s']:,.0f}" for r in results)
+    print(f"process threads={num_threads} ({timings} windows/s)")
+
+
+if __name__ == "__main__":
+    main()
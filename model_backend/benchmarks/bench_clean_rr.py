@@ -0,0 +1,71 @@
+"""
+Compare Record RR cleaning: vectorized clean_rr vs the pandas/hrvanalysis reference.
+
+Run from model_backend/:
+    python -m benchmarks.bench_clean_rr                       # synthetic 24h recording
+    python -m benchmarks.bench_clean_rr --records-dir Records # also check parity on real RR files
+"""
+import argparse
+import os
+import time
+
+import h5py
+import numpy as np
+
+from Dataset_preparation.record import RecordFiles, clean_rr, clean_rr_reference
+
+
+def synthetic_rr(n_beats, seed=0):
+    rng = np.random.default_rng(seed)
+    rr = 800 + rng.normal(0, 60, n_beats)
+    # sprinkle artefacts + ectopic beats (~1%)
+    idx = rng.integers(0, n_beats, n_beats // 100)
+    rr[idx] = rng.choice([120, 350, 1400, 4500], len(idx))
+    return rr
+
+
+def best_of(fn, rr, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rr)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def check_records(records_dir):
+    checked = 0
+    for record_id in sorted(os.listdir(records_dir)):
+        folder = os.path.join(records_dir, record_id)
+        if not os.path.isdir(folder):
+            continue
+        for rr_file in RecordFiles.from_folder(folder).rr:
+            with h5py.File(rr_file, "r") as f:
+                rr = f["rr"][:]
+            if not np.array_equal(clean_rr(rr), clean_rr_reference(rr), equal_nan=True):
+                raise SystemExit(f"MISMATCH in {rr_file}")
+            checked += 1
+    print(f"parity: {checked} RR files identical")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--beats", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--records-dir", default=None)
+    args = parser.parse_args()
+
+    rr = synthetic_rr(args.beats)
+    assert np.array_equal(clean_rr(rr), clean_rr_reference(rr), equal_nan=True)
+
+    t_ref = best_of(clean_rr_reference, rr, args.repeat)
+    t_vec = best_of(clean_rr, rr, args.repeat)
+    print(f"beats={args.beats}  reference={t_ref * 1000:.1f}ms  vectorized={t_vec * 1000:.1f}ms  "
+          f"speedup={t_ref / t_vec:.1f}x")
+
+    if args.records_dir:
+        check_records(args.records_dir)
+
+
+if __name__ == "__main__":
+    main()
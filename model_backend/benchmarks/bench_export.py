@@ -0,0 +1,72 @@
+"""
+CPU latency / throughput of a NODE checkpoint: eager dopri5 (serving default), eager fixed-step
+(torchdiffeq) and the unrolled TorchScript export from model_export.py.
+
+Run from model_backend/:
+    python -m benchmarks.bench_export
+    python -m benchmarks.bench_export --checkpoint Three_Class_Models/saved_models/PSR_hybrid_best.pth --solver rk4:8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from model_export import export_torchscript
+from model_utils import load_checkpoint, load_model
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="Three_Class_Models/saved_models/NODE_PSR_best.pth")
+    parser.add_argument("--solver", default="rk4:4")
+    parser.add_argument("--batch", type=int, default=4096, help="rows per call for the throughput run")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    reference = load_checkpoint(args.checkpoint)
+    fixed = load_checkpoint(args.checkpoint, solver=args.solver)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.ts")
+        export_torchscript(fixed, args.solver, path)
+        exported = load_model(None, path)
+
+    dim = reference.odefunc.net[0].in_features
+    single = torch.randn(1, dim)
+    batch = torch.randn(args.batch, dim)
+    variants = {
+        f"eager {reference.solver}": reference,
+        f"eager {fixed.solver}": fixed,
+        f"torchscript {fixed.solver}": exported,
+    }
+
+    with torch.no_grad():
+        ref_out = torch.softmax(reference(batch), dim=1)
+        print(f"checkpoint={args.checkpoint}  threads={torch.get_num_threads()}  batch={args.batch}")
+        for name, model in variants.items():
+            for _ in range(3):  # warmup (TorchScript profiles and optimizes on the first calls)
+                model(single)
+                model(batch)
+            latency = median_time(lambda: model(single), args.repeat)
+            throughput = args.batch / median_time(lambda: model(batch), max(3, args.repeat // 4))
+            max_dev = (torch.softmax(model(batch), dim=1) - ref_out).abs().max().item()
+            print(f"  {name:<28} latency={latency * 1e3:.2f}ms  throughput={throughput:,.0f} windows/s  "
+                  f"max_dev_vs_dopri5={max_dev:.1e}")
+
+
+if __name__ == "__main__":
+    main()
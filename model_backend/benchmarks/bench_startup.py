@@ -0,0 +1,88 @@
+"""
+Server cold-start timings per AF_STARTUP_MODE, one JSON line per mode (easy to track over time):
+- import_s:         `import main` in a fresh interpreter
+- first_response_s: uvicorn process start -> first 200 from GET / (liveness)
+- ready_s:          uvicorn process start -> first 200 from GET /ready (default models loaded + warmed up)
+
+Run from model_backend/:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --modes eager background --repeat 3 --warmup-rows 4096
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_seconds(env):
+    code = "import time; t0 = time.perf_counter(); import main; print(time.perf_counter() - t0)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def wait_for(url, t0, timeout):
+    while time.perf_counter() - t0 < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - t0
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(url)
+
+
+def server_seconds(env, timeout):
+    port = free_port()
+    t0 = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        first_response = wait_for(f"http://127.0.0.1:{port}/", t0, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", t0, timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return first_response, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["background", "eager", "lazy"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup-rows", type=int, default=None, help="AF_WARMUP_ROWS (default: server default)")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        env = {**os.environ, "AF_STARTUP_MODE": mode}
+        if args.warmup_rows is not None:
+            env["AF_WARMUP_ROWS"] = str(args.warmup_rows)
+
+        imports = [import_seconds(env) for _ in range(args.repeat)]
+        servers = [server_seconds(env, args.timeout) for _ in range(args.repeat)]
+        print(json.dumps({
+            "mode": mode,
+            "warmup_rows": env.get("AF_WARMUP_ROWS"),
+            "import_s": round(statistics.median(imports), 3),
+            "first_response_s": round(statistics.median(s[0] for s in servers), 3),
+            "ready_s": round(statistics.median(s[1] for s in servers), 3),
+        }))
+
+
+if __name__ == "__main__":
+    main()
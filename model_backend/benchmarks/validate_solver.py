@@ -0,0 +1,126 @@
+"""
+Check a NODE ODE solver setting (AF_ODE_SOLVER) and int8 mode (AF_MODEL_PRECISIONS) against the
+float32 dopri5 reference the models were trained with.
+Inputs are the server's: WINDOW_SIZE / STEP_SIZE windows, RR divided by INPUT_SCALE (ms -> s),
+in each model's own representation (PSR or raw windows).
+
+For each candidate solver (and, with --int8, its int8 variant) and every registry model
+(model_registry.MODEL_SPECS, or --models) this reports:
+- max / mean absolute deviation of the class probabilities from the reference
+- per-window argmax agreement
+- per-record decision flips at the model's serving threshold (ModelSpec.aggregation / threshold)
+- throughput in windows/s and speedup vs the reference
+
+Run from model_backend/:
+    python -m benchmarks.validate_solver                                # synthetic records
+    python -m benchmarks.validate_solver --records-dir Records --solvers rk4:4 rk4:8 midpoint:16
+    python -m benchmarks.validate_solver --records-dir Records --solvers rk4:4 --int8 --threads 1
+    python -m benchmarks.validate_solver --models NODE_PSR PSR_hybrid --solvers rk4:4 --int8
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from model_registry import MODEL_SPECS
+from model_utils import (
+    INPUT_SCALE,
+    STEP_SIZE,
+    WINDOW_SIZE,
+    SolverConfig,
+    WindowBatch,
+    build_psr_windows,
+    load_model,
+    predict_probabilities,
+    quantize_model,
+    preprocess_data,
+)
+
+
+def synthetic_rr(n_records, n_beats, seed=0):
+    rng = np.random.default_rng(seed)
+    # alternate regular and irregular rhythms so both sides of the thresholds are exercised
+    return {
+        f"synthetic_{i:03d}": 800 + rng.normal(0, 40 if i % 2 == 0 else 220, n_beats)
+        for i in range(n_records)
+    }
+
+
+def records_rr(records_dir):
+    """Cleaned RR of every record folder in records_dir, preprocessed as the server does."""
+    _, raw_rr = preprocess_data(records_dir, window_size=WINDOW_SIZE, step_size=STEP_SIZE, scale=INPUT_SCALE)
+    return raw_rr
+
+
+def window_batch(rr_by_record, spec):
+    """Model input for spec (its window_params), built like main._windows_for."""
+    record_ids = list(rr_by_record)
+    X, offsets = build_psr_windows(
+        [rr_by_record[rid] for rid in record_ids],
+        window_size=WINDOW_SIZE, step_size=STEP_SIZE, scale=INPUT_SCALE, **spec.window_params
+    )
+    return WindowBatch(X=X, record_ids=record_ids, offsets=offsets)
+
+
+def decisions(batch, probs, spec):
+    if spec.aggregation == "p75_danger":
+        return batch.quantile(1 - probs[:, 0], 0.75) >= spec.threshold
+    return batch.max(probs[:, 1]) >= spec.threshold
+
+
+def timed_probabilities(model, X, batch_size):
+    predict_probabilities(model, X[:64])  # warmup
+    t0 = time.perf_counter()
+    probs = predict_probabilities(model, X, batch_size=batch_size)
+    return probs, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records-dir", default=None)
+    parser.add_argument("--models", nargs="+", default=list(MODEL_SPECS), choices=list(MODEL_SPECS))
+    parser.add_argument("--synthetic-records", type=int, default=20)
+    parser.add_argument("--synthetic-beats", type=int, default=2000)
+    parser.add_argument("--solvers", nargs="+", default=["rk4:4", "rk4:8", "midpoint:8", "dopri5:1e-5:1e-7"])
+    parser.add_argument("--int8", action="store_true", help="also check int8 variants of fixed-step solvers")
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.records_dir:
+        rr_by_record = records_rr(args.records_dir)
+    else:
+        rr_by_record = synthetic_rr(args.synthetic_records, args.synthetic_beats)
+
+    for name in args.models:
+        spec = MODEL_SPECS[name]
+        batch = window_batch(rr_by_record, spec)
+        reference = load_model(spec.model_class, spec.path, spec.input_dim, spec.num_classes)
+        ref_probs, ref_time = timed_probabilities(reference, batch.X, args.batch_size)
+        ref_decisions = decisions(batch, ref_probs, spec)
+        print(f"\n{name} ({spec.representation}, threshold {spec.threshold}): reference {reference.solver} float32  "
+              f"windows={len(batch.X)}  {len(batch.X) / ref_time:,.0f} windows/s  "
+              f"positive decisions={int(ref_decisions.sum())}/{len(ref_decisions)}")
+
+        for solver_spec in args.solvers:
+            solver = SolverConfig.parse(solver_spec)
+            candidate = load_model(spec.model_class, spec.path, spec.input_dim, spec.num_classes, solver=solver)
+            candidates = [(f"{solver} float32", candidate)]
+            if args.int8 and solver.fixed_step:
+                candidates.append((f"{solver} int8", quantize_model(candidate)))
+
+            for label, model in candidates:
+                probs, elapsed = timed_probabilities(model, batch.X, args.batch_size)
+                deviation = np.abs(probs - ref_probs)
+                agreement = np.mean(probs.argmax(axis=1) == ref_probs.argmax(axis=1))
+                flips = int(np.sum(decisions(batch, probs, spec) != ref_decisions))
+                print(f"  {label:<28} max_dev={deviation.max():.2e}  mean_dev={deviation.mean():.2e}  "
+                      f"argmax_agree={agreement:.4%}  flips={flips}/{len(ref_decisions)}  "
+                      f"{len(batch.X) / elapsed:,.0f} windows/s  speedup={ref_time / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+class HeavyJobLimiter:
+    """
+    Runs CPU-heavy request work (ZIP reads, preprocessing, torch inference) off the event loop.
+    - At most max_concurrent jobs run at once, on a dedicated thread pool
+      (torch and zlib / h5py release the GIL; preprocess_data can add its own process pool)
+    - Up to max_queued more jobs wait for a slot
+    - Anything beyond that is rejected straight away with 503 + Retry-After
+    - iterate() applies the same limits to streaming responses
+    Admission is tracked with a thread lock, so it works with any event loop.
+    """
+
+    def __init__(self, max_concurrent=2, max_queued=8, retry_after=5):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="heavy-job")
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _admit(self):
+        with self._lock:
+            if self._in_flight >= self.max_concurrent + self.max_queued:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy processing other uploads. Please retry shortly.",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        def job():
+            # released when the work itself ends, even if the awaiting request was cancelled
+            try:
+                with self._slots:
+                    return fn(*args, **kwargs)
+            finally:
+                self._release()
+
+        self._admit()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, job)
+        except BaseException:
+            self._release()
+            raise
+        return await future
+
+    def iterate(self, iterator_fn, *args, **kwargs):
+        """
+        Admit now (503 when full) and return a generator that runs iterator_fn(*args)
+        while holding a job slot - for StreamingResponse, which iterates it in a threadpool.
+        """
+        self._admit()
+
+        def generate():
+            try:
+                yield b""  # primed below: from here on close() always releases the admission
+                with self._slots:
+                    yield from iterator_fn(*args, **kwargs)
+            finally:
+                self._release()
+
+        lines = generate()
+        next(lines)
+        return lines
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "running": min(in_flight, self.max_concurrent),
+            "queued": max(0, in_flight - self.max_concurrent),
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+        }
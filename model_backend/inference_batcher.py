@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _PendingRequest:
+    def __init__(self, X, max_rows):
+        # queued one slice at a time: X is the slice waiting for (or in) a batch
+        self._slices = deque(X[start:start + max_rows] for start in range(0, max(len(X), 1), max_rows))
+        self._parts = []
+        self.X = self._slices[0]
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish_slice(self, probs):
+        """Store the current slice's rows; returns True when another slice is left to queue."""
+        self._parts.append(probs)
+        self._slices.popleft()
+        if self._slices:
+            self.X = self._slices[0]
+            return True
+        self.result = self._parts[0] if len(self._parts) == 1 else np.concatenate(self._parts)
+        return False
+
+
+class MicroBatcher:
+    """
+    Coalesces model calls from concurrent requests into shared batches, one queue per model.
+    - Callers block in predict(X) while a worker thread collects pending requests
+    - A batch runs once it holds max_batch_rows rows or its oldest request has waited max_wait_ms
+    - One infer_fn(model, X) call per batch; each caller gets its own rows back, in order
+    - Requests larger than max_batch_rows are split into max_batch_rows slices, one queued at a
+      time: the next slice goes to the back of the queue, so requests that arrived meanwhile
+      are not held up behind a large upload
+    """
+
+    def __init__(self, model, infer_fn, max_batch_rows=4096, max_wait_ms=5.0, name="model"):
+        self.model = model
+        self.infer_fn = infer_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._pending = deque()
+        self._queued_rows = 0
+        self._cond = threading.Condition()
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch_rows = 0
+
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def predict(self, X):
+        request = _PendingRequest(X, self.max_batch_rows)
+        with self._cond:
+            self._pending.append(request)
+            self._queued_rows += len(X)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._pending),
+                "queued_rows": self._queued_rows,
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+                "mean_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "largest_batch_rows": self.largest_batch_rows,
+                "max_batch_rows": self.max_batch_rows,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            while self._queued_rows < self.max_batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rows = [], 0
+            while self._pending:
+                n = len(self._pending[0].X)
+                if batch and rows + n > self.max_batch_rows:
+                    break
+                batch.append(self._pending.popleft())
+                rows += n
+            self._queued_rows -= rows
+            return batch, rows
+
+    def _loop(self):
+        while True:
+            batch, rows = self._next_batch()
+            try:
+                X = batch[0].X if len(batch) == 1 else np.concatenate([r.X for r in batch])
+                probs = self.infer_fn(self.model, X)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            finished, start = [], 0
+            with self._cond:
+                self.batches += 1
+                self.rows += rows
+                self.largest_batch_rows = max(self.largest_batch_rows, rows)
+                for request in batch:
+                    end = start + len(request.X)
+                    if request.finish_slice(probs[start:end]):
+                        self._pending.append(request)
+                        self._queued_rows += len(request.X)
+                    else:
+                        self.requests += 1
+                        finished.append(request)
+                    start = end
+
+            for request in finished:
+                request.done.set()
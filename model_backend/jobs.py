@@ -0,0 +1,175 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    """
+    One background analysis of an uploaded ZIP.
+    status: queued -> running -> done | failed | cancelled
+    stage / records_done / records_total are updated by the pipeline through update().
+    """
+    job_id: str
+    task: str
+    status: str = "queued"
+    stage: str = "queued"
+    records_done: int = 0
+    records_total: int = 0
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    error_status: Optional[int] = None
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+    _future: Any = field(default=None, repr=False)
+    _on_finish: Optional[Callable] = field(default=None, repr=False)
+
+    def update(self, stage=None, records_done=None, records_total=None):
+        """Progress hook for the pipeline; raises JobCancelled once cancellation was requested."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        if stage is not None:
+            self.stage = stage
+        if records_done is not None:
+            self.records_done = records_done
+        if records_total is not None:
+            self.records_total = records_total
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "task": self.task,
+            "status": self.status,
+            "stage": self.stage,
+            "records_done": self.records_done,
+            "records_total": self.records_total,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    In-process job runner.
+    - Jobs run on a local pool of max_workers threads, in submission order
+    - At most max_queued jobs wait for a worker; submit() rejects more with 503 + Retry-After
+    - Finished jobs (and their results) are kept for ttl_seconds, then evicted
+    - cancel() drops queued jobs immediately; running jobs stop at their next progress update
+    """
+
+    def __init__(self, max_workers=2, ttl_seconds=3600, max_queued=16, retry_after=5):
+        self.ttl_seconds = ttl_seconds
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="af-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _queued(self):
+        return sum(job.status == "queued" for job in self._jobs.values())
+
+    def check_capacity(self):
+        """Raise 503 + Retry-After when max_queued jobs are already waiting."""
+        self.purge_expired()
+        with self._lock:
+            self._check_capacity()
+
+    def _check_capacity(self):
+        if self._queued() >= self.max_queued:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many background jobs are queued. Please retry shortly.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+    def submit(self, task: str, fn: Callable, *args, on_finish: Callable = None) -> Job:
+        """
+        Run fn(*args, progress=job.update) in the background; on_finish() runs whatever the outcome.
+        Raises 503 (see check_capacity) without calling on_finish when the queue is full.
+        """
+        self.purge_expired()
+        job = Job(job_id=uuid.uuid4().hex, task=task, _on_finish=on_finish)
+        with self._lock:
+            self._check_capacity()
+            self._jobs[job.job_id] = job
+        job._future = self.executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purge_expired()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            # never started: _run will not be called, so finish it here
+            self._finish(job, "cancelled")
+            if job._on_finish is not None:
+                job._on_finish()
+        return job
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished and job.finished_at is not None and job.finished_at <= cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def _run(self, job, fn, args):
+        try:
+            if job._cancel.is_set():
+                self._finish(job, "cancelled")
+                return
+            job.status = "running"
+            job.started_at = time.time()
+            job.result = fn(*args, progress=job.update)
+            self._finish(job, "done")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except HTTPException as e:
+            job.error, job.error_status = str(e.detail), e.status_code
+            self._finish(job, "failed")
+        except Exception as e:
+            job.error, job.error_status = f"{type(e).__name__}: {e}", 500
+            self._finish(job, "failed")
+        finally:
+            if job._on_finish is not None:
+                job._on_finish()
+
+    @staticmethod
+    def _finish(job, status):
+        job.status = status
+        job.stage = status
+        job.finished_at = time.time()
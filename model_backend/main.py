@@ -1,26 +1,57 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 import uvicorn
+import json
 import os
+import posixpath
+import shutil
 import tempfile
+import threading
 import zipfile
-import pandas as pd
 import torch
 import numpy as np
-import shutil
 import time
+from dataclasses import replace
 from io import BytesIO
 from fastapi.middleware.cors import CORSMiddleware
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from starlette.responses import StreamingResponse
-from typing import Dict, Optional
+from starlette.formparsers import MultiPartParser
+from starlette.responses import JSONResponse, StreamingResponse
+from typing import Dict, Literal, Optional
+from starlette.concurrency import run_in_threadpool
 from model_utils import (
-    load_model, preprocess_data, predict_probabilities,
-    NODEModel, compute_rr_features, ReportRequest
+    preprocess_data, predict_probabilities, iter_record_windows, build_psr_windows,
+    WindowBatch, compute_rr_features, ReportRequest, WINDOW_SIZE, STEP_SIZE, INPUT_SCALE
 )
+from model_registry import MODEL_SPECS, ModelPreloader, ModelRegistry, parse_model_precisions
+from autotune import DEFAULT_CACHE_PATH, TuningCache, apply_thread_count
+from zip_ingest import ZipRecords, UploadSizeLimitMiddleware
+from preprocess_cache import PreprocessCache
+from heavy_jobs import HeavyJobLimiter
+from jobs import JobManager
+from inference_batcher import MicroBatcher
 
 app = FastAPI()
 
+# Upload limits
+# - Uploads are streamed by the multipart parser in chunks into a spooled file that
+#   stays in memory up to UPLOAD_SPOOL_MAX_MEMORY bytes and rolls over to a temp file after
+# - Bodies above MAX_UPLOAD_BYTES are rejected with 413 before / while they stream in
+# - The ZIP is then read in place from the spool, one member at a time, so peak ingest
+#   memory per request is about UPLOAD_SPOOL_MAX_MEMORY + the largest single ZIP member
+#   (preprocessing memory comes on top and scales with the number of RR beats)
+MAX_UPLOAD_BYTES = int(os.environ.get("AF_MAX_UPLOAD_BYTES", 2 * 1024 ** 3))
+UPLOAD_SPOOL_MAX_MEMORY = int(os.environ.get("AF_UPLOAD_SPOOL_MAX_MEMORY", 8 * 1024 ** 2))
+
+# ZIP manifest quotas, checked from the central directory before any member is inflated
+# (zipfile never inflates a member past its declared size, so these bound the real work)
+MAX_ZIP_MEMBERS = int(os.environ.get("AF_MAX_ZIP_MEMBERS", 1000))
+MAX_ZIP_MEMBER_BYTES = int(os.environ.get("AF_MAX_ZIP_MEMBER_BYTES", 1024 ** 3))
+MAX_ZIP_TOTAL_BYTES = int(os.environ.get("AF_MAX_ZIP_TOTAL_BYTES", 8 * 1024 ** 3))
+MAX_ZIP_COMPRESSION_RATIO = float(os.environ.get("AF_MAX_ZIP_COMPRESSION_RATIO", 100))
+
+MultiPartParser.spool_max_size = UPLOAD_SPOOL_MAX_MEMORY
+# Added before CORS so 413 responses still carry CORS headers
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,201 +60,592 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-MODEL_PATH = "Three_Class_Models/saved_models/NODE_PSR_best.pth"
-input_dim = 138
-num_classes = 3
-model = load_model(NODEModel, MODEL_PATH, input_dim, num_classes)
+# Per-record preprocessing worker processes (1 = run records serially in the request)
+PREPROCESS_WORKERS = int(os.environ.get("AF_PREPROCESS_WORKERS", 1))
+
+# Cleaned-RR cache shared by all endpoints (0 bytes disables it; the disk tier is optional)
+PREPROCESS_CACHE_BYTES = int(os.environ.get("AF_PREPROCESS_CACHE_BYTES", 256 * 1024 ** 2))
+PREPROCESS_CACHE_DIR = os.environ.get("AF_PREPROCESS_CACHE_DIR")
+PREPROCESS_CACHE_DISK_BYTES = int(os.environ.get("AF_PREPROCESS_CACHE_DISK_BYTES", 2 * 1024 ** 3))
+preprocess_cache = (
+    PreprocessCache(PREPROCESS_CACHE_BYTES, PREPROCESS_CACHE_DIR, PREPROCESS_CACHE_DISK_BYTES)
+    if PREPROCESS_CACHE_BYTES > 0 else None
+)
+
+# Heavy request work (ingest, preprocessing, inference) runs off the event loop:
+# AF_MAX_HEAVY_JOBS at once, AF_MAX_QUEUED_JOBS waiting, anything more gets 503 + Retry-After
+heavy_jobs = HeavyJobLimiter(
+    max_concurrent=int(os.environ.get("AF_MAX_HEAVY_JOBS", 2)),
+    max_queued=int(os.environ.get("AF_MAX_QUEUED_JOBS", 8)),
+    retry_after=int(os.environ.get("AF_RETRY_AFTER_SECONDS", 5)),
+)
+
+# Background jobs for long recordings (POST /jobs/): worker threads + result retention
+# - every queued job keeps a copy of its upload, so at most AF_MAX_QUEUED_BACKGROUND_JOBS wait
+#   for a worker; more submissions get 503 + Retry-After, like the sync endpoints
+job_manager = JobManager(
+    max_workers=int(os.environ.get("AF_JOB_WORKERS", 1)),
+    ttl_seconds=int(os.environ.get("AF_JOB_TTL_SECONDS", 3600)),
+    max_queued=int(os.environ.get("AF_MAX_QUEUED_BACKGROUND_JOBS", 16)),
+    retry_after=int(os.environ.get("AF_RETRY_AFTER_SECONDS", 5)),
+)
 
-TWO_MODEL_PATH = "Two_Class_Models/saved_models/NODE_PSR_two_class_best.pth"
-two_model = load_model(NODEModel, TWO_MODEL_PATH, input_dim, 2)
+# ODE solver for all NODE models: "dopri5" (default, as trained), "dopri5:1e-5:1e-7" (rtol:atol)
+# or a fixed-step solver such as "rk4:8". Check a candidate with benchmarks/validate_solver.py first.
+ODE_SOLVER = os.environ.get("AF_ODE_SOLVER", "dopri5")
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device).eval()
-two_model.to(device).eval()
 
-# Warmup (avoid first-request latency)
-dummy = torch.zeros((4096, 138), device=device)
-with torch.inference_mode():
-    _ = model(dummy)
-    _ = two_model(dummy)
-if device.type == "cuda":
-    torch.cuda.synchronize()
+# Model registry (model_registry.MODEL_SPECS): all shipped checkpoints, loaded on first use and
+# selectable per request with ?predict_model= / ?detect_model=
+# - PREDICT_MODEL / DETECT_MODEL are the defaults, loaded + warmed up at startup (see STARTUP_MODE)
+# - AF_MODEL_PATH / AF_TWO_MODEL_PATH point a default at another file, e.g. a TorchScript
+#   export from model_export.py (*.ts, solver baked in)
+# - AF_MODEL_PRECISIONS: per-model precision, "NODE_raw=int8,PSR_hybrid=float32"; "float32" (default)
+#   or "int8" (CPU + fixed-step solver only). AF_MODEL_PRECISION / AF_TWO_MODEL_PRECISION set
+#   the default predict / detect model's entry
+PREDICT_MODEL = os.environ.get("AF_PREDICT_MODEL", "NODE_PSR")
+DETECT_MODEL = os.environ.get("AF_DETECT_MODEL", "NODE_PSR_two_class")
+MODEL_CACHE_BYTES = int(os.environ.get("AF_MODEL_CACHE_BYTES", 512 * 1024 ** 2))
+
+
+def _model_specs():
+    specs = dict(MODEL_SPECS)
+    precisions = parse_model_precisions(os.environ.get("AF_MODEL_PRECISIONS"), specs)
+    for name, path_var, precision_var in (
+        (PREDICT_MODEL, "AF_MODEL_PATH", "AF_MODEL_PRECISION"),
+        (DETECT_MODEL, "AF_TWO_MODEL_PATH", "AF_TWO_MODEL_PRECISION"),
+    ):
+        specs[name] = replace(specs[name], path=os.environ.get(path_var, specs[name].path))
+        if precision_var in os.environ:
+            precision = parse_model_precisions(f"{name}={os.environ[precision_var]}", specs)[name]
+            if precisions.setdefault(name, precision) != precision:
+                raise ValueError(f"{precision_var}={precision} conflicts with AF_MODEL_PRECISIONS {name}={precisions[name]}")
+    for name, precision in precisions.items():
+        specs[name] = replace(specs[name], precision=precision)
+    return specs
+
+
+# Inference autotuning (autotune.py): per-model batch size + one torch thread count for the process
+# - AUTOTUNE "cached" (default): apply tuned settings from AF_AUTOTUNE_CACHE (the thread count now,
+#   batch sizes when a model loads)
+# - "auto": also tune what the default models are missing during startup (adds ~1 min before /ready
+#   on first start, then cached); stopped, and left for the next start, once a request is in flight
+# - "off": DEFAULT_BATCH_SIZE and torch's thread count
+# - the same cache is filled offline with `python autotune.py`
+AUTOTUNE = os.environ.get("AF_AUTOTUNE", "cached")
+if AUTOTUNE not in ("off", "cached", "auto"):
+    raise ValueError(f"Unknown AF_AUTOTUNE {AUTOTUNE!r}, expected off, cached or auto")
+tuning_cache = None if AUTOTUNE == "off" else TuningCache(os.environ.get("AF_AUTOTUNE_CACHE", DEFAULT_CACHE_PATH))
+if tuning_cache is not None:
+    apply_thread_count(tuning_cache)
+
+model_registry = ModelRegistry(
+    _model_specs(), solver=ODE_SOLVER, device=device, max_bytes=MODEL_CACHE_BYTES, tuning_cache=tuning_cache
+)
+
+# Startup
+# - STARTUP_MODE "background" (default): the default models load + warm up on a thread, the server
+#   accepts connections right away; GET / is liveness, GET /ready turns 200 once they are loaded
+# - "eager": load + warm up before the import finishes (ready as soon as the server is up)
+# - "lazy": nothing preloaded, every model loads on its first request
+# - WARMUP_ROWS rows of zeros per default model, at its input width (0 = no warmup)
+STARTUP_MODE = os.environ.get("AF_STARTUP_MODE", "background")
+WARMUP_ROWS = int(os.environ.get("AF_WARMUP_ROWS", 64))
+if STARTUP_MODE not in ("background", "eager", "lazy"):
+    raise ValueError(f"Unknown AF_STARTUP_MODE {STARTUP_MODE!r}, expected background, eager or lazy")
+
+# Preprocessing pool workers (model_utils.get_preprocess_pool) re-import this file as __mp_main__ when
+# the server is started with `python main.py`; they never serve requests, so nothing is preloaded there
+def _requests_in_flight():
+    jobs = job_manager.stats()
+    heavy = heavy_jobs.stats()
+    return heavy["running"] + heavy["queued"] + jobs.get("queued", 0) + jobs.get("running", 0) > 0
+
+
+model_preloader = ModelPreloader(
+    model_registry,
+    [] if STARTUP_MODE == "lazy" or __name__ == "__mp_main__" else [PREDICT_MODEL, DETECT_MODEL],
+    WARMUP_ROWS,
+    autotune=AUTOTUNE == "auto",
+    busy=_requests_in_flight,
+)
+if STARTUP_MODE == "eager":
+    model_preloader.run()
+else:
+    model_preloader.start()
+
+
+def _run_model(model_name, X):
+    return predict_probabilities(model_registry.get(model_name), X)
+
+
+# Cross-request micro-batching: concurrent requests share model calls (one queue per model)
+# - a batch runs at BATCH_MAX_ROWS rows or once its oldest request waited BATCH_MAX_WAIT_MS
+BATCH_MAX_ROWS = int(os.environ.get("AF_BATCH_MAX_ROWS", 4096))
+BATCH_MAX_WAIT_MS = float(os.environ.get("AF_BATCH_MAX_WAIT_MS", 5))
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _batcher(spec):
+    with _batchers_lock:
+        if spec.name not in _batchers:
+            _batchers[spec.name] = MicroBatcher(
+                spec.name, _run_model, BATCH_MAX_ROWS, BATCH_MAX_WAIT_MS, name=spec.name
+            )
+        return _batchers[spec.name]
+
 
 @app.get("/")
 def root():
     return {"status": "running", "message": "AF project backend is live."}
 
 
-def _fix_flat_structure(records_dir: str) -> None:
-    """
-    If extracted ZIP has no subfolders, group files into record folders.
-    Example file: record_022_rr_00.csv -> folder: record_022/
-    """
-    if not any(os.path.isdir(os.path.join(records_dir, d)) for d in os.listdir(records_dir)):
-        for f in os.listdir(records_dir):
-            p = os.path.join(records_dir, f)
-            if os.path.isfile(p):
-                rid = "_".join(f.split("_")[:2])  
-                target = os.path.join(records_dir, rid)
-                os.makedirs(target, exist_ok=True)
-                shutil.move(p, os.path.join(target, f))
+@app.get("/ready")
+def ready():
+    status = model_preloader.status()
+    if not model_preloader.ready:
+        return JSONResponse(status, status_code=503, headers={"Retry-After": "1"})
+    return status
+
+
+@app.get("/jobs/stats")
+def heavy_job_stats():
+    return {**heavy_jobs.stats(), "background_jobs": job_manager.stats()}
+
+
+@app.get("/inference/stats")
+def inference_stats():
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {name: batcher.stats() for name, batcher in batchers.items()}
+
 
+@app.get("/models")
+def list_models():
+    return {
+        "defaults": {"predict": PREDICT_MODEL, "detect": DETECT_MODEL},
+        "models": model_registry.describe(),
+        "cache": model_registry.stats(),
+    }
 
-def _validate_zip_files(records_dir: str) -> None:
+
+@app.get("/cache/stats")
+def cache_stats():
+    if preprocess_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **preprocess_cache.stats()}
+
+
+def _is_unsafe_member_path(name: str) -> bool:
+    normalized = name.replace("\\", "/")
+    if normalized.startswith("/") or (len(normalized) > 1 and normalized[1] == ":"):
+        return True
+    return ".." in posixpath.normpath(normalized).split("/")
+
+
+def _validate_zip_files(zf: zipfile.ZipFile) -> None:
     """
-    Validate file extensions inside extracted ZIP (recursive).
+    Validate the uploaded ZIP from its central directory (nothing is inflated):
+    - member count, per-member and total uncompressed size (413)
+    - path traversal, compression ratio and file extensions (400)
     Only allows .h5 and .csv.
     """
+    infos = zf.infolist()
+    if len(infos) > MAX_ZIP_MEMBERS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"ZIP contains {len(infos)} entries; at most {MAX_ZIP_MEMBERS} are allowed."
+        )
+
     invalid = []
-    for root, _, files in os.walk(records_dir):
-        for f in files:
-            if not f.lower().endswith((".h5", ".csv")):
-                invalid.append(os.path.relpath(os.path.join(root, f), records_dir))
+    total_size = 0
+    for info in infos:
+        if _is_unsafe_member_path(info.filename):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsafe path in ZIP: {info.filename}"
+            )
+        if info.is_dir():
+            continue
+        if not info.filename.lower().endswith((".h5", ".csv")):
+            invalid.append(info.filename)
+            continue
+
+        if info.file_size > MAX_ZIP_MEMBER_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{info.filename} is {info.file_size} bytes uncompressed; "
+                       f"the limit per file is {MAX_ZIP_MEMBER_BYTES} bytes."
+            )
+        total_size += info.file_size
+        if total_size > MAX_ZIP_TOTAL_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"ZIP contents exceed the total uncompressed limit of {MAX_ZIP_TOTAL_BYTES} bytes."
+            )
+        if info.file_size > 0 and info.file_size > info.compress_size * MAX_ZIP_COMPRESSION_RATIO:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{info.filename} has a suspicious compression ratio "
+                       f"(more than {MAX_ZIP_COMPRESSION_RATIO:g}x)."
+            )
+
     if invalid:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid file(s) found in ZIP: {', '.join(invalid)}. Only .h5 or .csv allowed."
         )
 
-@app.post("/predict/")
-async def predict(
-    records_zip: UploadFile = File(...),
-):
-    t_start = time.time()
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        zip_path = os.path.join(tmpdir, "records.zip")
 
-        #Read ZIP bytes & save
-        records_bytes = await records_zip.read()
-        with open(zip_path, "wb") as f:
-            f.write(records_bytes)
+def _open_records_zip(records_file) -> ZipRecords:
+    """
+    Open the uploaded ZIP in place (spooled upload file, no copy) and group its
+    members into records from the central directory.
+    Flat ZIPs (record_022_rr_00.h5 ...) and per-record folders are both accepted.
+    """
+    try:
+        zf = zipfile.ZipFile(records_file, "r")
+    except zipfile.BadZipFile:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid records.zip file. Please upload a valid ZIP archive."
+        )
 
-        #Extract ZIP
-        records_dir = os.path.join(tmpdir, "Records")
-        try:
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                zip_ref.extractall(records_dir)
-        except zipfile.BadZipFile:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid records.zip file. Please upload a valid ZIP archive."
-            )
-        _validate_zip_files(records_dir)
-        _fix_flat_structure(records_dir)
-
-        available_records = {
-            d.strip()
-            for d in os.listdir(records_dir)
-            if os.path.isdir(os.path.join(records_dir, d))
-        }
-        if not available_records:
+    try:
+        _validate_zip_files(zf)
+        archive = ZipRecords(zf)
+        if not archive.record_ids():
             raise HTTPException(
                 status_code=400,
-                detail="No record folders found in ZIP after structure fix."
+                detail="No records found in ZIP."
             )
+    except HTTPException:
+        zf.close()
+        raise
+    return archive
 
-        # Preprocessing
+def _no_progress(**kwargs):
+    pass
+
+
+def _preprocess_upload(records_file, spec, progress=_no_progress):
+    """Ingest the uploaded ZIP and build the normalized window batch for spec's input representation."""
+    progress(stage="ingest")
+    with _open_records_zip(records_file) as archive:
+        # Preprocessing + normalization (/1000, done in place)
+        progress(stage="preprocess")
         try:
-            X, record_ids, raw_rr_dict = preprocess_data(records_dir=records_dir)
+            return preprocess_data(
+                archive=archive, window_size=WINDOW_SIZE, step_size=STEP_SIZE, workers=PREPROCESS_WORKERS,
+                scale=INPUT_SCALE, cache=preprocess_cache, progress=progress, **spec.window_params
+            )
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
-        
-        # Normalization
-        X = X / 1000.0
-
-        # Model inference 
-        with torch.no_grad():
-            probs = predict_probabilities(model, X)
-
-        # Aggregate prob_danger (p75)
-        prob_danger = 1 - probs[:, 0]
-        df = pd.DataFrame({"record_id": record_ids, "prob_danger": prob_danger})
-
-        agg_probs = (
-            df.groupby("record_id")["prob_danger"]
-            .quantile(0.75)
-            .reset_index()
-            .rename(columns={"prob_danger": "p75_prob_danger"})
-        )
 
-        # RR features
-        rr_features = {rid: compute_rr_features(rri) for rid, rri in raw_rr_dict.items()}
-        response = {
-            "record_id": agg_probs["record_id"].tolist(),
-            "prob_danger": agg_probs["p75_prob_danger"].tolist(),
-            "rr_features": rr_features,
-        }
 
-        print(f"[/predict] TOTAL endpoint time: {time.time() - t_start:.4f}s")
-        return response
+def _windows_for(spec, batch, raw_rr, built_for):
+    """batch (built for the built_for spec) in spec's input representation, rebuilt from the cleaned RR if needed."""
+    if spec.window_params == built_for.window_params:
+        return batch
+    X, offsets = build_psr_windows(
+        [raw_rr[rid] for rid in batch.record_ids],
+        window_size=WINDOW_SIZE, step_size=STEP_SIZE, scale=INPUT_SCALE, **spec.window_params
+    )
+    return WindowBatch(X, list(batch.record_ids), offsets)
+
+
+def _p75_prob_danger(batch, probs):
+    # prob_danger = 1 - P(SR), aggregated per record with the 75th percentile
+    return batch.quantile(1 - probs[:, 0], 0.75)
+
+
+def _max_prob_af(batch, probs):
+    # max AF prob per record
+    return batch.max(probs[:, 1])
+
+
+AGGREGATIONS = {"p75_danger": _p75_prob_danger, "max_af": _max_prob_af}
+
+
+def _score(spec, batch):
+    """Per-record aggregated probability of spec's model over batch."""
+    probs = _batcher(spec).predict(batch.X)
+    return AGGREGATIONS[spec.aggregation](batch, probs)
+
+
+def _resolve_model(name, task):
+    """Spec of the requested model (the default for task when name is None); 400 if it is for another task."""
+    spec = model_registry.spec(name or (PREDICT_MODEL if task == "predict" else DETECT_MODEL))
+    if spec.task != task:
+        raise HTTPException(status_code=400, detail=f"Model {spec.name!r} is a {spec.task} model, not {task}.")
+    return spec
+
+
+def _resolve_models(task, predict_model=None, detect_model=None):
+    """(predict spec, detect spec) used by task; None for the model the task does not run."""
+    predict_spec = _resolve_model(predict_model, "predict") if task in ("predict", "analyze") else None
+    detect_spec = _resolve_model(detect_model, "detect") if task in ("detect", "analyze") else None
+    return predict_spec, detect_spec
+
+
+def _model_fields(predict_spec=None, detect_spec=None):
+    """
+    Which model and decision threshold produced the probabilities of a response:
+    model / threshold, or predict_model / predict_threshold + detect_* when both models ran.
+    """
+    specs = [(prefix, spec) for prefix, spec in (("predict_", predict_spec), ("detect_", detect_spec)) if spec is not None]
+    fields = {}
+    for prefix, spec in specs:
+        prefix = prefix if len(specs) > 1 else ""
+        fields[f"{prefix}model"] = spec.name
+        fields[f"{prefix}threshold"] = spec.threshold
+    return fields
+
+
+def _predict_response(records_file, predict_spec, detect_spec=None, progress=_no_progress):
+    t_start = time.time()
+
+    batch, raw_rr_dict = _preprocess_upload(records_file, predict_spec, progress)
+    progress(stage="inference")
+
+    # Model inference + aggregation (prob_danger, p75)
+    p75_prob_danger = _score(predict_spec, batch)
+
+    # RR features
+    rr_features = {rid: compute_rr_features(rri) for rid, rri in raw_rr_dict.items()}
+    response = {
+        "record_id": list(batch.record_ids),
+        "prob_danger": p75_prob_danger.tolist(),
+        "rr_features": rr_features,
+        **_model_fields(predict_spec),
+    }
+
+    print(f"[/predict] TOTAL endpoint time: {time.time() - t_start:.4f}s")
+    return response
+
+
+def _detect_response(records_file, predict_spec=None, detect_spec=None, progress=_no_progress):
+    t_start = time.time()
+
+    batch, raw_rr_dict = _preprocess_upload(records_file, detect_spec, progress)
+    progress(stage="inference")
+
+    # Model inference + aggregation (max AF prob per record)
+    prob_af = _score(detect_spec, batch)
+
+    # RR features
+    rr_features = {rid: compute_rr_features(rri) for rid, rri in raw_rr_dict.items()}
+    response = {
+        "record_ids": list(batch.record_ids),
+        "prob_af": prob_af.tolist(),
+        "rr_features": rr_features,
+        **_model_fields(detect_spec=detect_spec),
+    }
+
+    print(f"[/detect] TOTAL endpoint time: {time.time() - t_start:.4f}s")
+    return response
+
+
+def _analyze_response(records_file, predict_spec, detect_spec, progress=_no_progress):
+    t_start = time.time()
+
+    batch, raw_rr_dict = _preprocess_upload(records_file, predict_spec, progress)
+    progress(stage="inference")
+
+    prob_danger = _score(predict_spec, batch)
+    prob_af = _score(detect_spec, _windows_for(detect_spec, batch, raw_rr_dict, predict_spec))
+
+    rr_features = {rid: compute_rr_features(rri) for rid, rri in raw_rr_dict.items()}
+    response = {
+        "record_ids": list(batch.record_ids),
+        "prob_danger": prob_danger.tolist(),
+        "prob_af": prob_af.tolist(),
+        "rr_features": rr_features,
+        **_model_fields(predict_spec, detect_spec),
+    }
+
+    print(f"[/analyze] TOTAL endpoint time: {time.time() - t_start:.4f}s")
+    return response
+
+
+def _record_lines(archive, task, predict_spec, detect_spec):
+    """
+    NDJSON lines, one per record, emitted as soon as that record is preprocessed + scored.
+    Same fields / aggregation rules as the batch responses. Windows are built and scored one
+    block at a time (iter_record_windows); only their probabilities are kept until the record ends.
+    """
+    t_start = time.time()
+    produced = 0
+    scored = [(key, spec) for key, spec in (("prob_danger", predict_spec), ("prob_af", detect_spec)) if spec is not None]
+    model_fields = _model_fields(predict_spec, detect_spec)
+    window_params = []
+    for _, spec in scored:
+        if spec.window_params not in window_params:
+            window_params.append(spec.window_params)
+    with archive:
+        for record_id, blocks, summary in iter_record_windows(
+            archive=archive, window_size=WINDOW_SIZE, step_size=STEP_SIZE, window_params=window_params,
+            workers=PREPROCESS_WORKERS, scale=INPUT_SCALE, cache=preprocess_cache,
+        ):
+            probs = {key: [] for key, _ in scored}
+            for block in blocks:
+                for key, spec in scored:
+                    probs[key].append(_batcher(spec).predict(block[window_params.index(spec.window_params)]))
+            line = {"record_id": record_id}
+            for key, spec in scored:
+                record_probs = np.concatenate(probs[key])
+                record_batch = WindowBatch(None, [record_id], np.array([0, len(record_probs)]))
+                line[key] = float(AGGREGATIONS[spec.aggregation](record_batch, record_probs)[0])
+            line["rr_features"] = summary.features()
+            line.update(model_fields)
+            produced += 1
+            yield json.dumps(line) + "\n"
+
+    if produced == 0:
+        yield json.dumps({
+            "error": "No valid records processed. Check zip structure (record folders + RR file names)."
+        }) + "\n"
+    print(f"[/{task} stream] TOTAL endpoint time: {time.time() - t_start:.4f}s")
+
+
+async def _stream_records(records_file, task, specs):
+    # ZIP errors are still reported as 400 / 413 before the 200 stream starts
+    archive = await run_in_threadpool(_open_records_zip, records_file)
+    try:
+        lines = heavy_jobs.iterate(_record_lines, archive, task, *specs)
+    except HTTPException:
+        archive.close()
+        raise
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+@app.post("/predict/")
+async def predict(
+    records_zip: UploadFile = File(...),
+    stream: bool = False,
+    predict_model: Optional[str] = None,
+):
+    specs = _resolve_models("predict", predict_model)
+    if stream:
+        return await _stream_records(records_zip.file, "predict", specs)
+    return await heavy_jobs.run(_predict_response, records_zip.file, *specs)
 
 @app.post("/detect/")
 async def detect(
     records_zip: UploadFile = File(...),
+    stream: bool = False,
+    detect_model: Optional[str] = None,
 ):
+    specs = _resolve_models("detect", detect_model=detect_model)
+    if stream:
+        return await _stream_records(records_zip.file, "detect", specs)
+    return await heavy_jobs.run(_detect_response, records_zip.file, *specs)
 
-    t_start = time.time()
-    with tempfile.TemporaryDirectory() as tmpdir:
-        zip_path = os.path.join(tmpdir, "records.zip")
-
-        records_bytes = await records_zip.read()
-        with open(zip_path, "wb") as f:
-            f.write(records_bytes)
-        records_dir = os.path.join(tmpdir, "Records")
-        try:
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                zip_ref.extractall(records_dir)
-        except zipfile.BadZipFile:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid records.zip file. Please upload a valid ZIP archive."
-            )
+@app.post("/analyze/")
+async def analyze(
+    records_zip: UploadFile = File(...),
+    stream: bool = False,
+    predict_model: Optional[str] = None,
+    detect_model: Optional[str] = None,
+):
+    """
+    Early prediction + AF detection for one upload.
+    Ingest and preprocessing run once; both models score the same windows
+    (rebuilt from the cleaned RR when the two models take different input representations).
+    ?stream=true returns NDJSON, one line per record as soon as it is scored.
+    """
+    specs = _resolve_models("analyze", predict_model, detect_model)
+    if stream:
+        return await _stream_records(records_zip.file, "analyze", specs)
+    return await heavy_jobs.run(_analyze_response, records_zip.file, *specs)
 
-        _validate_zip_files(records_dir)
-        _fix_flat_structure(records_dir)
+JOB_TASKS = {
+    "predict": _predict_response,
+    "detect": _detect_response,
+    "analyze": _analyze_response,
+}
 
-        available_records = {
-            d.strip()
-            for d in os.listdir(records_dir)
-            if os.path.isdir(os.path.join(records_dir, d))
-        }
-        if not available_records:
-            raise HTTPException(
-                status_code=400,
-                detail="No record folders found in ZIP after structure fix."
-            )
 
-        # Preprocess
-        try:
-            X, record_ids, raw_rr_dict = preprocess_data(records_dir=records_dir)
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=str(e))
+def _copy_upload(records_file):
+    """Job-owned copy of the upload (the request's spool is closed when the request ends)."""
+    upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+    records_file.seek(0)
+    shutil.copyfileobj(records_file, upload, 1024 * 1024)
+    upload.seek(0)
+    return upload
 
-        # Normalize
-        X = X / 1000.0
 
-        with torch.no_grad():
-            probs = predict_probabilities(two_model, X)
+def _get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return job
 
-        # Aggregate (max AF prob per record)
-        prob_af = probs[:, 1]
-        df = pd.DataFrame({"record_id": record_ids, "prob_af": prob_af})
-        agg_probs = df.groupby("record_id")["prob_af"].max().reset_index()
 
-        # RR features
-        rr_features = {rid: compute_rr_features(rri) for rid, rri in raw_rr_dict.items()}
-        response = {
-            "record_ids": agg_probs["record_id"].tolist(),
-            "prob_af": agg_probs["prob_af"].tolist(),
-            "rr_features": rr_features,
-        }
+@app.post("/jobs/", status_code=202)
+async def submit_job(
+    task: Literal["predict", "detect", "analyze"] = "analyze",
+    records_zip: UploadFile = File(...),
+    predict_model: Optional[str] = None,
+    detect_model: Optional[str] = None,
+):
+    """
+    Queue a ZIP for background processing (same pipeline + response as the sync endpoint).
+    Poll GET /jobs/{job_id}, then fetch GET /jobs/{job_id}/result.
+    """
+    specs = _resolve_models(task, predict_model, detect_model)
+    job_manager.check_capacity()  # 503 before copying the upload
+    upload = await run_in_threadpool(_copy_upload, records_zip.file)
+    try:
+        job = job_manager.submit(task, JOB_TASKS[task], upload, *specs, on_finish=upload.close)
+    except HTTPException:
+        upload.close()
+        raise
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return _get_job(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = _get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=job.error_status or 500, detail=job.error)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail="Job was cancelled.")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is not finished yet (status: {job.status}).")
+    return job.result
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return job.to_dict()
+
+def _report_decision_rule(report):
+    """(model name or None, threshold): report.threshold if given, else the threshold of report.model."""
+    if report.threshold is not None:
+        return report.model, report.threshold
+    spec = _resolve_model(report.model, "predict" if report.task_type == "early_prediction" else "detect")
+    return spec.name, spec.threshold
 
-        print(f"[/detect] TOTAL endpoint time: {time.time() - t_start:.4f}s")
-        return response
 
 @app.post("/report/")
 async def generate_report(report: ReportRequest):
+    model_name, threshold = _report_decision_rule(report)
+
+    # reportlab is only needed here, keep it off the startup path
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
     buffer = BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
@@ -242,14 +664,18 @@ async def generate_report(report: ReportRequest):
     c.drawString(50, y, f"Date/Time: {report.timestamp or 'N/A'}")
     y -= 16
 
+    model_text = f"Model: {model_name}, " if model_name else ""
+    c.drawString(50, y, f"{model_text}decision threshold: {threshold * 100:.0f}%")
+    y -= 16
+
     p = report.prob_af / 100.0
     if report.task_type == "early_prediction":
-        decision = "High Risk" if p >= 0.53 else "Low Risk"
+        decision = "High Risk" if p >= threshold else "Low Risk"
         c.drawString(50, y, f"Risk Level: {decision}")
         y -= 16
         c.drawString(50, y, f"Probability of Danger: {round(report.prob_af)}%")
     else:
-        decision = "AF Detected" if p >= 0.65 else "No AF Detected"
+        decision = "AF Detected" if p >= threshold else "No AF Detected"
         c.drawString(50, y, f"Decision: {decision}")
         y -= 16
         c.drawString(50, y, f"AF Probability: {round(report.prob_af)}%")
@@ -266,7 +692,7 @@ async def generate_report(report: ReportRequest):
 
     c.setFont("Helvetica", 11)
     for key, value in report.rr_features.items():
-        c.drawString(60, y, f"{key}: {value:.4f}")
+        c.drawString(60, y, f"{key}: {value:.4f}" if value is not None else f"{key}: N/A")
         y -= 16
 
     mean_rr = report.rr_features.get("mean_rr")
@@ -292,10 +718,10 @@ async def generate_report(report: ReportRequest):
 
     c.setFont("Helvetica", 11)
     if report.task_type == "early_prediction":
-        prob_text = "The model predicts a high likelihood of AF occurring soon." if p >= 0.53 \
+        prob_text = "The model predicts a high likelihood of AF occurring soon." if p >= threshold \
             else "The model predicts a low likelihood of imminent AF."
     else:
-        prob_text = "AF Detected." if p >= 0.65 else "No AF Detected."
+        prob_text = "AF Detected." if p >= threshold else "No AF Detected."
 
     c.drawString(60, y, prob_text)
     y -= 16
@@ -1,17 +1,60 @@
+import asyncio
 import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
 import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+import h5py
 import pandas as pd
 import numpy as np
 import torch
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
-from main import app
+import main
+from main import app, _open_records_zip, _validate_zip_files
 from model_utils import (
     phase_space_reconstruct,
     compute_rr_features,
     predict_probabilities,
+    preprocess_data,
+    get_preprocess_pool,
+    build_psr_windows,
+    count_windows,
     NODEModel,
+    HybridNODEAttentionModel,
+    SolverConfig,
+    FIXED_STEP_SOLVERS,
+    ADAPTIVE_SOLVERS,
+    load_checkpoint,
+    load_model,
+    quantize_model,
+    InferenceConfig,
+    get_inference_config,
+    set_inference_config,
+    WindowBatch,
+    ReportRequest,
+    RRSummary,
+    iter_psr_windows,
+    iter_record_windows,
 )
+from Dataset_preparation.build_dataset import BuildParams, FeatureStore, build_dataset, load_record_filter, window_labels
+from Dataset_preparation.metadata import MetadataIndex
+from Dataset_preparation.record import ECG_FRONT_SAMPLES, IntervalLabels, Record, RRCleaner, RecordFiles, RecordMetadata, clean_rr, clean_rr_reference, create_record
+from model_export import export_torchscript
+from preprocess_cache import PreprocessCache
+from heavy_jobs import HeavyJobLimiter
+from jobs import JobManager
+from inference_batcher import MicroBatcher
+from model_registry import MODEL_SPECS, ModelPreloader, ModelRegistry, parse_model_precisions
+from autotune import AutotuneInterrupted, TuningCache, autotune_model, autotune_threads, model_key
+from zip_ingest import ZipRecords, UploadSizeLimitMiddleware, record_id_for
 
 client = TestClient(app)
 
@@ -24,6 +67,31 @@ def create_dummy_zip():
     memory_file.seek(0)
     return memory_file
 
+def make_rr_h5_bytes(rr):
+    buffer = io.BytesIO()
+    with h5py.File(buffer, "w") as f:
+        f.create_dataset("rr", data=np.asarray(rr, dtype=np.float64))
+    return buffer.getvalue()
+
+def make_rr(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 800 + rng.normal(0, 40, size=n)
+
+def create_record_zip(records, nested=False):
+    """records: {record_id: [rr_day_0, rr_day_1, ...]} -> in-memory ZIP of RR files + rr_labels.csv"""
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as zf:
+        for record_id, days in records.items():
+            prefix = f"{record_id}/" if nested else ""
+            for day, rr in enumerate(days):
+                zf.writestr(f"{prefix}{record_id}_rr_{day:02d}.h5", make_rr_h5_bytes(rr))
+            zf.writestr(
+                f"{prefix}{record_id}_rr_labels.csv",
+                "start_file_index,start_rr_index,end_file_index,end_rr_index\n0,10,0,20\n"
+            )
+    memory_file.seek(0)
+    return memory_file
+
 def pytest_close_float(a, b, tol=1e-8) -> bool:
     try:
         return abs(float(a) - float(b)) <= tol
@@ -91,6 +159,523 @@ def test_compute_rr_features_handles_zero_mean():
     assert features["mean_rr"] == 0.0
     assert features["estimated_hr_bpm"] is None
 
+# In-memory ZIP ingest
+def test_record_id_for_flat_and_nested_members():
+    assert record_id_for("record_022_rr_00.h5") == "record_022"
+    assert record_id_for("record_022/record_022_rr_00.h5") == "record_022"
+    assert record_id_for("Records/record_022/record_022_rr_labels.csv") == "record_022"
+
+def test_record_index_groups_members_by_kind():
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as zf:
+        for name in ["record_001_rr_01.h5", "record_001_rr_00.h5", "record_001_ecg_00.h5",
+                     "record_001_rr_labels.csv", "record_001_ecg_labels.csv", "record_002_rr_00.h5"]:
+            zf.writestr(name, b"")
+    with zipfile.ZipFile(memory_file) as zf:
+        records = ZipRecords(zf).records
+
+    assert sorted(records) == ["record_001", "record_002"]
+    files = records["record_001"]
+    assert [m.name for m in files.rr] == ["record_001_rr_00.h5", "record_001_rr_01.h5"]
+    assert [m.name for m in files.ecg] == ["record_001_ecg_00.h5"]
+    assert [m.name for m in files.rr_labels] == ["record_001_rr_labels.csv"]
+    assert [m.name for m in files.ecg_labels] == ["record_001_ecg_labels.csv"]
+
+def test_preprocess_data_from_zip_matches_extracted_dir(tmp_path):
+    records = {
+        "record_001": [make_rr(300, 1), make_rr(120, 2)],
+        "record_002": [make_rr(40, 3)],
+    }
+    with zipfile.ZipFile(create_record_zip(records, nested=True)) as zf:
+        zf.extractall(tmp_path)
+        batch_dir, rr_dir = preprocess_data(records_dir=str(tmp_path))
+        batch_zip, rr_zip = preprocess_data(archive=ZipRecords(zf))
+
+    assert np.array_equal(batch_dir.X, batch_zip.X)
+    assert batch_dir.record_ids == batch_zip.record_ids
+    assert np.array_equal(batch_dir.offsets, batch_zip.offsets)
+    assert sorted(rr_zip) == ["record_001", "record_002"]
+    for rid in rr_dir:
+        assert np.array_equal(rr_dir[rid], rr_zip[rid])
+
+def test_preprocess_data_flat_zip_groups_records():
+    records = {"record_001": [make_rr(100, 4)], "record_002": [make_rr(100, 5)]}
+    with zipfile.ZipFile(create_record_zip(records, nested=False)) as zf:
+        archive = ZipRecords(zf)
+        assert archive.record_ids() == ["record_001", "record_002"]
+        batch, _ = preprocess_data(archive=archive)
+    assert batch.X.shape[1] == 138
+    assert batch.record_ids == ["record_001", "record_002"]
+
+# Parallel preprocessing
+def test_preprocess_data_parallel_matches_serial_and_skips_bad_records():
+    records = {
+        "record_001": [make_rr(200, 6)],
+        "record_002": [make_rr(30, 7)],
+        "record_003": [make_rr(150, 8), make_rr(90, 9)],
+    }
+    zip_buffer = create_record_zip(records)
+    with zipfile.ZipFile(zip_buffer, "a") as zf:
+        zf.writestr("record_000_rr_00.h5", b"not an hdf5 file")
+        zf.writestr("record_000_rr_labels.csv", "start_file_index,start_rr_index,end_file_index,end_rr_index\n")
+
+    with zipfile.ZipFile(zip_buffer) as zf:
+        batch_serial, rr_serial = preprocess_data(archive=ZipRecords(zf), workers=1)
+        batch_parallel, rr_parallel = preprocess_data(archive=ZipRecords(zf), workers=2)
+
+    assert "record_000" not in rr_serial and "record_000" not in rr_parallel
+    assert np.array_equal(batch_serial.X, batch_parallel.X)
+    assert batch_serial.record_ids == batch_parallel.record_ids
+    assert list(rr_serial) == list(rr_parallel) == ["record_001", "record_002", "record_003"]
+
+def test_preprocess_pool_recovers_from_dead_worker():
+    records = {"record_001": [make_rr(200, 6)], "record_002": [make_rr(150, 8)]}
+    with zipfile.ZipFile(create_record_zip(records)) as zf:
+        expected, _ = preprocess_data(archive=ZipRecords(zf), workers=1)
+        # a worker killed between requests (OOM kill, segfault) leaves the shared pool broken
+        with pytest.raises(BrokenProcessPool):
+            get_preprocess_pool(2).submit(os._exit, 1).result()
+        for _ in range(2):
+            batch, _ = preprocess_data(archive=ZipRecords(zf), workers=2)
+            assert np.array_equal(batch.X, expected.X)
+
+# Preprocessing cache
+def test_preprocess_cache_recomputes_only_changed_records():
+    cache = PreprocessCache()
+    records = {"record_001": [make_rr(200, 1)], "record_002": [make_rr(120, 2)]}
+    with zipfile.ZipFile(create_record_zip(records)) as zf:
+        batch_first, _ = preprocess_data(archive=ZipRecords(zf), cache=cache)
+        batch_again, _ = preprocess_data(archive=ZipRecords(zf), cache=cache)
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 2
+    assert np.array_equal(batch_first.X, batch_again.X)
+
+    records["record_002"] = [make_rr(130, 3)]
+    records["record_003"] = [make_rr(60, 4)]
+    with zipfile.ZipFile(create_record_zip(records)) as zf:
+        batch_new, _ = preprocess_data(archive=ZipRecords(zf), cache=cache)
+        batch_fresh, _ = preprocess_data(archive=ZipRecords(zf))
+    assert cache.stats()["misses"] == 4 and cache.stats()["hits"] == 3
+    assert np.array_equal(batch_new.X, batch_fresh.X)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_preprocess_cache_inflates_each_rr_member_once(monkeypatch, workers):
+    cache = PreprocessCache()
+    records = {"record_001": [make_rr(200, 1), make_rr(80, 2)], "record_002": [make_rr(120, 3)]}
+    with zipfile.ZipFile(create_record_zip(records)) as zf:
+        reads = {}
+        zf_read = zf.read
+
+        def counting_read(name, *args):
+            reads[name] = reads.get(name, 0) + 1
+            return zf_read(name, *args)
+
+        monkeypatch.setattr(zf, "read", counting_read)
+        archive = ZipRecords(zf)
+        preprocess_data(archive=archive, workers=workers, cache=cache)
+        rr_reads = {name: n for name, n in reads.items() if "_rr_0" in name}
+        assert len(rr_reads) == 3 and set(rr_reads.values()) == {1}
+        assert all(member.data is None for files in archive.records.values() for member in files.rr)
+
+def test_preprocess_cache_lru_and_disk_tier(tmp_path):
+    rr = np.arange(100, dtype=np.float64)  # 800 bytes per entry
+    cache = PreprocessCache(max_bytes=2000, disk_dir=tmp_path, disk_max_bytes=10 ** 6)
+    for key in ("a", "b", "c"):
+        cache.put(key, rr)
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] <= 2000
+
+    # "a" was evicted from memory but is still on disk
+    assert np.array_equal(cache.get("a"), rr)
+    assert cache.stats()["disk_hits"] == 1
+
+    restarted = PreprocessCache(max_bytes=2000, disk_dir=tmp_path)
+    assert np.array_equal(restarted.get("c"), rr)
+    assert restarted.get("missing") is None
+    assert restarted.stats()["misses"] == 1
+
+def test_cache_stats_endpoint():
+    response = client.get("/cache/stats")
+    assert response.status_code == 200
+    assert "enabled" in response.json()
+
+# Vectorized RR cleaning
+@pytest.mark.parametrize("seed", range(20))
+def test_clean_rr_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    rr = 800 + rng.normal(0, 60, 500)
+    idx = rng.integers(0, 500, 40)
+    rr[idx] = rng.choice([100, 350, 1400, 2000, 5000], 40)
+    rr[:2] = 150     # invalid leading beats stay NaN until the final edge fill
+    rr[-3:] = 4500   # invalid trailing beats
+    assert np.array_equal(clean_rr(rr), clean_rr_reference(rr), equal_nan=True)
+
+def test_clean_rr_alternates_within_ectopic_runs():
+    rr = np.array([800, 1100, 1500, 2000, 800, 800], dtype=float)
+    assert np.array_equal(clean_rr(rr), clean_rr_reference(rr), equal_nan=True)
+    assert np.array_equal(clean_rr(np.array([800.0])), clean_rr_reference([800.0]))
+
+# Chunked, lazy RR loading
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 10000])
+def test_rr_cleaner_chunks_match_clean_rr(chunk_size):
+    for seed in range(10):
+        rng = np.random.default_rng(seed)
+        rr = 800 + rng.normal(0, 60, 300)
+        idx = rng.integers(0, 300, 40)
+        rr[idx] = rng.choice([100, 350, 1400, 2000, 5000, np.nan], 40)
+        rr[:3] = 150
+        rr[-4:] = 4500
+        rr[100:110] = [800, 1300] * 5  # ectopic run
+        cleaner = RRCleaner()
+        chunks = [cleaner.feed(rr[i:i + chunk_size]) for i in range(0, len(rr), chunk_size)]
+        cleaned = np.concatenate(chunks + [cleaner.finish()])
+        assert np.array_equal(cleaned, clean_rr(rr), equal_nan=True)
+
+def test_record_iter_rr_matches_load_rr_record(tmp_path):
+    days = [make_rr(700, 1), make_rr(100, 2), make_rr(1200, 3)]
+    days[0][[5, 300, 301]] = 5000
+    days[2][600:604] = [800, 1400, 800, 1400]
+    for day, rr in enumerate(days):
+        with h5py.File(tmp_path / f"record_001_rr_{day:02d}.h5", "w") as f:
+            f.create_dataset("rr", data=rr, chunks=(64,))
+    (tmp_path / "record_001_rr_labels.csv").write_text("start_file_index,start_rr_index,end_file_index,end_rr_index\n")
+
+    record = Record(tmp_path)
+    record.load_rr_record()
+    expected = np.concatenate(record.rr)
+    assert record.rr_lengths() == [700, 100, 1200]
+    chunks = list(record.iter_rr(chunk_size=100))
+    assert max(len(c) for c in chunks) <= 128
+    assert np.array_equal(np.concatenate(chunks), expected)
+    assert np.array_equal(record.load_rr(chunk_size=100), expected)
+
+    windows = np.concatenate(list(iter_psr_windows(record.iter_rr(chunk_size=100), scale=1000.0)))
+    assert np.array_equal(windows, build_psr_windows([expected], scale=1000.0)[0])
+    summary = RRSummary()
+    for chunk in record.iter_rr(chunk_size=100):
+        summary.update(chunk)
+    assert summary.features() == pytest.approx(compute_rr_features(expected))
+
+def test_iter_psr_windows_short_series():
+    rr = make_rr(30)
+    windows = np.concatenate(list(iter_psr_windows([rr[:10], rr[10:]])))
+    assert np.array_equal(windows, build_psr_windows([rr])[0])
+
+def test_rr_features_without_valid_beats_are_json_safe():
+    # every beat out of range: the cleaned series is all NaN
+    cleaned = clean_rr(np.array([5000.0, 6000.0, 100.0]))
+    expected = {"mean_rr": None, "estimated_hr_bpm": None}
+    assert compute_rr_features(cleaned) == compute_rr_features([]) == expected
+    assert RRSummary().features() == RRSummary().update(cleaned).features() == expected
+
+    records = {"record_001": [np.full(60, 5000.0)]}
+    with zipfile.ZipFile(create_record_zip(records)) as zf:
+        (record_id, blocks, summary), = iter_record_windows(archive=ZipRecords(zf))
+        list(blocks)
+    assert json.loads(json.dumps(summary.features(), allow_nan=False)) == expected
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_iter_record_windows_blocks_match_preprocess_data(workers):
+    records = {"record_001": [make_rr(700, 1), make_rr(300, 2)], "record_002": [make_rr(30, 3)]}
+    with zipfile.ZipFile(create_record_zip(records)) as zf:
+        psr, raw_rr = preprocess_data(archive=ZipRecords(zf), scale=1000.0)
+        raw, _ = preprocess_data(archive=ZipRecords(zf), m=1, tau=1, scale=1000.0)
+        streamed = list(iter_record_windows(
+            archive=ZipRecords(zf), window_params=[{"m": 3, "tau": 2}, {"m": 1, "tau": 1}],
+            workers=workers, scale=1000.0, chunk_beats=256,
+        ))
+
+    assert [record_id for record_id, _, _ in streamed] == ["record_001", "record_002"]
+    for i, (record_id, blocks, summary) in enumerate(streamed):
+        blocks = list(blocks)
+        assert len(blocks) == (4 if record_id == "record_001" else 1)
+        for column, batch in enumerate((psr, raw)):
+            rows = slice(batch.offsets[i], batch.offsets[i + 1])
+            assert np.array_equal(np.concatenate([block[column] for block in blocks]), batch.X[rows])
+        assert summary.features() == pytest.approx(compute_rr_features(raw_rr[record_id]))
+
+# Lazy ECG view
+def write_ecg_record(folder, day_lengths, events, chunked=False):
+    rng = np.random.default_rng(0)
+    for day, n in enumerate(day_lengths):
+        with h5py.File(folder / f"record_001_ecg_{day:02d}.h5", "w") as f:
+            f.create_dataset("ecg", data=rng.normal(size=(n, 2)), chunks=(1000, 2) if chunked else None)
+        with h5py.File(folder / f"record_001_rr_{day:02d}.h5", "w") as f:
+            f.create_dataset("rr", data=make_rr(60, day))
+    (folder / "record_001_ecg_labels.csv").write_text(
+        "start_file_index,start_qrs_index,end_file_index,end_qrs_index\n"
+        + "".join(f"{a},{b},{c},{d}\n" for a, b, c, d in events)
+    )
+
+@pytest.mark.parametrize("clean_front", [False, True])
+@pytest.mark.parametrize("chunked", [False, True])
+def test_ecg_view_matches_load_ecg(tmp_path, clean_front, chunked):
+    events = [(0, 7000, 0, 9000), (0, 15000, 1, 6500), (1, 100, 1, 3000)]
+    write_ecg_record(tmp_path, [20000, 12000], events, chunked)
+    record = Record(tmp_path)
+    record.load_ecg(clean_front)
+    ecg, labels = np.concatenate(record.ecg), record.ecg_labels.dense()
+
+    with record.ecg_view(clean_front) as view:
+        assert view.shape == ecg.shape
+        assert np.array_equal(view[:], ecg)
+        assert np.array_equal(view.labels(), labels)
+        for start, stop in [(0, 10), (13000, 21000), (len(ecg) - 5, len(ecg) + 5), (500, 500)]:
+            assert np.array_equal(view[start:stop], ecg[start:stop])
+            assert np.array_equal(view.labels(start, stop), labels[start:stop])
+        assert np.array_equal(view[100:2000:7], ecg[100:2000:7])
+        front = ECG_FRONT_SAMPLES if clean_front else 0
+        assert view.episodes()[0].tolist() == [7000 - front, 9000 - front]
+
+def test_ecg_view_time_slice_and_episode_spanning_days(tmp_path):
+    write_ecg_record(tmp_path, [1000, 1000, 1000], [(0, 900, 2, 50)])
+    with Record(tmp_path).ecg_view(fs=100.0) as view:
+        assert view.episodes().tolist() == [[900, 2050]]
+        assert view.labels(890, 2060).sum() == 1150
+        assert np.array_equal(view.time_slice(9.5, 10.5), view[950:1050])
+
+def test_plot_ecg_defaults_to_clean_front_of_load_ecg(tmp_path, monkeypatch):
+    write_ecg_record(tmp_path, [20000], [(0, 7000, 0, 9000)])
+    record = Record(tmp_path)
+    used = []
+
+    def ecg_view(clean_front=False, fs=None):
+        used.append(clean_front)
+        raise StopIteration  # stop before plotting
+
+    monkeypatch.setattr(record, "ecg_view", ecg_view)
+    for load_clean_front, plot_clean_front, expected in [
+        (None, None, False), (True, None, True), (False, None, False), (True, False, False),
+    ]:
+        if load_clean_front is not None:
+            record.load_ecg(load_clean_front)
+        with pytest.raises(StopIteration):
+            record.plot_ecg(clean_front=plot_clean_front)
+        assert used[-1] is expected
+
+# Run-length (interval) labels
+def dense_labels_reference(events, day_lengths):
+    days = [np.zeros(n, dtype=np.uint8) for n in day_lengths]
+    for start_day, start, end_day, end in events:
+        if start_day == end_day:
+            days[start_day][start:end] = 1
+        else:
+            days[start_day][start:] = 1
+            days[end_day][:end] = 1
+            for day in range(start_day + 1, end_day):
+                days[day][:] = 1
+    return np.concatenate(days)
+
+def test_interval_labels_match_dense_reference():
+    day_lengths = [300, 120, 80, 250]
+    events = [(0, 10, 0, 40), (0, 30, 0, 60), (0, 250, 3, 20), (3, 100, 3, 100), (3, 200, 3, 400)]
+    table = pd.DataFrame(events, columns=["start_file_index", "start_rr_index", "end_file_index", "end_rr_index"])
+    labels = IntervalLabels.from_events(table, "rr", day_lengths)
+    expected = dense_labels_reference(events, day_lengths)
+
+    assert labels.episodes.tolist() == [[10, 60], [250, 520], [700, 750]]
+    assert np.array_equal(labels.dense(), expected)
+    assert np.array_equal(labels.dense(240, 800), expected[240:800])
+    positions = np.arange(len(expected))
+    assert np.array_equal(labels.at(positions), expected)
+    starts = np.arange(0, len(expected) - 50, 5)
+    assert np.allclose(labels.window_fraction(len(starts)), [expected[a:a + 50].mean() for a in starts])
+
+    with pytest.raises(ValueError):
+        IntervalLabels.from_events(table.assign(end_file_index=4), "rr", day_lengths)
+
+def test_rr_labels_span_more_than_two_days(tmp_path):
+    for day, n in enumerate([100, 100, 100]):
+        with h5py.File(tmp_path / f"record_001_rr_{day:02d}.h5", "w") as f:
+            f.create_dataset("rr", data=make_rr(n, day))
+    (tmp_path / "record_001_rr_labels.csv").write_text(
+        "start_file_index,start_rr_index,end_file_index,end_rr_index\n0,90,2,10\n"
+    )
+    record = Record(tmp_path)
+    record.load_rr_record()
+    assert record.rr_labels.dense().sum() == 10 + 100 + 10
+    assert record.rr_labels.at([89, 90, 150, 209, 210]).tolist() == [0, 1, 1, 1, 0]
+
+# Metadata index
+def test_metadata_index_loads_shipped_csv():
+    index = MetadataIndex.from_csv()
+    meta = index.get("record_001")
+    assert isinstance(meta, RecordMetadata)
+    assert (meta.patient_id, meta.record_n_files, meta.record_n_samples) == ("patient_001", 2, 34559600)
+    assert index.for_patient("patient_001") == [meta]
+    assert "record_001" in index and "record_999" not in index
+    with pytest.raises(KeyError):
+        index.get("record_999")
+
+    df = pd.read_csv("metadata.csv")
+    selected = index.filter(sex="male", min_age=70, max_age=80, min_seconds=100000)
+    expected = df[(df.patient_sex == "male") & df.patient_age.between(70, 80) & (df.record_seconds >= 100000)]
+    assert selected.record_ids == expected.record_id.tolist()
+
+def test_create_record_attaches_metadata(tmp_path):
+    (tmp_path / "record_001").mkdir()
+    with h5py.File(tmp_path / "record_001" / "record_001_rr_00.h5", "w") as f:
+        f.create_dataset("rr", data=make_rr(60))
+    df = pd.read_csv("metadata.csv")
+    index = MetadataIndex(df)
+
+    from_df = create_record("record_001", df, tmp_path)
+    from_index = index.create_record("record_001", tmp_path)
+    assert from_df.metadata == from_index.metadata == index.get("record_001")
+    assert Record(tmp_path / "record_001", index.get("record_001")).metadata.record_id == "record_001"
+    assert create_record("record_001", df.drop(columns="record_samples"), tmp_path).metadata is None
+
+    with pytest.raises(ValueError):
+        create_record("record_001", pd.concat([df, df.iloc[[1]]]), tmp_path)
+
+# Offline dataset builder
+def write_rr_record(records_dir, record_id, days, events):
+    folder = records_dir / record_id
+    folder.mkdir(parents=True, exist_ok=True)
+    for day, rr in enumerate(days):
+        with h5py.File(folder / f"{record_id}_rr_{day:02d}.h5", "w") as f:
+            f.create_dataset("rr", data=rr)
+    (folder / f"{record_id}_rr_labels.csv").write_text(
+        "start_file_index,start_rr_index,end_file_index,end_rr_index\n"
+        + "".join(f"{a},{b},{c},{d}\n" for a, b, c, d in events)
+    )
+
+def test_build_dataset_writes_labelled_windows_and_updates_incrementally(tmp_path):
+    records_dir, out = tmp_path / "Records", tmp_path / "store"
+    # 800 ms beats: 75 beats per minute, AF from beat 900 (12 minutes in) to 1000
+    write_rr_record(records_dir, "record_000", [np.full(600, 800.0), np.full(600, 800.0)], [(1, 300, 1, 400)])
+    write_rr_record(records_dir, "record_001", [make_rr(300, 1)], [])
+    write_rr_record(records_dir, "record_002", [make_rr(30, 2)], [])
+    params = BuildParams(pre_af_minutes=5)
+    metadata = MetadataIndex(pd.read_csv("metadata.csv"))
+
+    assert build_dataset(records_dir, out, params, metadata, log=lambda *a: None) == \
+        {"kept": 0, "built": 3, "dropped": 0, "failed": 0}
+    store = FeatureStore(out)
+    assert store.index["record_id"].tolist() == ["record_000", "record_001", "record_002"]
+    assert store.index["patient_id"].tolist() == ["patient_000", "patient_001", "patient_002"]
+
+    record = Record(records_dir / "record_000")
+    rr = record.load_rr()
+    psr = store.load("psr", ["record_000"])
+    assert np.array_equal(psr, build_psr_windows([rr])[0])
+    assert np.array_equal(store.load("raw", ["record_000"]), build_psr_windows([rr], m=1, tau=1)[0])
+    labels = store.load("label", ["record_000"])
+    starts = np.arange(len(labels)) * 5
+    assert (labels[(starts >= 900) & (starts + 50 <= 1000)] == 2).all()
+    minutes_before = (900 - (starts + 50)) * 0.8 / 60
+    assert (labels[(minutes_before >= 0) & (minutes_before < 4.9)] == 1).all()
+    assert (labels[minutes_before > 5.1] == 0).all()
+    assert len(store) == len(store.load("label")) == len(store.groups())
+    assert store.groups()[-1] == "patient_002"
+
+    assert build_dataset(records_dir, out, params, log=lambda *a: None)["built"] == 0
+    write_rr_record(records_dir, "record_003", [make_rr(200, 3)], [(0, 20, 0, 120)])
+    (records_dir / "record_001" / "record_001_rr_labels.csv").write_text(
+        "start_file_index,start_rr_index,end_file_index,end_rr_index\n0,100,0,200\n"
+    )
+    assert build_dataset(records_dir, out, params, allowed={"record_000", "record_001", "record_003"},
+                         workers=2, log=lambda *a: None) == {"kept": 1, "built": 2, "dropped": 1, "failed": 0}
+    store = FeatureStore(out)
+    assert sorted(store.index["record_id"]) == ["record_000", "record_001", "record_003"]
+    assert set(store.index["shard"]) == {0, 1}
+    assert store.load("label", ["record_001"]).max() == 2
+
+    assert build_dataset(records_dir, out, BuildParams(), log=lambda *a: None)["built"] == 4
+    assert set(FeatureStore(out).index["shard"]) == {0}
+
+def test_window_labels_straddling_an_onset_are_pre_af():
+    # 800 ms beats, AF on beats [200, 400): windows 155..170 hold the onset with af_fraction < 0.5
+    rr = np.full(400, 800.0)
+    labels, af_fraction = window_labels(rr, IntervalLabels([200], [400], 400), BuildParams(pre_af_minutes=5))
+    starts = np.arange(len(labels)) * 5
+    straddling = (starts < 200) & (starts + 50 > 200)
+    assert (af_fraction[straddling & (starts < 175)] < 0.5).all()
+    assert (labels[starts < 175] == 1).all()
+    assert (labels[starts >= 175] == 2).all()
+
+    # an onset on the very first beat, with a short episode
+    labels, _ = window_labels(rr, IntervalLabels([0], [10], 400), BuildParams(pre_af_minutes=5))
+    assert labels[0] == 1 and (labels[starts >= 10] == 0).all()
+
+def test_build_dataset_recovers_from_interrupted_build_and_removes_stale_shards(tmp_path):
+    records_dir, out = tmp_path / "Records", tmp_path / "store"
+    write_rr_record(records_dir, "record_000", [make_rr(300, 0)], [])
+    write_rr_record(records_dir, "record_001", [make_rr(200, 1)], [])
+    build_dataset(records_dir, out, allowed={"record_000"}, log=lambda *a: None)
+    build_dataset(records_dir, out, log=lambda *a: None)
+    assert sorted(p.name for p in out.glob("shard-*")) == ["shard-00000", "shard-00001"]
+
+    # a build killed after creating its shard, before writing index.csv
+    (out / "shard-00002").mkdir()
+    (out / "shard-00002" / "raw.npy").write_bytes(b"partial")
+    write_rr_record(records_dir, "record_002", [make_rr(100, 2)], [])
+    assert build_dataset(records_dir, out, log=lambda *a: None) == \
+        {"kept": 2, "built": 1, "dropped": 0, "failed": 0}
+    store = FeatureStore(out)
+    assert store.index.set_index("record_id")["shard"].to_dict() == \
+        {"record_000": 0, "record_001": 1, "record_002": 2}
+    assert store.load("raw", ["record_002"]).shape == (count_windows(100), 50)
+
+    # record_001 changed: rebuilt into a new shard, its old one (no other record) is deleted
+    write_rr_record(records_dir, "record_001", [make_rr(250, 3)], [])
+    assert build_dataset(records_dir, out, log=lambda *a: None) == \
+        {"kept": 2, "built": 1, "dropped": 0, "failed": 0}
+    assert FeatureStore(out).index.set_index("record_id")["shard"]["record_001"] == 3
+    assert sorted(p.name for p in out.glob("shard-*")) == ["shard-00000", "shard-00002", "shard-00003"]
+
+def test_record_filter_from_save_files():
+    allowed = load_record_filter()
+    assert len(allowed) == 96 and "record_000" in allowed
+    assert len(load_record_filter(exclude_flags=["one_af_event"])) < 96
+    with pytest.raises(ValueError):
+        load_record_filter(exclude_flags=["no_such_flag"])
+
+# Strided PSR window builder
+def reference_psr_rows(rri, window_size=50, step_size=5):
+    rows = []
+    n = len(rri)
+    for start in range(0, max(1, n - window_size + 1), step_size):
+        window = rri[start:start + window_size]
+        if len(window) < window_size:
+            window = np.pad(window, (0, window_size - len(window)), "constant")
+        rows.append(phase_space_reconstruct(window, m=3, tau=2))
+        if n < window_size:
+            break
+    return np.stack(rows).astype(np.float32)
+
+def test_build_psr_windows_bit_identical_to_phase_space_reconstruct():
+    series = [make_rr(n, n) for n in (1, 49, 50, 51, 54, 55, 56, 1003)]
+    X, offsets = build_psr_windows(series, scale=1000.0)
+
+    assert X.dtype == np.float32 and X.shape[1] == 138
+    assert offsets[0] == 0 and offsets[-1] == len(X)
+    for i, rri in enumerate(series):
+        expected = reference_psr_rows(rri) / 1000.0
+        assert np.array_equal(X[offsets[i]:offsets[i + 1]], expected)
+
+def test_build_psr_windows_counts_match_count_windows():
+    series = [make_rr(n) for n in (10, 50, 99, 100)]
+    _, offsets = build_psr_windows(series)
+    assert list(np.diff(offsets)) == [count_windows(len(rr)) for rr in series] == [1, 1, 10, 11]
+
+# WindowBatch segmented reductions
+def test_window_batch_reductions_match_pandas_groupby():
+    rng = np.random.default_rng(0)
+    counts = [1, 2, 7, 40, 3]
+    record_ids = [f"record_{i:03d}" for i in range(len(counts))]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    values = rng.random(offsets[-1]).astype(np.float32)
+    batch = WindowBatch(np.zeros((offsets[-1], 138), dtype=np.float32), record_ids, offsets)
+
+    df = pd.DataFrame({"record_id": np.repeat(record_ids, counts), "v": values})
+    grouped = df.groupby("record_id")["v"]
+
+    assert list(batch.codes) == list(np.repeat(np.arange(len(counts)), counts))
+    assert np.array_equal(batch.max(values), grouped.max().to_numpy())
+    assert np.allclose(batch.mean(values), grouped.mean().to_numpy())
+    for q in (0.0, 0.25, 0.5, 0.75, 1.0):
+        assert np.allclose(batch.quantile(values, q), grouped.quantile(q).to_numpy(), rtol=0, atol=1e-12)
+
 # NODEModel forward (shape)
 def test_node_model_forward_output_shape():
     model = NODEModel(dim=138, num_classes=3)
@@ -98,6 +683,125 @@ def test_node_model_forward_output_shape():
     logits = model(x)
     assert logits.shape == (4, 3)
 
+# NODEModel ODE solver selection
+def test_solver_config_parse():
+    assert SolverConfig.parse(None) == SolverConfig("dopri5", None, 1e-7, 1e-9)
+    assert SolverConfig.parse("rk4:8") == SolverConfig("rk4", 8)
+    assert SolverConfig.parse("midpoint") == SolverConfig("midpoint", 1)
+    assert SolverConfig.parse("dopri5:1e-5:1e-7") == SolverConfig("dopri5", None, 1e-5, 1e-7)
+    assert SolverConfig.parse("rk4:8").time_grid().tolist() == [i / 8 for i in range(9)]
+    with pytest.raises(ValueError):
+        SolverConfig.parse("rk4:0")
+
+@pytest.mark.parametrize("spec", ["rk5:4", "fixed_adams:8", "scipy_solver", "rk4:4:2", "dopri5:1e-5:1e-7:1", "dopri5:0", "rk4:x"])
+def test_solver_config_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        SolverConfig.parse(spec)
+    with pytest.raises(ValueError):
+        ModelRegistry(MODEL_SPECS, solver=spec)
+
+def test_solver_sets_are_torchdiffeq_methods_of_their_kind():
+    from torchdiffeq._impl.odeint import SOLVERS
+    from torchdiffeq._impl.solvers import AdaptiveStepsizeODESolver, FixedGridODESolver
+
+    assert all(issubclass(SOLVERS[method], FixedGridODESolver) for method in FIXED_STEP_SOLVERS)
+    assert all(issubclass(SOLVERS[method], AdaptiveStepsizeODESolver) for method in ADAPTIVE_SOLVERS)
+    with pytest.raises(ValueError, match="rk4"):
+        SolverConfig.parse("rk5:4")
+
+def test_node_model_default_solver_matches_plain_odeint():
+    from torchdiffeq import odeint
+
+    torch.manual_seed(0)
+    model = NODEModel(dim=138, num_classes=3).eval()
+    x = torch.randn(16, 138)
+    t = torch.tensor([0.0, 1.0])
+    with torch.no_grad():
+        expected = model.classifier(odeint(model.odefunc, x, t)[-1])
+        assert torch.equal(model(x), expected)
+
+def test_node_model_fixed_step_solver_close_to_dopri5():
+    torch.manual_seed(0)
+    reference = NODEModel(dim=138, num_classes=3).eval()
+    fixed = NODEModel(dim=138, num_classes=3, solver="rk4:8").eval()
+    fixed.load_state_dict(reference.state_dict())
+
+    X = np.random.default_rng(0).random((64, 138)).astype(np.float32)
+    assert np.allclose(predict_probabilities(fixed, X), predict_probabilities(reference, X), atol=1e-4)
+
+# TorchScript export (unrolled fixed-step integrator)
+@pytest.mark.parametrize("model_class", [NODEModel, HybridNODEAttentionModel])
+@pytest.mark.parametrize("solver", ["rk4:4", "midpoint:3", "euler:8", "heun3:2"])
+def test_torchscript_export_matches_eager_odeint(tmp_path, model_class, solver):
+    torch.manual_seed(0)
+    eager = model_class(dim=138, num_classes=3, solver=solver).eval()
+    path = tmp_path / "model.ts"
+    export_torchscript(eager, solver, path)
+
+    exported = load_model(NODEModel, path)
+    X = np.random.default_rng(0).random((37, 138)).astype(np.float32)
+    assert np.allclose(predict_probabilities(exported, X), predict_probabilities(eager, X), rtol=0, atol=1e-6)
+
+def test_torchscript_export_needs_fixed_step_solver(tmp_path):
+    with pytest.raises(ValueError):
+        export_torchscript(NODEModel(dim=138, num_classes=3), "dopri5", tmp_path / "model.ts")
+
+def test_load_checkpoint_picks_architecture():
+    node = load_checkpoint("Three_Class_Models/saved_models/NODE_PSR_best.pth")
+    hybrid = load_checkpoint("Two_Class_Models/saved_models/raw_hybrid_two_class_best.pth", solver="rk4:4")
+    assert isinstance(node, NODEModel) and node.classifier[-1].out_features == 3
+    assert isinstance(hybrid, HybridNODEAttentionModel) and hybrid.odefunc.net[0].in_features == 50
+    assert hybrid.solver == SolverConfig("rk4", 4)
+
+@pytest.mark.parametrize("model_name", ["NODE_PSR", "raw_hybrid_two_class"])
+def test_validate_solver_inputs_match_server(tmp_path, model_name):
+    from benchmarks.validate_solver import records_rr, synthetic_rr, window_batch
+
+    spec = MODEL_SPECS[model_name]
+    records = {"record_001": [make_rr(300, 1), make_rr(120, 2)], "record_002": [make_rr(90, 3)]}
+    zip_buffer = create_record_zip(records, nested=True)
+    with zipfile.ZipFile(zip_buffer) as zf:
+        zf.extractall(tmp_path)
+    server_batch, _ = main._preprocess_upload(zip_buffer, spec)
+    tool_batch = window_batch(records_rr(tmp_path), spec)
+    assert tool_batch.record_ids == server_batch.record_ids
+    assert np.array_equal(tool_batch.X, server_batch.X)
+
+    # synthetic windows are in seconds too, like uploads after INPUT_SCALE
+    synthetic = window_batch(synthetic_rr(2, 200), spec)
+    assert synthetic.X.shape[1] == spec.input_dim
+    assert 0.1 < np.median(synthetic.X) < 2.0
+
+# int8 dynamic quantization
+def test_quantized_model_close_to_float32():
+    model = load_checkpoint("Three_Class_Models/saved_models/NODE_PSR_best.pth", solver="rk4:4")
+    quantized = quantize_model(model)
+    assert not any(isinstance(m, torch.nn.Linear) for m in quantized.modules())
+
+    X = np.random.default_rng(0).normal(800, 50, (256, 138)).astype(np.float32)
+    probs = predict_probabilities(quantized, X)
+    reference = predict_probabilities(model, X)
+    assert probs.shape == (256, 3)
+    assert np.mean(probs.argmax(axis=1) == reference.argmax(axis=1)) > 0.95
+
+def test_quantize_model_needs_fixed_step_solver():
+    with pytest.raises(ValueError):
+        quantize_model(NODEModel(dim=138, num_classes=3))
+
+def test_quantized_torchscript_export_matches_eager(tmp_path):
+    quantized = quantize_model(NODEModel(dim=138, num_classes=2, solver="rk4:2").eval())
+    export_torchscript(quantized, "rk4:2", tmp_path / "model.ts")
+    exported = load_model(NODEModel, tmp_path / "model.ts")
+    X = np.random.default_rng(1).random((16, 138)).astype(np.float32)
+    assert np.allclose(predict_probabilities(exported, X), predict_probabilities(quantized, X), atol=1e-6)
+
+def test_model_precision_setting():
+    specs = {"NODE_PSR": replace(MODEL_SPECS["NODE_PSR"], precision="int8")}
+    registry = ModelRegistry(specs, solver="rk4:2")
+    assert not any(isinstance(m, torch.nn.Linear) for m in registry.get("NODE_PSR").modules())
+    with pytest.raises(ValueError):
+        ModelRegistry({"NODE_PSR": replace(MODEL_SPECS["NODE_PSR"], precision="fp16")})
+
 # predict_probabilities (softmax output)
 def test_predict_probabilities_shape_and_row_sum():
     model = NODEModel(dim=138, num_classes=3)
@@ -134,8 +838,7 @@ def test_predict_endpoint(monkeypatch):
     monkeypatch.setattr(
         "main.preprocess_data",
         lambda *args, **kwargs: (
-            np.random.rand(1, 138),
-            ["record_001"],
+            WindowBatch(np.random.rand(1, 138).astype(np.float32), ["record_001"], np.array([0, 1])),
             {"record_001": [800, 810, 820]}
         )
     )
@@ -174,8 +877,7 @@ def test_detect_endpoint(monkeypatch):
     monkeypatch.setattr(
         "main.preprocess_data",
         lambda *a, **k: (
-            np.random.rand(1, 138),
-            ["record_001"],
+            WindowBatch(np.random.rand(1, 138).astype(np.float32), ["record_001"], np.array([0, 1])),
             {"record_001": [800, 820, 840]}
         )
     )
@@ -199,6 +901,609 @@ def test_detect_endpoint(monkeypatch):
     assert "prob_af" in data
     assert pytest_close_float(data["prob_af"][0], 0.7)
 
+def test_analyze_endpoint_preprocesses_once_and_runs_both_models(monkeypatch):
+    calls = {"preprocess": 0}
+
+    def fake_preprocess(*args, **kwargs):
+        calls["preprocess"] += 1
+        batch = WindowBatch(np.random.rand(3, 138).astype(np.float32), ["record_001", "record_002"], np.array([0, 2, 3]))
+        return batch, {"record_001": [800, 810], "record_002": [700, 710]}
+
+    def fake_predict(model, X):
+        if model.classifier[-1].out_features == 3:
+            return np.array([[0.6, 0.3, 0.1], [0.2, 0.4, 0.4], [0.9, 0.05, 0.05]])
+        return np.array([[0.3, 0.7], [0.8, 0.2], [0.4, 0.6]])
+
+    monkeypatch.setattr("main.preprocess_data", fake_preprocess)
+    monkeypatch.setattr("main.predict_probabilities", fake_predict)
+
+    response = client.post(
+        "/analyze/",
+        files={"records_zip": ("records.zip", create_dummy_zip().read(), "application/zip")}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert calls["preprocess"] == 1
+    assert data["record_ids"] == ["record_001", "record_002"]
+    # record_001: danger [0.4, 0.8] -> p75 = 0.7, AF max(0.7, 0.2) = 0.7
+    assert pytest_close_float(data["prob_danger"][0], 0.7, tol=1e-6)
+    assert pytest_close_float(data["prob_af"][0], 0.7, tol=1e-6)
+    assert pytest_close_float(data["prob_danger"][1], 0.1, tol=1e-6)
+    assert pytest_close_float(data["prob_af"][1], 0.6, tol=1e-6)
+    assert set(data["rr_features"]) == {"record_001", "record_002"}
+
+def test_predict_rejects_invalid_zip_members():
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as zf:
+        zf.writestr("record_001_rr_00.h5", "dummy_rr_data")
+        zf.writestr("notes.txt", "not allowed")
+
+    response = client.post(
+        "/predict/",
+        files={"records_zip": ("records.zip", memory_file.getvalue(), "application/zip")}
+    )
+    assert response.status_code == 400
+    assert "notes.txt" in response.json()["detail"]
+
+# ZIP manifest validation
+def zip_with(members, compression=zipfile.ZIP_STORED):
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w", compression=compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    memory_file.seek(0)
+    return zipfile.ZipFile(memory_file)
+
+def validation_status(zf):
+    with pytest.raises(HTTPException) as exc_info:
+        _validate_zip_files(zf)
+    return exc_info.value.status_code
+
+def test_validate_zip_accepts_record_files():
+    _validate_zip_files(zip_with({"record_001/record_001_rr_00.h5": b"rr", "record_001/record_001_rr_labels.csv": b"a"}))
+
+def test_validate_zip_rejects_path_traversal():
+    assert validation_status(zip_with({"../record_001_rr_00.h5": b"rr"})) == 400
+    assert validation_status(zip_with({"/abs/record_001_rr_00.h5": b"rr"})) == 400
+
+def test_validate_zip_rejects_too_many_members(monkeypatch):
+    monkeypatch.setattr(main, "MAX_ZIP_MEMBERS", 2)
+    members = {f"record_00{i}_rr_00.h5": b"rr" for i in range(3)}
+    assert validation_status(zip_with(members)) == 413
+
+def test_validate_zip_rejects_oversized_members(monkeypatch):
+    monkeypatch.setattr(main, "MAX_ZIP_MEMBER_BYTES", 100)
+    assert validation_status(zip_with({"record_001_rr_00.h5": b"x" * 101})) == 413
+
+    monkeypatch.setattr(main, "MAX_ZIP_MEMBER_BYTES", 1000)
+    monkeypatch.setattr(main, "MAX_ZIP_TOTAL_BYTES", 150)
+    members = {"record_001_rr_00.h5": b"x" * 100, "record_001_rr_01.h5": b"x" * 100}
+    assert validation_status(zip_with(members)) == 413
+
+def test_validate_zip_rejects_zip_bomb_ratio():
+    bomb = zip_with({"record_001_rr_00.h5": b"\0" * (10 * 1024 * 1024)}, compression=zipfile.ZIP_DEFLATED)
+    assert validation_status(bomb) == 400
+
+# Bounded-memory uploads
+def test_upload_over_content_length_limit_rejected_with_413():
+    limited_client = TestClient(UploadSizeLimitMiddleware(app, max_bytes=1024))
+    response = limited_client.post(
+        "/predict/",
+        files={"records_zip": ("records.zip", b"x" * 4096, "application/zip")}
+    )
+    assert response.status_code == 413
+
+def test_chunked_upload_over_limit_rejected_with_413():
+    limited_client = TestClient(UploadSizeLimitMiddleware(app, max_bytes=1024))
+    boundary = "af-boundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="records_zip"; filename="records.zip"\r\n'
+        "Content-Type: application/zip\r\n\r\n"
+    ).encode() + b"x" * 4096 + f"\r\n--{boundary}--\r\n".encode()
+
+    def chunks():
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+
+    response = limited_client.post(
+        "/detect/",
+        content=chunks(),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    )
+    assert response.status_code == 413
+
+def test_open_records_zip_reads_spooled_upload_in_place():
+    # ~32MB upload rolled over to disk: opening it and indexing records must not load it into memory
+    big_member = np.zeros(4 * 1024 * 1024, dtype=np.float64).tobytes()
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with zipfile.ZipFile(spool, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr("record_001/record_001_rr_00.h5", big_member)
+        zf.writestr("record_001/record_001_rr_labels.csv", "start_file_index,start_rr_index,end_file_index,end_rr_index\n")
+    spool.seek(0)
+
+    tracemalloc.start()
+    with _open_records_zip(spool) as archive:
+        assert archive.record_ids() == ["record_001"]
+        assert len(archive.records["record_001"].rr) == 1
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    spool.close()
+
+    assert peak < 1024 * 1024
+
+# Heavy job limiting
+def test_heavy_job_limiter_rejects_with_retry_after_when_full():
+    limiter = HeavyJobLimiter(max_concurrent=1, max_queued=1, retry_after=7)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(limiter.run(release.wait))
+        queued = asyncio.ensure_future(limiter.run(lambda: "queued done"))
+        await asyncio.sleep(0.05)
+        assert limiter.stats()["running"] == 1 and limiter.stats()["queued"] == 1
+        with pytest.raises(HTTPException) as exc_info:
+            await limiter.run(lambda: None)
+        release.set()
+        return exc_info.value, await running, await queued
+
+    error, _, queued_result = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "7"
+    assert queued_result == "queued done"
+    assert limiter.stats()["running"] == 0 and limiter.stats()["queued"] == 0
+
+def test_predict_returns_503_when_heavy_jobs_full(monkeypatch):
+    limiter = HeavyJobLimiter(max_concurrent=1, max_queued=0, retry_after=3)
+    limiter._admit()  # occupy the only slot
+    monkeypatch.setattr(main, "heavy_jobs", limiter)
+
+    response = client.post(
+        "/predict/",
+        files={"records_zip": ("records.zip", create_dummy_zip().read(), "application/zip")}
+    )
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
+
+# Model registry
+def test_model_specs_match_checkpoints():
+    assert len(MODEL_SPECS) == 8
+    for spec in MODEL_SPECS.values():
+        model = load_checkpoint(spec.path)
+        assert isinstance(model, spec.model_class)
+        assert model.odefunc.net[0].in_features == spec.input_dim
+        assert model.classifier[-1].out_features == spec.num_classes
+
+def test_model_specs_use_notebook_thresholds():
+    # decision thresholds chosen per model in the training notebooks (96% F1 rule on validation)
+    assert {name: spec.threshold for name, spec in MODEL_SPECS.items()} == {
+        "NODE_PSR": 0.53,
+        "NODE_raw": 0.54,
+        "PSR_hybrid": 0.56,
+        "raw_hybrid": 0.56,
+        "NODE_PSR_two_class": 0.65,
+        "NODE_raw_two_class": 0.63,
+        "PSR_hybrid_two_class": 0.67,
+        "raw_hybrid_two_class": 0.72,
+    }
+    models = {m["name"]: m for m in client.get("/models").json()["models"]}
+    assert models["raw_hybrid_two_class"]["threshold"] == 0.72
+
+def test_model_precisions_per_model(monkeypatch):
+    assert parse_model_precisions(" NODE_raw=int8, PSR_hybrid = float32 ,") == {"NODE_raw": "int8", "PSR_hybrid": "float32"}
+    assert parse_model_precisions(None) == {}
+    for bad in ("NODE_raw", "NODE_rw=int8", "NODE_raw=int4", "=int8"):
+        with pytest.raises(ValueError):
+            parse_model_precisions(bad)
+
+    for var in ("AF_MODEL_PRECISION", "AF_TWO_MODEL_PRECISION"):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv("AF_MODEL_PRECISIONS", "NODE_raw=int8,raw_hybrid_two_class=int8")
+    monkeypatch.setenv("AF_MODEL_PRECISION", "int8")  # alias for the default predict model
+    specs = main._model_specs()
+    assert {name for name, spec in specs.items() if spec.precision == "int8"} == \
+        {"NODE_raw", "raw_hybrid_two_class", main.PREDICT_MODEL}
+
+    monkeypatch.setenv("AF_MODEL_PRECISIONS", f"{main.PREDICT_MODEL}=float32")
+    with pytest.raises(ValueError):
+        main._model_specs()
+
+def test_model_registry_loads_lazily_with_lru_bound():
+    specs = {name: MODEL_SPECS[name] for name in ("NODE_PSR", "NODE_raw", "PSR_hybrid")}
+    all_three = sum(os.path.getsize(spec.path) for spec in specs.values())
+    registry = ModelRegistry(specs, max_bytes=all_three - 1)
+    assert registry.stats()["loaded"] == []
+
+    first = registry.get("NODE_PSR")
+    assert registry.get("NODE_PSR") is first
+    registry.get("NODE_raw")
+    registry.get("PSR_hybrid")
+    stats = registry.stats()
+    assert stats["loads"] == 3 and stats["evictions"] == 1
+    assert stats["loaded"] == ["NODE_raw", "PSR_hybrid"]
+
+    with pytest.raises(HTTPException) as exc:
+        registry.get("missing")
+    assert exc.value.status_code == 400
+
+def test_predict_endpoint_uses_requested_model(monkeypatch):
+    seen = []
+
+    def fake_predict(model, X):
+        seen.append((type(model).__name__, X.shape[1]))
+        return np.tile([0.6, 0.3, 0.1], (len(X), 1))
+
+    monkeypatch.setattr("main.preprocess_data", lambda *a, m=3, **k: (
+        WindowBatch(np.zeros((2, 50 if m == 1 else 138), dtype=np.float32), ["record_001"], np.array([0, 2])),
+        {"record_001": make_rr(200, 0)},
+    ))
+    monkeypatch.setattr("main.predict_probabilities", fake_predict)
+    zip_bytes = create_dummy_zip().read()
+
+    response = client.post("/predict/?predict_model=raw_hybrid", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+    assert response.status_code == 200
+    assert response.json()["model"] == "raw_hybrid"
+    assert response.json()["threshold"] == 0.56
+    assert seen == [("HybridNODEAttentionModel", 50)]
+
+    wrong_task = client.post("/predict/?predict_model=NODE_PSR_two_class", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+    assert wrong_task.status_code == 400
+    unknown = client.post("/detect/?detect_model=nope", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+    assert unknown.status_code == 400
+
+def test_analyze_rebuilds_windows_for_other_representation(monkeypatch):
+    rr = {"record_001": make_rr(300, 1), "record_002": make_rr(200, 2)}
+
+    def fake_preprocess(*args, m=3, tau=2, **kwargs):
+        X, offsets = build_psr_windows([rr["record_001"], rr["record_002"]], 50, 5, m, tau, scale=1000.0)
+        return WindowBatch(X, ["record_001", "record_002"], offsets), rr
+
+    shapes = []
+
+    def fake_predict(model, X):
+        shapes.append(X.shape)
+        n = model.classifier[-1].out_features
+        return np.full((len(X), n), 1.0 / n)
+
+    monkeypatch.setattr("main.preprocess_data", fake_preprocess)
+    monkeypatch.setattr("main.predict_probabilities", fake_predict)
+
+    response = client.post(
+        "/analyze/?detect_model=NODE_raw_two_class",
+        files={"records_zip": ("records.zip", create_dummy_zip().read(), "application/zip")},
+    )
+    assert response.status_code == 200
+    assert response.json()["detect_model"] == "NODE_raw_two_class"
+    assert response.json()["detect_threshold"] == 0.63
+    assert response.json()["predict_threshold"] == main.model_registry.spec(response.json()["predict_model"]).threshold
+    n_windows = count_windows(300) + count_windows(200)
+    assert shapes == [(n_windows, 138), (n_windows, 50)]
+
+def test_models_endpoint_lists_all_checkpoints():
+    main.model_preloader._thread.join(timeout=60)
+    data = client.get("/models").json()
+    assert data["defaults"] == {"predict": "NODE_PSR", "detect": "NODE_PSR_two_class"}
+    assert len(data["models"]) == 8
+    assert {m["name"] for m in data["models"] if m["loaded"]} >= {"NODE_PSR", "NODE_PSR_two_class"}
+
+# Startup: background loading + readiness
+def test_model_preloader_loads_and_warms_up_in_background():
+    registry = ModelRegistry({name: MODEL_SPECS[name] for name in ("NODE_raw", "PSR_hybrid_two_class")})
+    preloader = ModelPreloader(registry, ["NODE_raw", "PSR_hybrid_two_class"], warmup_rows=8)
+    assert preloader.status()["state"] == "pending"
+    preloader.start()
+    preloader._thread.join(timeout=60)
+    assert preloader.ready
+    assert registry.stats()["loaded"] == ["NODE_raw", "PSR_hybrid_two_class"]
+
+def test_model_preloader_reports_failure():
+    registry = ModelRegistry({"NODE_PSR": replace(MODEL_SPECS["NODE_PSR"], path="missing.pth")})
+    preloader = ModelPreloader(registry, ["NODE_PSR"])
+    with pytest.raises(FileNotFoundError):
+        preloader.run()
+    assert preloader.status()["state"] == "failed" and "missing.pth" in preloader.status()["error"]
+
+def test_ready_endpoint_separate_from_liveness(monkeypatch):
+    assert client.get("/").status_code == 200
+    main.model_preloader._thread.join(timeout=60)
+    assert client.get("/ready").json()["state"] == "ready"
+
+    not_ready = ModelPreloader(main.model_registry, [main.PREDICT_MODEL])
+    monkeypatch.setattr(main, "model_preloader", not_ready)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/").status_code == 200
+
+# Cross-request micro-batching
+def test_micro_batcher_coalesces_concurrent_requests():
+    calls = []
+
+    def infer(model, X):
+        calls.append(len(X))
+        time.sleep(0.01)
+        return X[:, :2] * 2
+
+    batcher = MicroBatcher(object(), infer, max_batch_rows=1000, max_wait_ms=50)
+    inputs = [np.full((i + 1, 4), i, dtype=np.float32) for i in range(8)]
+    results = [None] * len(inputs)
+
+    def call(i):
+        results[i] = batcher.predict(inputs[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(inputs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for X, probs in zip(inputs, results):
+        assert np.array_equal(probs, X[:, :2] * 2)
+    stats = batcher.stats()
+    assert stats["requests"] == 8 and sum(calls) == 36
+    assert stats["batches"] == len(calls) < 8
+    assert stats["queue_depth"] == 0
+
+def test_micro_batcher_respects_max_rows_and_propagates_errors():
+    calls = []
+
+    def infer(model, X):
+        calls.append(len(X))
+        if np.any(X < 0):
+            raise ValueError("bad rows")
+        return X
+
+    batcher = MicroBatcher(object(), infer, max_batch_rows=10, max_wait_ms=0)
+    X = np.arange(50, dtype=float).reshape(25, 2)
+    assert np.array_equal(batcher.predict(X), X)  # oversized requests run in max_batch_rows slices
+    with pytest.raises(ValueError):
+        batcher.predict(-np.ones((3, 2)))
+    assert calls == [10, 10, 5, 3]
+    assert batcher.stats()["largest_batch_rows"] == 10
+    assert batcher.stats()["requests"] == 1
+
+def test_micro_batcher_interleaves_small_requests_with_a_split_one():
+    calls, release = [], threading.Event()
+
+    def infer(model, X):
+        calls.append(len(X))
+        if len(calls) == 1:
+            release.wait(5)
+        return X
+
+    batcher = MicroBatcher(object(), infer, max_batch_rows=10, max_wait_ms=0)
+    large = np.arange(50, dtype=float).reshape(25, 2)
+    results = {}
+    large_thread = threading.Thread(target=lambda: results.update(large=batcher.predict(large)))
+    large_thread.start()
+    while not calls:
+        time.sleep(0.001)
+    # queued while the first slice runs: goes before the large request's next slice
+    small_thread = threading.Thread(target=lambda: results.update(small=batcher.predict(np.ones((3, 2)))))
+    small_thread.start()
+    while batcher.stats()["queue_depth"] == 0:
+        time.sleep(0.001)
+    release.set()
+    large_thread.join(5)
+    small_thread.join(5)
+
+    assert calls == [10, 3, 10, 5]
+    assert np.array_equal(results["large"], large)
+    assert np.array_equal(results["small"], np.ones((3, 2)))
+
+def test_inference_stats_endpoint():
+    main._batcher(main.model_registry.spec("NODE_PSR"))
+    response = client.get("/inference/stats")
+    assert response.status_code == 200
+    assert "queue_depth" in response.json()["NODE_PSR"]
+
+# Inference autotuning
+def test_predict_probabilities_uses_inference_config(monkeypatch):
+    model = NODEModel(dim=138, num_classes=3, solver="rk4:2").eval()
+    calls = []
+    original_forward = model.forward
+    monkeypatch.setattr(model, "forward", lambda x: calls.append(len(x)) or original_forward(x))
+
+    X = np.random.rand(10, 138).astype(np.float32)
+    set_inference_config(model, InferenceConfig(batch_size=4))
+    threads = torch.get_num_threads()
+    probs = predict_probabilities(model, X)
+    assert calls == [4, 4, 2] and probs.shape == (10, 3)
+    assert torch.get_num_threads() == threads  # a process setting, never switched per model
+
+    set_inference_config(model, None)
+    assert get_inference_config(model) is None
+    calls.clear()
+    predict_probabilities(model, X)
+    assert calls == [10]
+
+def test_tuning_cache_round_trip_and_registry_applies_it(tmp_path):
+    spec = MODEL_SPECS["NODE_raw"]
+    cache = TuningCache(tmp_path / "autotune.json")
+    key = model_key(spec, "rk4:2")
+    assert key == model_key(spec, "rk4:2") != model_key(spec, "dopri5")
+    assert cache.get(key) is None and cache.get_threads() is None
+
+    cache.put(key, InferenceConfig(batch_size=1024), windows_per_s=1.0, name=spec.name)
+    cache.put_threads(1, windows_per_s=1.0, models=[spec.name])
+    reopened = TuningCache(tmp_path / "autotune.json")
+    assert reopened.get(key) == InferenceConfig(1024) and reopened.get_threads() == 1
+
+    registry = ModelRegistry({"NODE_raw": spec}, solver="rk4:2", tuning_cache=cache)
+    assert get_inference_config(registry.get("NODE_raw")) == InferenceConfig(1024)
+
+def test_autotune_picks_a_candidate_and_restores_threads():
+    spec = MODEL_SPECS["NODE_raw"]
+    model = NODEModel(dim=spec.input_dim, num_classes=3, solver="rk4:2").eval()
+    threads = torch.get_num_threads()
+    config, windows_per_s, results = autotune_model(model, spec, batch_sizes=(32, 128), rows=256, repeat=1)
+    assert config.batch_size in (32, 128)
+    assert len(results) == 2 and windows_per_s == max(r["windows_per_s"] for r in results)
+
+    num_threads, _, results = autotune_threads([(model, spec)], thread_counts=[1, 2], rows=256, repeat=1)
+    assert num_threads in (1, 2) and [r["num_threads"] for r in results] == [1, 2]
+    assert torch.get_num_threads() == threads
+
+    with pytest.raises(AutotuneInterrupted):
+        autotune_model(model, spec, batch_sizes=(32,), rows=64, repeat=1, busy=lambda: True)
+
+def test_model_preloader_autotunes_untuned_models(tmp_path, monkeypatch):
+    cache = TuningCache(tmp_path / "autotune.json")
+    registry = ModelRegistry({"NODE_raw": MODEL_SPECS["NODE_raw"]}, tuning_cache=cache)
+
+    # requests in flight: tuning stops before it switches anything, and nothing is stored
+    busy = ModelPreloader(registry, ["NODE_raw"], warmup_rows=0, autotune=True, busy=lambda: True)
+    busy.run()
+    assert busy.ready and busy.status()["autotune"] == "interrupted" and busy.tuned == []
+    assert cache.get(model_key(MODEL_SPECS["NODE_raw"], None)) is None
+
+    calls = []
+    monkeypatch.setattr(
+        "autotune.autotune_model",
+        lambda model, spec, **kwargs: calls.append(spec.name) or (InferenceConfig(512), 1.0, []),
+    )
+    monkeypatch.setattr(
+        "autotune.autotune_threads",
+        lambda models, **kwargs: calls.append("threads") or (torch.get_num_threads(), 1.0, []),
+    )
+    preloader = ModelPreloader(registry, ["NODE_raw"], warmup_rows=0, autotune=True, busy=lambda: False)
+    preloader.run()
+    assert calls == ["NODE_raw", "threads"]
+    assert preloader.status()["tuned"] == ["NODE_raw", "threads"] and preloader.status()["autotune"] == "done"
+    assert get_inference_config(registry.get("NODE_raw")) == InferenceConfig(512)
+    assert cache.get_threads() == torch.get_num_threads()
+
+    preloader = ModelPreloader(ModelRegistry(registry.specs, tuning_cache=cache), ["NODE_raw"], autotune=True)
+    preloader.run()
+    assert calls == ["NODE_raw", "threads"] and preloader.status()["tuned"] == []
+
+# NDJSON streaming
+def test_stream_analyze_emits_one_line_per_record_matching_batch():
+    records = {"record_001": [make_rr(120, 11)], "record_002": [make_rr(80, 12)], "record_003": [make_rr(10, 13)]}
+    zip_bytes = create_record_zip(records).read()
+
+    streamed = client.post("/analyze/?stream=true", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+    batch = client.post("/analyze/", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+
+    assert streamed.status_code == 200
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    expected = batch.json()
+    assert [line["record_id"] for line in lines] == expected["record_ids"]
+    for i, line in enumerate(lines):
+        # per-record batches can take different adaptive ODE steps than the full batch
+        assert abs(line["prob_danger"] - expected["prob_danger"][i]) < 1e-3
+        assert abs(line["prob_af"] - expected["prob_af"][i]) < 1e-3
+        assert line["rr_features"] == pytest.approx(expected["rr_features"][line["record_id"]])
+        assert line["predict_threshold"] == expected["predict_threshold"]
+        assert line["detect_model"] == expected["detect_model"]
+
+def test_stream_rejects_invalid_zip_before_streaming():
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as zf:
+        zf.writestr("notes.txt", "not allowed")
+    response = client.post(
+        "/detect/?stream=true",
+        files={"records_zip": ("records.zip", memory_file.getvalue(), "application/zip")}
+    )
+    assert response.status_code == 400
+
+# Background jobs
+def wait_for_job(job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f"/jobs/{job_id}").json()
+        if status["status"] in ("done", "failed", "cancelled"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_job_result_matches_sync_endpoint(monkeypatch):
+    def fake_preprocess(*args, progress=None, **kwargs):
+        progress(records_done=0, records_total=2)
+        progress(records_done=2, records_total=2)
+        batch = WindowBatch(np.full((3, 138), 0.5, dtype=np.float32), ["record_001", "record_002"], np.array([0, 2, 3]))
+        return batch, {"record_001": [800, 810], "record_002": [700, 710]}
+
+    monkeypatch.setattr("main.preprocess_data", fake_preprocess)
+    monkeypatch.setattr(
+        "main.predict_probabilities",
+        lambda model, X: np.array([[0.6, 0.3, 0.1], [0.2, 0.4, 0.4], [0.9, 0.05, 0.05]])
+    )
+    zip_bytes = create_dummy_zip().read()
+
+    sync = client.post("/predict/", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+    submitted = client.post("/jobs/?task=predict", files={"records_zip": ("records.zip", zip_bytes, "application/zip")})
+    assert submitted.status_code == 202
+
+    status = wait_for_job(submitted.json()["job_id"])
+    assert status["status"] == "done"
+    assert status["records_done"] == status["records_total"] == 2
+
+    result = client.get(f"/jobs/{status['job_id']}/result")
+    assert result.status_code == 200
+    assert result.json() == sync.json()
+
+def test_job_failure_keeps_http_status():
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as zf:
+        zf.writestr("notes.txt", "not allowed")
+    submitted = client.post("/jobs/", files={"records_zip": ("records.zip", memory_file.getvalue(), "application/zip")})
+
+    status = wait_for_job(submitted.json()["job_id"])
+    assert status["status"] == "failed"
+    assert client.get(f"/jobs/{status['job_id']}/result").status_code == 400
+    assert client.get("/jobs/does-not-exist").status_code == 404
+
+def test_job_queue_bound_rejects_with_retry_after(monkeypatch):
+    manager = JobManager(max_workers=1, max_queued=1, retry_after=7)
+    release = threading.Event()
+    running = manager.submit("predict", lambda progress: release.wait(5))
+    queued = manager.submit("predict", lambda progress: None)
+    with pytest.raises(HTTPException) as exc_info:
+        manager.submit("predict", lambda progress: None)
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == "7"
+
+    monkeypatch.setattr("main.job_manager", manager)
+    copies = []
+    monkeypatch.setattr("main._copy_upload", lambda f: copies.append(f))
+    response = client.post("/jobs/", files={"records_zip": ("records.zip", create_dummy_zip().read(), "application/zip")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert copies == []  # rejected before the upload is copied
+
+    release.set()
+    queued._future.result(timeout=5)
+    assert running.status == queued.status == "done"
+    assert manager.submit("predict", lambda progress: None)._future.result(timeout=5) is None
+
+def test_job_manager_cancel_and_ttl_eviction():
+    manager = JobManager(max_workers=1, ttl_seconds=0.2)
+    started = threading.Event()
+    finished = []
+
+    def long_task(progress):
+        started.set()
+        while True:
+            progress(stage="preprocess")
+            time.sleep(0.01)
+
+    running = manager.submit("predict", long_task, on_finish=lambda: finished.append("running"))
+    queued = manager.submit("predict", long_task, on_finish=lambda: finished.append("queued"))
+    assert started.wait(5)
+
+    manager.cancel(queued.job_id)
+    assert queued.status == "cancelled"
+    manager.cancel(running.job_id)
+    running._future.result(timeout=5)
+    assert running.status == "cancelled"
+    assert sorted(finished) == ["queued", "running"]
+
+    time.sleep(0.3)
+    assert manager.get(running.job_id) is None
+
 def test_report_pdf():
     payload = {
         "record_id": "record_001",
@@ -218,6 +1523,23 @@ def test_report_pdf():
     assert response.headers["content-type"] == "application/pdf"
     assert len(response.content) > 100
 
+def test_report_decides_with_the_model_threshold():
+    def payload(**fields):
+        return {
+            "record_id": "record_001", "task_type": "af_detection", "decision": "Yes", "prob_af": 68,
+            "rr_features": {"mean_rr": 800.0, "estimated_hr_bpm": 75.0}, **fields,
+        }
+
+    # 68% is AF for the default detect model (0.65), not for raw_hybrid_two_class (0.72)
+    rule = lambda **fields: main._report_decision_rule(ReportRequest(**payload(**fields)))
+    assert rule() == (main.DETECT_MODEL, 0.65)
+    assert rule(model="raw_hybrid_two_class") == ("raw_hybrid_two_class", 0.72)
+    assert rule(threshold=0.7) == (None, 0.7)
+    assert client.post("/report/", json=payload(model="raw_hybrid_two_class")).status_code == 200
+    assert client.post("/report/", json=payload(threshold=0.7)).status_code == 200
+    assert client.post("/report/", json=payload(model="NODE_PSR")).status_code == 400
+    assert client.post("/report/", json=payload(model="nope")).status_code == 400
+
 def test_report_missing_fields():
     payload = {
         "record_id": "record_001",
@@ -0,0 +1,111 @@
+"""
+Export NODE checkpoints to self-contained TorchScript, so serving does not need torchdiffeq.
+
+The ODE block is integrated with a fixed-step solver (SolverConfig, e.g. "rk4:4") whose steps
+are unrolled into the traced graph: the artifact is a plain feed-forward network that gives the
+same output as the eager model with that solver. main.py loads it through load_model
+(AF_MODEL_PATH / AF_TWO_MODEL_PATH).
+
+Run from model_backend/:
+    python model_export.py Three_Class_Models/saved_models/NODE_PSR_best.pth --solver rk4:4
+    # -> Three_Class_Models/saved_models/NODE_PSR_best.rk4-4.ts
+    python model_export.py Three_Class_Models/saved_models/NODE_PSR_best.pth --solver rk4:4 --int8
+    # -> Three_Class_Models/saved_models/NODE_PSR_best.rk4-4.int8.ts (int8 Linear weights, CPU only)
+Check the solver first with benchmarks/validate_solver.py; benchmarks/bench_export.py compares latency.
+"""
+import argparse
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from model_utils import SolverConfig, TORCHSCRIPT_SUFFIX, load_checkpoint, quantize_model
+
+_ONE_THIRD = 1 / 3
+_TWO_THIRDS = 2 / 3
+
+
+def _rk_step(method, func, t0, dt, y0):
+    """One fixed step dy, same arithmetic as torchdiffeq's fixed-grid solvers."""
+    k1 = func(t0, y0)
+    if method == "euler":
+        return dt * k1
+    if method == "midpoint":
+        half_dt = 0.5 * dt
+        return dt * func(t0 + half_dt, y0 + k1 * half_dt)
+    if method == "heun2":
+        k2 = func(t0 + dt, y0 + dt * k1)
+        return dt * (k1 * 0.5 + k2 * 0.5)
+    if method == "heun3":
+        k2 = func(t0 + dt * _ONE_THIRD, y0 + dt * k1 * _ONE_THIRD)
+        k3 = func(t0 + dt * _TWO_THIRDS, y0 + dt * (k1 * 0.0 + k2 * _TWO_THIRDS))
+        return dt * (k1 * 0.25 + k2 * 0.0 + k3 * 0.75)
+    if method == "rk4":
+        # torchdiffeq's "rk4" is the 3/8-rule variant
+        k2 = func(t0 + dt * _ONE_THIRD, y0 + dt * k1 * _ONE_THIRD)
+        k3 = func(t0 + dt * _TWO_THIRDS, y0 + dt * (k2 - k1 * _ONE_THIRD))
+        k4 = func(t0 + dt, y0 + dt * (k1 - k2 + k3))
+        return (k1 + 3 * (k2 + k3) + k4) * dt * 0.125
+    raise ValueError(f"Unsupported fixed-step solver: {method}")
+
+
+class UnrolledODEModel(nn.Module):
+    """
+    NODEModel / HybridNODEAttentionModel with the ODE block integrated by an explicit
+    Python loop over a fixed grid, which tracing unrolls into straight-line ops.
+    """
+
+    def __init__(self, model, solver):
+        super(UnrolledODEModel, self).__init__()
+        self.solver = SolverConfig.parse(solver)
+        if not self.solver.fixed_step:
+            raise ValueError(f"Export needs a fixed-step solver (e.g. rk4:4), got {self.solver}")
+        self.model = model
+        grid = self.solver.time_grid().tolist()
+        self.steps = list(zip(grid[:-1], [t1 - t0 for t0, t1 in zip(grid[:-1], grid[1:])]))
+
+    def forward(self, x):
+        y = x
+        for t0, dt in self.steps:
+            y = y + _rk_step(self.solver.method, self.model.odefunc, t0, dt, y)
+        return self.model.head(y)
+
+
+def export_torchscript(model, solver, path):
+    """Trace model with the given fixed-step solver unrolled and save it as TorchScript."""
+    unrolled = UnrolledODEModel(model, solver).eval()
+    dim = model.odefunc.net[0].in_features
+    with torch.no_grad():
+        traced = torch.jit.trace(unrolled, torch.zeros(2, dim), check_trace=False)
+    traced.save(str(path))
+    return traced
+
+
+def default_export_path(checkpoint, solver, int8=False):
+    solver = SolverConfig.parse(solver)
+    checkpoint = Path(checkpoint)
+    precision = ".int8" if int8 else ""
+    return checkpoint.with_name(f"{checkpoint.stem}.{solver.method}-{solver.steps}{precision}{TORCHSCRIPT_SUFFIX}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checkpoints", nargs="+", help="state_dict checkpoints (*.pth)")
+    parser.add_argument("--solver", default="rk4:4", help="fixed-step solver spec, e.g. rk4:4, midpoint:8")
+    parser.add_argument("--int8", action="store_true", help="int8 dynamic quantization of the Linear layers")
+    parser.add_argument("--out", default=None, help="output path (single checkpoint only)")
+    args = parser.parse_args()
+    if args.out and len(args.checkpoints) > 1:
+        parser.error("--out needs exactly one checkpoint")
+
+    for checkpoint in args.checkpoints:
+        model = load_checkpoint(checkpoint, solver=args.solver)
+        if args.int8:
+            model = quantize_model(model)
+        path = args.out or default_export_path(checkpoint, args.solver, args.int8)
+        export_torchscript(model, args.solver, path)
+        print(f"{checkpoint} -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Literal
+
+import torch
+from fastapi import HTTPException
+
+from model_utils import (
+    HybridNODEAttentionModel,
+    MODEL_PRECISIONS,
+    NODEModel,
+    SolverConfig,
+    load_model,
+    quantize_model,
+    set_inference_config,
+)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    One servable checkpoint.
+    - representation: "psr" = PSR embedding (m=3, tau=2) of each 50-beat window, 138 features
+                      "raw" = the 50-beat window itself, 50 features
+    - aggregation: per-record rule over the window probabilities
+        "p75_danger": 75th percentile of 1 - P(SR) (three-class early prediction)
+        "max_af":     max P(AF) (two-class detection)
+    - threshold: decision threshold on the aggregated probability
+    - precision: "float32" or "int8" (see model_utils.quantize_model)
+    """
+    name: str
+    path: str
+    architecture: Literal["node", "hybrid"]
+    representation: Literal["psr", "raw"]
+    num_classes: int
+    aggregation: Literal["p75_danger", "max_af"]
+    threshold: float
+    precision: str = "float32"
+
+    @property
+    def task(self):
+        return "predict" if self.num_classes == 3 else "detect"
+
+    @property
+    def input_dim(self):
+        return 138 if self.representation == "psr" else 50
+
+    @property
+    def window_params(self):
+        """m / tau for build_psr_windows (m=1 keeps the raw window)."""
+        return {"m": 3, "tau": 2} if self.representation == "psr" else {"m": 1, "tau": 1}
+
+    @property
+    def model_class(self):
+        return HybridNODEAttentionModel if self.architecture == "hybrid" else NODEModel
+
+
+def _spec(name, architecture, representation, num_classes, threshold):
+    folder = "Three_Class_Models" if num_classes == 3 else "Two_Class_Models"
+    aggregation = "p75_danger" if num_classes == 3 else "max_af"
+    return ModelSpec(
+        name=name,
+        path=f"{folder}/saved_models/{name}_best.pth",
+        architecture=architecture,
+        representation=representation,
+        num_classes=num_classes,
+        aggregation=aggregation,
+        threshold=threshold,
+    )
+
+
+# Every checkpoint in */saved_models, by name (the file stem without "_best"), with the decision
+# threshold its training notebook chose on the validation set (BEST THRESHOLD, 96% F1 rule)
+MODEL_SPECS = {spec.name: spec for spec in (
+    _spec("NODE_PSR", "node", "psr", 3, 0.53),
+    _spec("NODE_raw", "node", "raw", 3, 0.54),
+    _spec("PSR_hybrid", "hybrid", "psr", 3, 0.56),
+    _spec("raw_hybrid", "hybrid", "raw", 3, 0.56),
+    _spec("NODE_PSR_two_class", "node", "psr", 2, 0.65),
+    _spec("NODE_raw_two_class", "node", "raw", 2, 0.63),
+    _spec("PSR_hybrid_two_class", "hybrid", "psr", 2, 0.67),
+    _spec("raw_hybrid_two_class", "hybrid", "raw", 2, 0.72),
+)}
+
+
+def parse_model_precisions(text, specs=MODEL_SPECS):
+    """
+    "NODE_raw=int8,PSR_hybrid=float32" -> {name: precision}; ValueError for an unknown model
+    name, an unknown precision or an entry that is not name=precision.
+    """
+    precisions = {}
+    for entry in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, sep, precision = (part.strip() for part in entry.partition("="))
+        if not sep or not name or not precision:
+            raise ValueError(f"Bad model precision entry {entry!r}, expected name=precision")
+        if name not in specs:
+            raise ValueError(f"Unknown model {name!r} in model precisions. Available: {', '.join(sorted(specs))}")
+        if precision not in MODEL_PRECISIONS:
+            raise ValueError(f"Unknown model precision {precision!r} for {name}, expected one of {MODEL_PRECISIONS}")
+        precisions[name] = precision
+    return precisions
+
+
+class ModelRegistry:
+    """
+    Models by name, loaded on first use.
+    - get() loads the checkpoint (ODE solver and precision applied) and keeps it in an LRU
+      bounded by max_bytes, using the checkpoint file size as the memory estimate
+    - Concurrent first uses of one model load it once
+    - tuning_cache (autotune.TuningCache): a stored batch size for the model on this CPU is
+      applied when it loads
+    """
+
+    def __init__(self, specs, solver=None, device=torch.device("cpu"), max_bytes=512 * 1024 ** 2, tuning_cache=None):
+        SolverConfig.parse(solver)  # a bad AF_ODE_SOLVER fails here, at startup, not on first use
+        for spec in specs.values():
+            if spec.precision not in MODEL_PRECISIONS:
+                raise ValueError(f"Unknown model precision {spec.precision!r}, expected one of {MODEL_PRECISIONS}")
+            if spec.precision == "int8" and device.type != "cpu":
+                raise ValueError("int8 models run on CPU only")
+        self.specs = dict(specs)
+        self.solver = solver
+        self.device = device
+        self.max_bytes = max_bytes
+        self.tuning_cache = tuning_cache
+
+        self._models = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.specs}
+        self.loads = 0
+        self.evictions = 0
+
+    def spec(self, name) -> ModelSpec:
+        spec = self.specs.get(name)
+        if spec is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown model {name!r}. Available: {', '.join(sorted(self.specs))}",
+            )
+        return spec
+
+    def get(self, name):
+        spec = self.spec(name)
+        model = self._cached(name)
+        if model is not None:
+            return model
+        with self._load_locks[name]:
+            model = self._cached(name)
+            if model is None:
+                model = self._load(spec)
+                self._put(name, model, os.path.getsize(spec.path))
+        return model
+
+    def describe(self):
+        with self._lock:
+            loaded = set(self._models)
+        return [
+            {**asdict(spec), "task": spec.task, "input_dim": spec.input_dim, "loaded": spec.name in loaded}
+            for spec in self.specs.values()
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._models),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+    def _cached(self, name):
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None:
+                return None
+            self._models.move_to_end(name)
+            return entry[0]
+
+    def _load(self, spec):
+        model = load_model(spec.model_class, spec.path, spec.input_dim, spec.num_classes, solver=self.solver)
+        if spec.precision == "int8":
+            model = quantize_model(model)
+        model = model.to(self.device).eval()
+        if self.tuning_cache is not None:
+            from autotune import model_key
+            set_inference_config(model, self.tuning_cache.get(model_key(spec, self.solver)))
+        return model
+
+    def _put(self, name, model, size):
+        with self._lock:
+            self._models[name] = (model, size)
+            self._bytes += size
+            self.loads += 1
+            # the model just loaded always stays, even if it alone exceeds max_bytes
+            while self._bytes > self.max_bytes and len(self._models) > 1:
+                _, (_, evicted_size) = self._models.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+
+class ModelPreloader:
+    """
+    Loads and warms up the given models on a background thread (start()) or inline (run()),
+    so the server can accept connections (liveness) before it is ready to score (readiness).
+    Requests that arrive earlier still work: they wait for / trigger the load in the registry.
+    - warmup_rows: rows of zeros at each model's own input width run once after loading (0 = off)
+    - autotune: after warmup, tune (autotune.py) the batch size of the models with no entry in the
+      registry's tuning_cache, then the process thread count if none is stored, and store the
+      results; the server is ready only once this is done. busy() (requests in flight) stops it:
+      tuning switches the process thread count under running inference, so it is left for the
+      next start (autotune_state "interrupted")
+    """
+
+    def __init__(self, registry, names, warmup_rows=64, autotune=False, busy=None):
+        if autotune and registry.tuning_cache is None:
+            raise ValueError("autotune needs a registry with a tuning_cache")
+        self.registry = registry
+        self.names = list(names)
+        self.warmup_rows = warmup_rows
+        self.autotune = autotune
+        self.busy = busy
+        self.tuned = []
+        self.autotune_state = "pending" if autotune else "off"
+        self.state = "pending"
+        self.error = None
+        self.seconds = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="model-preload", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        t0 = time.perf_counter()
+        self.state = "loading"
+        try:
+            for name in self.names:
+                model = self.registry.get(name)
+                if self.warmup_rows:
+                    dummy = torch.zeros((self.warmup_rows, self.registry.spec(name).input_dim), device=self.registry.device)
+                    with torch.inference_mode():
+                        model(dummy)
+            if self.autotune:
+                self._autotune()
+            if self.registry.device.type == "cuda":
+                torch.cuda.synchronize()
+        except Exception as e:
+            self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.seconds = time.perf_counter() - t0
+        self.state = "ready"
+
+    def _autotune(self):
+        from autotune import AutotuneInterrupted, model_key, tune_registry_model, tune_registry_threads
+
+        cache = self.registry.tuning_cache
+        try:
+            for name in self.names:
+                if cache.get(model_key(self.registry.spec(name), self.registry.solver)) is None:
+                    tune_registry_model(self.registry, name, cache, busy=self.busy)
+                    self.tuned.append(name)
+            if self.names and cache.get_threads() is None:
+                tune_registry_threads(self.registry, self.names, cache, busy=self.busy)
+                self.tuned.append("threads")
+        except AutotuneInterrupted:
+            self.autotune_state = "interrupted"
+            return
+        self.autotune_state = "done"
+
+    def status(self):
+        return {
+            "state": self.state,
+            "models": self.names,
+            "seconds": self.seconds,
+            "error": self.error,
+            "tuned": self.tuned,
+            "autotune": self.autotune_state,
+        }
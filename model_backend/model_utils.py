@@ -1,18 +1,24 @@
 import numpy as np
-import pandas as pd
 import torch, os
-from Dataset_preparation.record import Record, create_record
+import itertools
+import multiprocessing
+import threading
+from numpy.lib.stride_tricks import sliding_window_view
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from Dataset_preparation.record import RR_CHUNK_BEATS, Record, RecordFiles, create_record
 
 import torch.nn as nn
 import torch.nn.functional as F
-from torchdiffeq import odeint
 
 from pydantic import BaseModel
-from typing import Dict, Optional, Literal
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Literal
 
 import time
+import weakref
+from collections import deque
 import numpy as np
-import pandas as pd
 
 class ODEFunc(nn.Module):
     def __init__(self, dim):
@@ -26,9 +32,84 @@ class ODEFunc(nn.Module):
     def forward(self, t, x):
         return self.net(x)
 
+# torchdiffeq methods SolverConfig accepts: explicit fixed-grid Runge-Kutta methods, run on a
+# grid of `steps` equal steps, and the adaptive ones, run on [0, 1] with rtol / atol
+FIXED_STEP_SOLVERS = ("euler", "midpoint", "heun2", "heun3", "rk4")
+ADAPTIVE_SOLVERS = ("dopri5", "dopri8", "bosh3", "fehlberg2", "adaptive_heun")
+TORCHSCRIPT_SUFFIX = ".ts"
+MODEL_PRECISIONS = ("float32", "int8")
+
+
+@dataclass
+class SolverConfig:
+    """
+    How NODE models integrate t in [0, 1].
+    - Adaptive (dopri5, the training default): rtol / atol, data-dependent number of steps
+    - Fixed-step (rk4, midpoint, euler, ...): `steps` equal steps, fixed cost per batch
+    Spec strings: "dopri5", "dopri5:1e-5:1e-7" (rtol:atol), "rk4:8", "midpoint:16".
+    """
+    method: str = "dopri5"
+    steps: Optional[int] = None
+    rtol: float = 1e-7
+    atol: float = 1e-9
+
+    @classmethod
+    def parse(cls, spec):
+        if spec is None:
+            return cls()
+        if isinstance(spec, cls):
+            return spec
+        method, *args = str(spec).strip().split(":")
+        if method in FIXED_STEP_SOLVERS:
+            if len(args) > 1:
+                raise ValueError(f"Fixed-step solver spec is method:steps, got {spec!r}")
+            steps = int(args[0]) if args else 1
+            if steps < 1:
+                raise ValueError(f"Solver steps must be >= 1, got {spec!r}")
+            return cls(method=method, steps=steps)
+        if method not in ADAPTIVE_SOLVERS:
+            raise ValueError(
+                f"Unknown ODE solver {method!r} in {spec!r}, expected one of "
+                f"{', '.join(FIXED_STEP_SOLVERS)} (method:steps) or {', '.join(ADAPTIVE_SOLVERS)} (method:rtol:atol)"
+            )
+        if len(args) > 2:
+            raise ValueError(f"Adaptive solver spec is method:rtol:atol, got {spec!r}")
+        config = cls(method=method)
+        if args:
+            config.rtol = float(args[0])
+            config.atol = float(args[1]) if len(args) > 1 else config.atol
+        if config.rtol <= 0 or config.atol <= 0:
+            raise ValueError(f"Solver rtol / atol must be > 0, got {spec!r}")
+        return config
+
+    @property
+    def fixed_step(self):
+        return self.method in FIXED_STEP_SOLVERS
+
+    def time_grid(self, dtype=torch.float32, device=None):
+        """Integration grid: [0, 1] for adaptive solvers, steps + 1 equally spaced points otherwise."""
+        n_points = self.steps + 1 if self.fixed_step else 2
+        return torch.linspace(0.0, 1.0, n_points, dtype=dtype, device=device)
+
+    def integrate(self, func, x):
+        """State of dx/dt = func(t, x) at t = 1."""
+        from torchdiffeq import odeint  # imported on first use: TorchScript exports never need it
+
+        t = self.time_grid(x.dtype, x.device)
+        if self.fixed_step:
+            return odeint(func, x, t, method=self.method)[-1]
+        return odeint(func, x, t, method=self.method, rtol=self.rtol, atol=self.atol)[-1]
+
+    def __str__(self):
+        if self.fixed_step:
+            return f"{self.method}:{self.steps}"
+        return f"{self.method}:{self.rtol:g}:{self.atol:g}"
+
+
 class NODEModel(nn.Module):
-    def __init__(self, dim, num_classes):
+    def __init__(self, dim, num_classes, solver=None):
         super(NODEModel, self).__init__()
+        self.solver = SolverConfig.parse(solver)
         self.odefunc = ODEFunc(dim)
         self.classifier = nn.Sequential(
             nn.Linear(dim, 64),
@@ -36,10 +117,51 @@ class NODEModel(nn.Module):
             nn.Linear(64, num_classes)
         )
 
+    def head(self, z):
+        """Layers after the ODE block."""
+        return self.classifier(z)
+
+    def forward(self, x):
+        return self.head(self.solver.integrate(self.odefunc, x))
+
+
+class SelfAttention(nn.Module):
+    def __init__(self, dim):
+        super(SelfAttention, self).__init__()
+        self.query = nn.Linear(dim, dim)
+        self.key = nn.Linear(dim, dim)
+        self.value = nn.Linear(dim, dim)
+        self.scale = dim ** 0.5
+
     def forward(self, x):
-        t = torch.tensor([0.0, 1.0], dtype=x.dtype, device=x.device)
-        out = odeint(self.odefunc, x, t)[-1]
-        return self.classifier(out)
+        x1 = x.unsqueeze(1)
+        Q = self.query(x1)
+        K = self.key(x1)
+        V = self.value(x1)
+        scores = torch.softmax(torch.bmm(Q, K.transpose(1, 2)) / self.scale, dim=-1)
+        out = torch.bmm(scores, V)  # [batch, 1, dim]
+        return out.squeeze(1)
+
+
+class HybridNODEAttentionModel(nn.Module):
+    """NODE block followed by self-attention (the *_hybrid_* checkpoints, see train_*_hybrid.ipynb)."""
+
+    def __init__(self, dim, num_classes, solver=None):
+        super(HybridNODEAttentionModel, self).__init__()
+        self.solver = SolverConfig.parse(solver)
+        self.odefunc = ODEFunc(dim)
+        self.attn = SelfAttention(dim)
+        self.classifier = nn.Sequential(
+            nn.Linear(dim, 64),
+            nn.ReLU(),
+            nn.Linear(64, num_classes)
+        )
+
+    def head(self, z):
+        return self.classifier(self.attn(z))
+
+    def forward(self, x):
+        return self.head(self.solver.integrate(self.odefunc, x))
 
 def phase_space_reconstruct(x, m=3, tau=2):
     """
@@ -58,30 +180,333 @@ def phase_space_reconstruct(x, m=3, tau=2):
     psr_flat = np.column_stack(psr_vectors).flatten()
     return psr_flat
 
+# Serving input: windows of WINDOW_SIZE beats every STEP_SIZE beats, RR in ms divided by INPUT_SCALE (-> s).
+# Everything that feeds the models (main.py, autotune.py, benchmarks) builds windows with these.
+WINDOW_SIZE = 50
+STEP_SIZE = 5
+INPUT_SCALE = 1000.0
+
+
+def count_windows(n, window_size=50, step_size=5):
+    """Number of windows preprocess_data builds for an RR series of length n (at least one)."""
+    if n < window_size:
+        return 1
+    return (n - window_size) // step_size + 1
+
+
+def build_psr_windows(rr_series, window_size=50, step_size=5, m=3, tau=2, scale=1.0):
+    """
+    Sliding-window PSR features for several RR series in one preallocated float32 buffer.
+    - Windows are strided views of each series (no per-window slices / pads / stacks)
+    - Row k is bit-identical to phase_space_reconstruct(window_k).astype(np.float32)
+    - Rows are divided by scale in place (scale=1000.0 gives the model input)
+    Returns (X, offsets): rows offsets[i]:offsets[i + 1] belong to rr_series[i].
+    """
+    n_points = window_size - (m - 1) * tau
+    if n_points < 1:
+        raise ValueError("window_size too short for the PSR embedding (m, tau)")
+
+    counts = [count_windows(len(rr), window_size, step_size) for rr in rr_series]
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    X = np.empty((offsets[-1], n_points * m), dtype=np.float32)
+
+    for i, rr in enumerate(rr_series):
+        rr = np.asarray(rr)
+        if len(rr) < window_size:
+            rr = np.pad(rr, (0, window_size - len(rr)), "constant")
+        windows = sliding_window_view(rr, window_size)[::step_size]
+
+        # Same layout as phase_space_reconstruct: feature t * m + d is window[t + d]
+        # (tau only shortens the embedding). Fill one embedding dimension at a time.
+        rows = X[offsets[i]:offsets[i + 1]].reshape(-1, n_points, m)
+        for d in range(m):
+            rows[:, :, d] = windows[:, d:d + n_points]
+
+    if scale != 1.0:
+        X /= scale
+    return X, offsets
+
+
+def iter_psr_windows(rr_chunks, window_size=50, step_size=5, m=3, tau=2, scale=1.0):
+    """
+    build_psr_windows over one series that arrives in chunks (e.g. Record.iter_rr).
+    Yields blocks of rows; together they equal build_psr_windows([np.concatenate(rr_chunks)], ...)[0].
+    Only the overlap a window needs from the next chunk (< window_size beats) is carried over.
+    """
+    carry = np.empty(0)
+    produced = False
+    for chunk in rr_chunks:
+        buffer = np.concatenate([carry, chunk]) if len(carry) else np.asarray(chunk)
+        if len(buffer) < window_size:
+            carry = buffer
+            continue
+        X, _ = build_psr_windows([buffer], window_size, step_size, m, tau, scale)
+        carry = buffer[len(X) * step_size:]
+        produced = True
+        yield X
+    if not produced:
+        # shorter than one window: a single zero-padded window, as build_psr_windows
+        yield build_psr_windows([carry], window_size, step_size, m, tau, scale)[0]
+
+
+
+@dataclass
+class WindowBatch:
+    """
+    PSR windows of several records, stored record after record.
+    - X: (n_windows, n_features) float32 model input
+    - record_ids: one id per record, in row order
+    - offsets: rows offsets[i]:offsets[i + 1] belong to record_ids[i] (every record has >= 1 row)
+    Segmented reductions aggregate per-window values (e.g. probabilities) per record.
+    """
+    X: np.ndarray
+    record_ids: List[str]
+    offsets: np.ndarray
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Integer record index of every window."""
+        return np.repeat(np.arange(len(self.record_ids), dtype=np.int32), self.counts)
+
+    def max(self, values) -> np.ndarray:
+        return np.maximum.reduceat(np.asarray(values), self.offsets[:-1])
+
+    def mean(self, values) -> np.ndarray:
+        sums = np.add.reduceat(np.asarray(values, dtype=np.float64), self.offsets[:-1])
+        return sums / self.counts
+
+    def quantile(self, values, q) -> np.ndarray:
+        """Per-record quantile with linear interpolation (same as pandas groupby().quantile(q))."""
+        values = np.asarray(values, dtype=np.float64)
+        starts, counts = self.offsets[:-1], self.counts
+        # sort inside each record segment (codes are already grouped, so sort by value within code)
+        ordered = values[np.lexsort((values, self.codes))]
+
+        position = q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, counts - 1)
+        frac = position - lower
+        low_val = ordered[starts + lower]
+        high_val = ordered[starts + upper]
+        return low_val + (high_val - low_val) * frac
+
+
+_preprocess_pool = None
+_preprocess_pool_workers = 0
+_preprocess_pool_lock = threading.Lock()
+
+
+def _pool_context():
+    """
+    Workers start from a fork server that only imported model_utils, not by forking the
+    threaded server process (torch / OpenMP, batcher and job threads hold locks).
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["model_utils"])
+    return context
+
+
+def get_preprocess_pool(workers: int, broken: ProcessPoolExecutor = None) -> ProcessPoolExecutor:
+    """
+    Process pool shared across requests (started once, resized on demand),
+    so per-request cost is only pickling record files / results.
+    broken: a pool that raised BrokenProcessPool (a worker was killed / crashed); it is replaced,
+    unless another request already did.
+    """
+    global _preprocess_pool, _preprocess_pool_workers
+    with _preprocess_pool_lock:
+        if _preprocess_pool is not None and (_preprocess_pool is broken or _preprocess_pool_workers != workers):
+            _preprocess_pool.shutdown(wait=False)
+            _preprocess_pool = None
+        if _preprocess_pool is None:
+            _preprocess_pool = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+            _preprocess_pool_workers = workers
+        return _preprocess_pool
+
+
+def _preprocess_record(record_id, records_dir, files):
+    """
+    Load + clean one record's RR and return it concatenated across days.
+    Runs in the request thread or a pool worker.
+    """
+    record = create_record(record_id, None, records_dir, files=files)
+    return record.load_rr()
+
+
+def _submit_records(record_ids, record_index, records_dir, workers):
+    """{record_id: (pool, Future)} on the shared pool, or (None, exception) when submitting failed."""
+    submitted = {}
+    for record_id in record_ids:
+        pool = get_preprocess_pool(workers)
+        try:
+            try:
+                future = pool.submit(_preprocess_record, record_id, records_dir, record_index[record_id])
+            except BrokenProcessPool:
+                pool = get_preprocess_pool(workers, broken=pool)
+                future = pool.submit(_preprocess_record, record_id, records_dir, record_index[record_id])
+            submitted[record_id] = pool, future
+        except Exception as e:
+            submitted[record_id] = None, e
+    return submitted
+
+
+def _await_record(record_id, remaining, submitted, retried, record_index, records_dir, workers):
+    """
+    Result of record_id's pool job. If its pool broke, the pool is replaced and every record of
+    remaining lost with it is resubmitted (updating submitted); record_id itself is retried once.
+    """
+    while True:
+        pool, future = submitted[record_id]
+        if pool is None:
+            raise future
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            if record_id in retried:
+                raise
+            retried.add(record_id)
+            get_preprocess_pool(workers, broken=pool)
+            lost = [
+                rid for rid in remaining
+                if rid in submitted and submitted[rid][0] is pool
+                and not (submitted[rid][1].done() and submitted[rid][1].exception() is None)
+            ]
+            submitted.update(_submit_records(lost, record_index, records_dir, workers))
+
+
+def _cache_lookup(files, cache):
+    """(cache key, cached RR or None) of a record; (None, None) without a cache or for unreadable files."""
+    if cache is None:
+        return None, None
+    try:
+        key = cache.key_for(files.rr)
+    except Exception:
+        return None, None  # let the normal path report the error
+    return key, cache.get(key)
+
+
+def _release_files(files):
+    """Drop RR bytes the cache key kept on archive members (zip_ingest.ZipMember.read(keep=True))."""
+    for source in files.rr:
+        if hasattr(source, "release"):
+            source.release()
+
+
+def _iter_preprocessed_records(record_list, record_index, records_dir, workers, cache=None):
+    """
+    Yield (record_id, rri, error) in record_list order.
+    Errors are returned per record instead of raised, so one bad record never stops the batch.
+    With a cache (preprocess_cache.PreprocessCache) only new / changed records are recomputed:
+    records are hashed just ahead of loading (at most 2 * workers misses in flight), and the
+    bytes read for the key are the ones loaded, so each RR file is inflated once.
+    When a pool worker dies (OOM kill, crash in h5py), the pool is replaced and the records that
+    were lost with it are resubmitted; the record being waited for is retried once, then skipped.
+    """
+    records = iter(record_list)
+    ahead = deque()  # (record_id, cache key, cached RR), looked up but not yielded yet
+    submitted = {}
+    retried = set()
+    max_misses = 2 * workers if workers > 1 else 1
+
+    def look_ahead():
+        while sum(rri is None for _, _, rri in ahead) < max_misses:
+            record_id = next(records, None)
+            if record_id is None:
+                return
+            key, rri = _cache_lookup(record_index[record_id], cache)
+            ahead.append((record_id, key, rri))
+            if rri is not None:
+                _release_files(record_index[record_id])
+            elif workers > 1:
+                submitted.update(_submit_records([record_id], record_index, records_dir, workers))
+
+    try:
+        look_ahead()
+        while ahead:
+            record_id, key, rri = ahead.popleft()
+            if rri is not None:
+                look_ahead()
+                yield record_id, rri, None
+                continue
+            error = None
+            try:
+                if workers > 1:
+                    remaining = [record_id] + [rid for rid, _, _ in ahead]
+                    rri = _await_record(record_id, remaining, submitted, retried, record_index, records_dir, workers)
+                    del submitted[record_id]
+                else:
+                    rri = _preprocess_record(record_id, records_dir, record_index[record_id])
+            except Exception as e:
+                error = e
+            _release_files(record_index[record_id])
+            look_ahead()
+            if error is not None:
+                yield record_id, None, error
+                continue
+            if key is not None:
+                cache.put(key, rri)
+            yield record_id, rri, None
+    finally:
+        # caller stopped early (e.g. job cancelled): drop records not started yet
+        for pool, future in submitted.values():
+            if pool is not None:
+                future.cancel()
+
+
+def _record_index(records_dir, archive):
+    """{record_id: RecordFiles} for an uploaded ZIP (archive) or a folder of record folders."""
+    if archive is not None:
+        record_index = archive.records
+        records_dir = ""
+    else:
+        if not records_dir or not os.path.isdir(records_dir):
+            raise ValueError("records_dir not found / invalid")
+
+        record_index = {
+            d: RecordFiles.from_folder(os.path.join(records_dir, d))
+            for d in os.listdir(records_dir)
+            if os.path.isdir(os.path.join(records_dir, d))
+        }
+
+    if not record_index:
+        raise ValueError("No record folders found in records_dir.")
+    return record_index, records_dir
+
+
 def preprocess_data(
-    records_dir: str,
+    records_dir: str = None,
     window_size=50,
     step_size=5,
     m=3,
-    tau=2
+    tau=2,
+    archive=None,
+    workers=1,
+    scale=1.0,
+    cache=None,
+    progress=None
 ):
     """
-    - Detect record folders inside records_dir
-    - Load RR from each folder using Record(record_folder, metadata_record=None)
-    - Build PSR windows -> X
+    - Detect record folders inside records_dir, or records inside an uploaded
+      ZIP when archive (zip_ingest.ZipRecords) is given - no extraction needed
+    - Index each record's files once (RecordFiles) and load RR through
+      Record(record_folder, metadata_record=None, files=...)
+    - Build PSR windows for all records into one float32 buffer (divided by scale)
+    - workers > 1 runs records on a shared process pool; output order is the
+      same as the serial path and failing records are still skipped + logged
+    - cache (preprocess_cache.PreprocessCache) reuses cleaned RR of unchanged records
+    - progress(records_done=..., records_total=...) is called after every record
+    Returns (WindowBatch, {record_id: raw RR})
     """
-    if not records_dir or not os.path.isdir(records_dir):
-        raise ValueError("records_dir not found / invalid")
+    record_index, records_dir = _record_index(records_dir, archive)
+    record_list = sorted(record_index)
 
-    record_list = sorted([
-        d for d in os.listdir(records_dir)
-        if os.path.isdir(os.path.join(records_dir, d))
-    ])
-
-    if not record_list:
-        raise ValueError("No record folders found in records_dir.")
-
-    feature_rows = []
     record_ids = []
     raw_rr = {}
 
@@ -89,50 +514,127 @@ def preprocess_data(
     skipped_count = 0
     t_global = time.time()
 
-    for record_id in record_list:
-        try:
-            record = create_record(record_id, None, records_dir)
-            record.load_rr_record()
-
-            rri = np.concatenate(record.rr)
-            raw_rr[record_id] = rri
-            n = len(rri)
-
-            # windows (at least one)
-            for start in range(0, max(1, n - window_size + 1), step_size):
-                window = rri[start:start + window_size]
-                if len(window) < window_size:
-                    window = np.pad(window, (0, window_size - len(window)), "constant")
+    if progress is not None:
+        progress(records_done=0, records_total=len(record_list))
 
-                psr = phase_space_reconstruct(window, m=m, tau=tau)
-                feature_rows.append(psr)
-                record_ids.append(record_id)
+    for record_id, rri, error in _iter_preprocessed_records(
+        record_list, record_index, records_dir, workers, cache
+    ):
+        if progress is not None:
+            progress(records_done=processed_count + skipped_count + 1, records_total=len(record_list))
 
-                if n < window_size:
-                    break
-
-            processed_count += 1
-
-        except Exception as e:
+        if error is not None:
             skipped_count += 1
-            print(f"[preprocess_data] SKIP {record_id}: {type(e).__name__}: {e}")
+            print(f"[preprocess_data] SKIP {record_id}: {type(error).__name__}: {error}")
             continue
 
-    if len(feature_rows) == 0:
+        raw_rr[record_id] = rri
+        record_ids.append(record_id)
+        processed_count += 1
+
+    if processed_count == 0:
         raise ValueError(
             "No valid records processed. Check zip structure (record folders + RR file names)."
         )
 
-    X = np.stack(feature_rows).astype(np.float32)
-    record_ids = np.array(record_ids)
-    return X, record_ids, raw_rr
+    X, offsets = build_psr_windows(
+        [raw_rr[rid] for rid in record_ids],
+        window_size=window_size, step_size=step_size, m=m, tau=tau, scale=scale
+    )
+    return WindowBatch(X, record_ids, offsets), raw_rr
+
+def _record_blocks(rri, window_size, step_size, window_params, scale, chunk_beats, summary):
+    """
+    Windows of rri in blocks cut from consecutive chunk_beats-beat slices: one tuple per block with
+    the windows in each of window_params. summary (RRSummary) is updated as the slices are read.
+    """
+    def chunks():
+        for start in range(0, len(rri), chunk_beats):
+            chunk = rri[start:start + chunk_beats]
+            summary.update(chunk)
+            yield chunk
+
+    # every representation cuts the same windows from the same slices, so the blocks line up
+    copies = itertools.tee(chunks(), len(window_params))
+    return zip(*(
+        iter_psr_windows(rr_chunks, window_size, step_size, scale=scale, **params)
+        for rr_chunks, params in zip(copies, window_params)
+    ))
+
+
+def iter_record_windows(
+    records_dir: str = None,
+    window_size=50,
+    step_size=5,
+    window_params=({"m": 3, "tau": 2},),
+    archive=None,
+    workers=1,
+    scale=1.0,
+    cache=None,
+    chunk_beats=RR_CHUNK_BEATS,
+):
+    """
+    Per-record version of preprocess_data for streaming responses.
+    Yields (record_id, blocks, summary) as soon as each record's RR is cleaned, in the same
+    order as preprocess_data. Failing records are skipped + logged.
+    - blocks yields, per chunk_beats beats, a tuple with the windows in each of window_params
+      ({"m": ..., "tau": ...}); concatenated, they equal preprocess_data's rows for the record
+    - summary (RRSummary) gives compute_rr_features of the record once blocks is exhausted
+    Windows (about 14x the cleaned RR in bytes for PSR) are built one block at a time; the cleaned
+    RR itself is still loaded whole, as the cache and the pool workers exchange it.
+    """
+    record_index, records_dir = _record_index(records_dir, archive)
+
+    for record_id, rri, error in _iter_preprocessed_records(
+        sorted(record_index), record_index, records_dir, workers, cache
+    ):
+        if error is not None:
+            print(f"[iter_record_windows] SKIP {record_id}: {type(error).__name__}: {error}")
+            continue
+
+        summary = RRSummary()
+        blocks = _record_blocks(rri, window_size, step_size, list(window_params), scale, chunk_beats, summary)
+        yield record_id, blocks, summary
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+@dataclass
+class InferenceConfig:
+    """
+    Per-model predict_probabilities settings, normally found by autotune.py.
+    torch's thread count is not one of them: it is a process setting (autotune.apply_thread_count).
+    """
+    batch_size: int = DEFAULT_BATCH_SIZE
+
+
+_inference_configs = weakref.WeakKeyDictionary()
+
 
-def predict_probabilities(model, X, batch_size=4096):
-    import time
-    t0 = time.time()
+def set_inference_config(model, config: Optional[InferenceConfig]):
+    if config is None:
+        _inference_configs.pop(model, None)
+    else:
+        _inference_configs[model] = config
+
+
+def get_inference_config(model) -> Optional[InferenceConfig]:
+    return _inference_configs.get(model)
+
+
+def predict_probabilities(model, X, batch_size=None):
+    """
+    Softmax probabilities of model over the rows of X, in chunks of batch_size rows.
+    batch_size defaults to the model's InferenceConfig (set_inference_config), else DEFAULT_BATCH_SIZE.
+    """
+    config = _inference_configs.get(model)
+    if batch_size is None:
+        batch_size = config.batch_size if config is not None else DEFAULT_BATCH_SIZE
 
     model.eval()
-    device = next(model.parameters()).device
+    # int8 dynamic-quantized models keep packed weights, not parameters (and run on CPU)
+    parameter = next(model.parameters(), None)
+    device = parameter.device if parameter is not None else torch.device("cpu")
     X_tensor = torch.from_numpy(X).float().to(device)
 
     probs_list = []
@@ -149,21 +651,56 @@ def predict_probabilities(model, X, batch_size=4096):
 
 
 def load_model(model_class, model_path, *args, **kwargs):
+    """
+    Load a trained model for inference.
+    - state_dict checkpoints (*.pth): model_class(*args, **kwargs) with the weights loaded
+    - TorchScript exports (*.ts, see model_export.py): loaded as-is, model_class and args are not used
+    """
+    if str(model_path).endswith(TORCHSCRIPT_SUFFIX):
+        model = torch.jit.load(model_path, map_location=torch.device("cpu"))
+        model.eval()
+        return model
     model = model_class(*args, **kwargs)
     state_dict = torch.load(model_path, map_location=torch.device("cpu"))
     model.load_state_dict(state_dict)
     model.eval()
     return model
 
+def quantize_model(model):
+    """
+    int8 dynamic quantization of every nn.Linear (int8 weights, activations quantized per call), CPU only.
+    Needs a fixed-step solver: quantization noise in the ODE function keeps adaptive solvers
+    shrinking their step size. TorchScript exports are quantized at export time (model_export.py --int8).
+    """
+    if isinstance(model, torch.jit.ScriptModule):
+        raise ValueError("TorchScript models cannot be quantized after export; use model_export.py --int8")
+    solver = getattr(model, "solver", None)
+    if solver is not None and not solver.fixed_step:
+        raise ValueError(f"int8 models need a fixed-step ODE solver (e.g. rk4:4), got {solver}")
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+def load_checkpoint(model_path, solver=None):
+    """Rebuild NODEModel / HybridNODEAttentionModel from a state_dict checkpoint, sizes read from the weights."""
+    state_dict = torch.load(model_path, map_location=torch.device("cpu"))
+    model_class = HybridNODEAttentionModel if "attn.query.weight" in state_dict else NODEModel
+    dim = state_dict["odefunc.net.0.weight"].shape[1]
+    num_classes = state_dict["classifier.2.weight"].shape[0]
+    model = model_class(dim, num_classes, solver=solver)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
 def compute_rr_features(rr):
-    rr = np.array(rr)
+    # cleaned RR is only NaN when no beat was in range
+    rr = np.asarray(rr, dtype=np.float64)
+    rr = rr[np.isfinite(rr)]
 
-    # Mean RR interval in milliseconds
-    mean_rr = float(np.mean(rr))
+    # Mean RR interval in milliseconds (None without beats: NaN is not valid JSON)
+    mean_rr = float(np.mean(rr)) if rr.size else None
 
     # Estimated heart rate (BPM)
     # HR (bpm) = 60000 ms per minute / mean RR (ms)
-    estimated_hr_bpm = float(60000.0 / mean_rr) if mean_rr > 0 else None
+    estimated_hr_bpm = float(60000.0 / mean_rr) if mean_rr is not None and mean_rr > 0 else None
 
     return {
         "mean_rr": mean_rr,
@@ -171,11 +708,35 @@ def compute_rr_features(rr):
     }
 
 
+@dataclass
+class RRSummary:
+    """Running accumulator for compute_rr_features over a series read in chunks."""
+    count: int = 0
+    total: float = 0.0
+
+    def update(self, rr):
+        rr = np.asarray(rr, dtype=np.float64)
+        rr = rr[np.isfinite(rr)]
+        self.count += len(rr)
+        self.total += float(rr.sum())
+        return self
+
+    def features(self):
+        mean_rr = self.total / self.count if self.count else None
+        return {
+            "mean_rr": mean_rr,
+            "estimated_hr_bpm": float(60000.0 / mean_rr) if mean_rr is not None and mean_rr > 0 else None,
+        }
+
+
 class ReportRequest(BaseModel):
     record_id: str
     task_type: Literal["early_prediction", "af_detection"]
     decision: str
     prob_af: float
-    rr_features: Dict[str, float]
+    rr_features: Dict[str, Optional[float]]
     timestamp: Optional[str] = None
+    # model that produced prob_af (default: the task's default model) / explicit decision threshold
+    model: Optional[str] = None
+    threshold: Optional[float] = None
 
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# Bump when Record RR cleaning changes, so old entries are never served
+CLEANING_VERSION = b"clean_rr-v1"
+
+
+def _source_bytes(source) -> bytes:
+    """
+    Raw bytes of a record file: a Path or an archive member (zip_ingest.ZipMember).
+    Members keep the bytes until release(), for loading the record after a miss.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return Path(source).read_bytes()
+    return source.read(keep=True)
+
+
+class PreprocessCache:
+    """
+    Content-addressed cache of cleaned RR series, keyed by a hash of the record's
+    RR file bytes (see key_for). Re-uploads of the same files skip loading and cleaning.
+    - Memory tier: LRU bounded by max_bytes
+    - Optional disk tier (.npy per entry in disk_dir): LRU by mtime, bounded by disk_max_bytes
+    PSR windows are not stored: build_psr_windows re-derives them from the RR with one
+    strided copy, which is the same work as copying cached windows into the batch.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, disk_dir=None, disk_max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(rr_files) -> str:
+        hasher = hashlib.blake2b(CLEANING_VERSION, digest_size=20)
+        for source in rr_files:
+            data = _source_bytes(source)
+            hasher.update(len(data).to_bytes(8, "little"))
+            hasher.update(data)
+        return hasher.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            rri = self._entries.get(key)
+            if rri is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return rri
+
+        rri = self._disk_get(key)
+        with self._lock:
+            if rri is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._memory_put(key, rri)
+        return rri
+
+    def put(self, key, rri):
+        rri = np.asarray(rri)
+        rri.setflags(write=False)
+        self._memory_put(key, rri)
+        self._disk_put(key, rri)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": str(self.disk_dir) if self.disk_dir else None,
+            }
+
+    def _memory_put(self, key, rri):
+        if rri.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = rri
+            self._bytes += rri.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _disk_path(self, key):
+        return self.disk_dir / f"{key}.npy"
+
+    def _disk_get(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            rri = np.load(path)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        rri.setflags(write=False)
+        return rri
+
+    def _disk_put(self, key, rri):
+        if self.disk_dir is None or rri.nbytes > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        if path.exists():
+            return
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, rri)
+        os.replace(tmp_path, path)
+        self._disk_evict()
+
+    def _disk_evict(self):
+        files = []
+        for path in self.disk_dir.glob("*.npy"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda f: f[0]):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,132 @@
+import io
+import posixpath
+import zipfile
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+from Dataset_preparation.record import RecordFiles
+
+
+def record_id_for(member_name: str) -> str:
+    """
+    Work out which record an archive member belongs to.
+    Nested:  record_022/record_022_rr_00.h5 -> record_022 (parent folder)
+    Flat:    record_022_rr_00.h5           -> record_022 (first two name parts)
+    """
+    parent = posixpath.basename(posixpath.dirname(member_name))
+    if parent:
+        return parent.strip()
+    return "_".join(posixpath.basename(member_name).split("_")[:2]).strip()
+
+
+class ZipMember:
+    """
+    One file inside an uploaded ZIP. Record reads it through open(), which
+    returns an in-memory copy so h5py / pandas can seek without touching disk.
+    read(keep=True) keeps the inflated bytes on the member until release(), so a member
+    hashed for the preprocessing cache is not inflated again when the record is loaded.
+    """
+
+    def __init__(self, zf: zipfile.ZipFile, member_name: str):
+        self.zf = zf
+        self.member_name = member_name
+        self.data = None
+
+    @property
+    def name(self) -> str:
+        return posixpath.basename(self.member_name)
+
+    def read(self, keep=False) -> bytes:
+        if self.data is not None:
+            return self.data
+        data = self.zf.read(self.member_name)
+        if keep:
+            self.data = data
+        return data
+
+    def release(self):
+        if self.zf is not None:
+            self.data = None
+
+    def open(self) -> io.BytesIO:
+        return io.BytesIO(self.read())
+
+    def __getstate__(self):
+        # Sent to preprocessing worker processes: ship the bytes, not the open ZipFile
+        return {"member_name": self.member_name, "data": self.read()}
+
+    def __setstate__(self, state):
+        self.zf = None
+        self.member_name = state["member_name"]
+        self.data = state["data"]
+
+    def __repr__(self):
+        return f"ZipMember({self.member_name!r})"
+
+
+class ZipRecords:
+    """
+    Record index over an open ZipFile, built in one pass over the central
+    directory (nothing is inflated): records maps record_id -> RecordFiles.
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.zf = zf
+        self.records = {}
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            if info.is_dir():
+                continue
+            files = self.records.setdefault(record_id_for(info.filename), RecordFiles())
+            files.add(posixpath.basename(info.filename), ZipMember(zf, info.filename))
+
+    def record_ids(self):
+        return sorted(self.records)
+
+    def close(self):
+        self.zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject request bodies larger than max_bytes with 413.
+    - A declared Content-Length is checked before any body bytes are read
+    - Chunked uploads are counted as they stream in and stopped at the cap
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _too_large(self):
+        return f"Upload exceeds the maximum allowed size of {self.max_bytes} bytes."
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({"detail": self._too_large()}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._too_large())
+            return message
+
+        await self.app(scope, limited_receive, send)